@@ -0,0 +1,203 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import json
+import logging
+import threading
+import time
+import requests
+from ratelimit import TokenBucket
+from storage import atomic_write_json
+from transport import Transport
+
+
+class ArchiveBackfiller:
+    """
+    Capture the final state of archived threads. The archive.json of a board lists the threads that left the board
+    and were archived, every listed thread that is not in the finalized area yet is downloaded by a pool of worker
+    threads that take their tokens from the shared rate limiter, and written to data/finalized/<board>, apart from the
+    live saves. Progress is kept in a checkpoint file, so an interrupted backfill resumes where it stopped.
+    Next to a live crawl it runs in its own background thread, see start, so the crawl never waits for it
+    """
+    def __init__(self, transport, rate_limiter, logger, base_save_path: Path, max_workers: int = 4, checkpoint_path: Path = None, backfill_interval: float = 3600, retry_delay: float = 5):
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.logger = logger
+        self.base_save_path = Path(base_save_path)
+        self.max_workers = max_workers
+        self.backfill_interval = backfill_interval
+        self.retry_delay = retry_delay # seconds before the second attempt of a failed thread, then twice as long
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path is not None else self.base_save_path / "state" / "backfill_checkpoint.json"
+        self.checkpoint = self._load_checkpoint()
+        self._last_backfill = {} # board code -> time of its last backfill in this run
+        self._closed = threading.Event()
+        self._thread = None
+
+    def get_finalized_path(self, board_code):
+        """
+        :return: folder of the finalized threads of a board
+        """
+        return self.base_save_path / "finalized" / board_code
+
+    def run_due(self, board_codes):
+        """Backfill the boards that were not backfilled in the last backfill_interval seconds
+
+        :return: number of threads finalized
+        """
+        now = time.time()
+        finalized_count = 0
+        for board_code in board_codes:
+            if self._closed.is_set():
+                break
+            if now - self._last_backfill.get(board_code, 0) >= self.backfill_interval:
+                finalized_count += self.backfill_board(board_code)
+        return finalized_count
+
+    def start(self, get_board_codes, check_interval: float = 60):
+        """
+        Backfill the due boards in a background thread, the board codes are taken from get_board_codes() every
+        check_interval seconds, so boards added to a running crawl are backfilled too
+        """
+        self._thread = threading.Thread(target=self._run_periodically, args=(get_board_codes, check_interval), name="ArchiveBackfiller", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stop the background thread after the requests in flight, threads not finalized yet are backfilled in the next run
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def backfill_board(self, board_code):
+        """Download every archived thread of the board that was not finalized yet
+
+        :return: number of threads finalized
+        """
+        self._last_backfill[board_code] = time.time()
+        archived_thread_ids = self.get_archived_thread_ids(board_code)
+        if archived_thread_ids is None:
+            return 0
+
+        finalized_path = self.get_finalized_path(board_code)
+        finalized_path.mkdir(parents=True, exist_ok=True)
+        board_checkpoint = self.checkpoint.setdefault(board_code, {"finalized": [], "missing": []})
+        done_thread_ids = set(board_checkpoint["finalized"]) | set(board_checkpoint["missing"])
+        # files written after the last checkpoint of an interrupted run count as done too
+        done_thread_ids.update(saved_path.stem for saved_path in finalized_path.glob("*.json"))
+        thread_ids = [thread_id for thread_id in archived_thread_ids if thread_id not in done_thread_ids]
+        self.logger.info(f"Backfilling /{board_code}/: {len(thread_ids)} of {len(archived_thread_ids)} archived threads are not finalized yet")
+
+        finalized_count = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._finalize_thread, board_code, thread_id): thread_id for thread_id in thread_ids}
+            for done, future in enumerate(as_completed(futures), start=1):
+                thread_id = futures[future]
+                try:
+                    finalized = future.result()
+                except Exception:
+                    self.logger.exception(f"Unexpected error when finalizing thread {thread_id} on board /{board_code}/")
+                    continue
+                if finalized is None:
+                    continue # failed, tried again on the next backfill
+                board_checkpoint["finalized" if finalized else "missing"].append(thread_id)
+                finalized_count += int(finalized)
+                if done % 50 == 0:
+                    self.logger.info(f"Backfilling /{board_code}/: {done}/{len(thread_ids)} threads done")
+                    self._save_checkpoint()
+
+        # threads that fell out of the archive will never be listed again
+        archived = set(archived_thread_ids)
+        board_checkpoint["finalized"] = [thread_id for thread_id in board_checkpoint["finalized"] if thread_id in archived]
+        board_checkpoint["missing"] = [thread_id for thread_id in board_checkpoint["missing"] if thread_id in archived]
+        self._save_checkpoint()
+        self.logger.info(f"Backfilled /{board_code}/: {finalized_count} threads finalized")
+        return finalized_count
+
+    def get_archived_thread_ids(self, board_code):
+        """
+        :return: ids of the archived threads of the board, None if the board has no archive
+        """
+        self.rate_limiter.acquire()
+        try:
+            request_response = self.transport.get(self.transport.endpoints.archive(board_code), "archive")
+        except requests.RequestException as e:
+            self.logger.error(f"Error when trying to fetch the archive of /{board_code}/, skipping backfill: {e}")
+            return None
+        if request_response.status_code != 200:
+            self.logger.info(f"No archive for /{board_code}/ (status {request_response.status_code}), skipping backfill")
+            return None
+        return [str(thread_id) for thread_id in request_response.json()]
+
+    def _finalize_thread(self, board_code, thread_id):
+        """Download one archived thread into the finalized area
+
+        :return: True when saved, False when the thread is gone, None when the request kept failing
+        """
+        thread_api_address = self.transport.endpoints.thread_content(board_code, thread_id)
+        for attempt in range(3):
+            if attempt > 0:
+                self._closed.wait(self.retry_delay * attempt)
+            if self._closed.is_set():
+                return None
+            self.rate_limiter.acquire()
+            try:
+                request_response = self.transport.get(thread_api_address, "archive_thread")
+            except requests.RequestException as e:
+                self.logger.warning(f"Request for archived thread /{board_code}/{thread_id} failed: {e}, attempt {attempt + 1}")
+                continue
+            if request_response.status_code == 200:
+                atomic_write_json(self.get_finalized_path(board_code) / f"{thread_id}.json", request_response.json(), indent=2)
+                return True
+            if request_response.status_code == 404:
+                self.logger.debug("Archived thread /%s/%s is gone", board_code, thread_id)
+                return False
+            self.logger.warning(f"Request for archived thread /{board_code}/{thread_id} failed with error code {request_response.status_code}, attempt {attempt + 1}")
+        return None
+
+    def _run_periodically(self, get_board_codes, check_interval):
+        while True:
+            try:
+                self.run_due(get_board_codes())
+            except Exception:
+                self.logger.exception("Archive backfill failed")
+            if self._closed.wait(check_interval):
+                return
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path.exists():
+            return {}
+        with open(self.checkpoint_path, "r") as infile:
+            return json.load(infile)
+
+    def _save_checkpoint(self):
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(self.checkpoint_path, self.checkpoint)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Download the final state of the archived threads of boards into data/finalized")
+    argparser.add_argument("boards", type=str, nargs="+", help="Board codes to backfill, e.g. 'po' 'g'")
+    argparser.add_argument("--workers", type=int, default=4, help="Number of parallel downloads (default: 4)")
+    argparser.add_argument(
+        "--request-time-limit",
+        type=float,
+        default=1,
+        help="Minimum time in seconds between requests (default: 1)",
+    )
+    argparser.add_argument(
+        "--data-path",
+        type=str,
+        default=str(Path(__file__).resolve().parents[1] / "data"),
+        help="Path of the data folder (default: 'data' in the 4CTC repo folder)",
+    )
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s: %(message)s")
+    transport = Transport(pool_maxsize=args.workers)
+    backfiller = ArchiveBackfiller(transport, TokenBucket(max(args.request_time_limit, 1)), logging.getLogger("backfill"), Path(args.data_path), args.workers)
+    try:
+        for board_code in args.boards:
+            backfiller.backfill_board(board_code)
+    finally:
+        transport.close()
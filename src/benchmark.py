@@ -0,0 +1,120 @@
+from pathlib import Path
+import argparse
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import tempfile
+import time
+from mock_api import MockApiServer, add_mock_api_arguments, get_mock_api_settings
+from utils import get_argparser, get_optional_settings
+
+
+def run_scraper(requester_settings, usage_connection, show_log=False):
+    """
+    Run the Requester until it is interrupted with SIGINT, then send the resource usage of this process back.
+    Meant to be the target of a separate process, so the measured CPU time and memory are the scraper's own
+    """
+    if not show_log:
+        sys.stdout = sys.stderr = open(os.devnull, "w")
+    from requester import Requester
+    try:
+        Requester(**requester_settings)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # ru_maxrss is in kilobytes on Linux
+        usage_connection.send({"cpu_seconds": usage.ru_utime + usage.ru_stime, "peak_rss_bytes": usage.ru_maxrss * 1024})
+        usage_connection.close()
+
+
+def run_benchmark(duration, mock_api_settings, scraper_settings, request_time_limit=0.01, output_path=None, show_log=False):
+    """Run the real scraping pipeline against a local mock API for a fixed time
+
+    :param scraper_settings: optional Requester settings, see utils.OPTIONAL_CONFIG_DEFAULTS
+    :return: dictionary of the measured results
+    """
+    mock_api = MockApiServer(**mock_api_settings).start()
+    with tempfile.TemporaryDirectory() as temporary_path:
+        output_path = output_path or temporary_path
+        requester_settings = {
+            **scraper_settings,
+            "boards": [],
+            "request_time_limit": request_time_limit,
+            "output_path": output_path,
+            "save_log": False,
+            "clean_log": False,
+            "api_base_url": mock_api.api_base_url,
+            "media_base_url": mock_api.api_base_url,
+        }
+
+        # spawn, so the scraper does not inherit the memory of the mock API
+        context = multiprocessing.get_context("spawn")
+        usage_receiver, usage_sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_scraper, args=(requester_settings, usage_sender, show_log))
+        start_time = time.time()
+        process.start()
+        time.sleep(duration)
+        os.kill(process.pid, signal.SIGINT)
+        process.join(timeout=60)
+        elapsed = time.time() - start_time
+        usage = usage_receiver.recv() if usage_receiver.poll(5) else {}
+        if process.is_alive():
+            process.kill()
+        mock_api.close()
+
+        data_path = Path(output_path) / "data"
+        bytes_written = sum(
+            file_path.stat().st_size for file_path in data_path.rglob("*")
+            if file_path.is_file() and file_path.relative_to(data_path).parts[0] != "log"
+        )
+
+    return {
+        "seconds": elapsed,
+        "threads_per_second": mock_api.count_requests("thread", 200) / elapsed,
+        "requests_per_second": mock_api.count_requests() / elapsed,
+        "not_modified_responses": mock_api.count_requests(status_code=304),
+        "bytes_sent": mock_api.bytes_sent,
+        "bytes_written": bytes_written,
+        "cpu_seconds": usage.get("cpu_seconds"),
+        "peak_rss_bytes": usage.get("peak_rss_bytes"),
+    }
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Measure the scraper against a local mock API. Scraper flags can be given after '--', "
+                    "e.g. 'python src/benchmark.py --duration 60 -- --async-fetch --storage-mode append'"
+    )
+    argparser.add_argument("--duration", type=float, default=60, help="Seconds to run the scraper for (default: 60)")
+    argparser.add_argument(
+        "--request-time-limit",
+        type=float,
+        default=0.01,
+        help="Minimum time between requests of the scraper, below the API rule as only the mock API is requested (default: 0.01)",
+    )
+    argparser.add_argument("--output-path", type=str, default=None, help="Keep the scraped data in this folder (default: a temporary folder)")
+    argparser.add_argument("--show-log", action="store_true", help="If provided, the log of the scraper is printed")
+    add_mock_api_arguments(argparser)
+
+    arguments = sys.argv[1:]
+    scraper_arguments = []
+    if "--" in arguments:
+        scraper_arguments = arguments[arguments.index("--") + 1:]
+        arguments = arguments[:arguments.index("--")]
+    args = argparser.parse_args(arguments)
+    scraper_settings = get_optional_settings(get_argparser().parse_args(scraper_arguments))
+
+    results = run_benchmark(
+        args.duration, get_mock_api_settings(args), scraper_settings, args.request_time_limit, args.output_path, args.show_log
+    )
+    print(f"Duration:         {results['seconds']:.1f} s")
+    print(f"Threads captured: {results['threads_per_second']:.2f} /s")
+    print(f"Requests:         {results['requests_per_second']:.2f} /s ({results['not_modified_responses']} answered 304)")
+    print(f"Bytes received:   {results['bytes_sent']}")
+    print(f"Bytes written:    {results['bytes_written']}")
+    if results["cpu_seconds"] is not None:
+        print(f"CPU time:         {results['cpu_seconds']:.2f} s")
+        print(f"Peak RSS:         {results['peak_rss_bytes'] / 1024 / 1024:.1f} MB")
@@ -1,16 +1,22 @@
 from pathlib import Path
 import time
 from datetime import datetime, timedelta
-import requests
 import json
-import os
+import queue
+import requests
+from compaction import read_latest_thread_list
+from profiler import StageTimer, timed_stage
+from rawjson import RawJson, load_json, read_post_numbers, read_thread_list_entries
+from retry import CircuitBreaker
+from storage import create_thread_store
+from transport import Transport
 from utils import get_time, get_day
 
 class Board:
     """
     This is a board object that handles the request, saving, tracking to a particular board
     """
-    def __init__(self, board_code, logger):
+    def __init__(self, board_code, logger, transport=None, base_save_path=None, state_store=None, storage_mode="snapshot", writer=None, storage_options=None, search_index=None, min_poll_interval=10, max_poll_interval=300, catalog_delta=False, checkpoint_state=None, post_stream=None, retry_queue=None, circuit_breaker=None, trace_recorder=None, stage_timer=None, raw_passthrough=False, media_fetcher=None):
 
         # Board Code
         self.board_code = board_code
@@ -18,32 +24,149 @@ class Board:
         # Logger
         self.logger = logger
 
-        # API address
-        self.thread_list_api = f'https://a.4cdn.org/{self.board_code}/threads.json' #TODO import from static definitions
-        self.thread_content_api_prefix = f'https://a.4cdn.org/{self.board_code}/thread' #TODO +/op_id +.json import from static definitions
+        # HTTP transport, normally shared with the Requester and all other boards
+        self.transport = transport if transport is not None else Transport()
+
+        # API address, the catalog is a thread list that also carries the opening post and last replies of every thread
+        self.catalog_delta = catalog_delta
+        if catalog_delta:
+            self.thread_list_api = self.transport.endpoints.catalog(self.board_code)
+        else:
+            self.thread_list_api = self.transport.endpoints.thread_list(self.board_code)
         
         # Saving paths
-        self.base_save_path = Path().resolve() / "data"
-        self.update_saving_folder_info()
+        self._saving_folder_day = None
+        self.base_save_path = Path(base_save_path) if base_save_path is not None else Path().resolve() / "data"
+        self.storage_mode = storage_mode
+        self.storage_options = storage_options or {}
+        self.thread_store = None # created by initialize
+        self.writer = writer # background writer shared by all boards, None writes inline
+        self.search_index = search_index # full-text index of captured posts, None disables live indexing
+        self.post_stream = post_stream # stream of newly captured posts for consumers, None disables streaming
+        self.media_fetcher = media_fetcher # downloads the files of newly captured posts, None disables media capture
+        self.raw_passthrough = raw_passthrough # keep threads and thread lists as the response bytes instead of parsing them
+        self.trace_recorder = trace_recorder # keeps every thread list for the crawl simulator, None keeps only the latest
+
+        # Failed requests wait in the retry queue shared by all boards, None gives them up right away. The circuit
+        # breaker pauses the board while the API keeps failing for it
+        self.retry_queue = retry_queue
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker(f"/{board_code}/", logger)
+        self.retry_attempts = {} # failed attempts of each thread waiting for a retry
+
+        # Time spent in the stages of the crawl, normally shared with the Requester and all other boards
+        self.stage_timer = stage_timer if stage_timer is not None else StageTimer()
+
+        # Persistent crawl state, None keeps the state in memory only
+        self.state_store = state_store
 
         # For data request interval
         self.thread_list_last_request = None
         self.thread_content_last_request = {} # Its only useful for adding headers for thread content API
+        self.thread_list_validators = (None, None) # Last-Modified and ETag of the last thread list response
+        self.thread_validators = {} # Last-Modified and ETag of the last response for each thread
         self.thread_list_request_interval = 10 #TODO Static?
         self.thread_content_request_interval = 1 #TODO Static?
 
+        # Board activity, used to poll busy boards more often than quiet ones
+        self.min_poll_interval = max(min_poll_interval, self.thread_list_request_interval)
+        self.max_poll_interval = max(max_poll_interval, self.min_poll_interval)
+        self.target_changes_per_poll = 5 # a poll interval is aimed at this many births, deaths and updates
+        self.activity = None # smoothed births, deaths and updates per second, None until two thread lists were seen
+        self._last_activity_update = None
+        self.change_counts = {"birth": 0, "death": 0, "update": 0} # since start, for the metrics
+        self.last_sweep_seconds = None # duration of the last poll of the board including its fetches, set by the Requester
+
         # Not sure
         self.tracking_threads = {} # threads that are observed for their status including last update and death 
         self.online_threads = []
+        self.thread_positions = {} # position of each online thread, from 0 (top of page 1) to 1 (bottom of the last page)
+        self.reply_velocity = {} # smoothed replies per second of each online thread
+        self._reply_snapshots = {} # reply count and time of each online thread at the last thread list
+
+        # Catalog delta capture, small updates are taken from the last replies in the catalog instead of a full fetch
+        self.catalog_threads = {} # catalog entry of each online thread, from the last catalog
+        self.thread_tails = {} # last captured post number and captured reply count of each thread
+        self._full_capture_requests = queue.SimpleQueue() # threads the background writer could not add a delta to
+        self.delta_capture_count = 0
+        self.full_fetch_count = 0
+
+        # Saved state is loaded on the first use of the board, see initialize
+        self.initialized = False
+        self._checkpoint_state = checkpoint_state
+
+    def initialize(self):
+        """
+        Create the saving folders and the thread store and load the state of previous instances, from the checkpoint when
+        there is one, otherwise from the thread list snapshot and the crawl state store. Only the first call does anything,
+        so boards that are not polled yet cost nothing at startup
+        """
+        if self.initialized:
+            return
+        self.update_saving_folder_info()
+        self.thread_store = create_thread_store(self.storage_mode, self.board_code, self.base_save_path, self.logger, **self.storage_options)
+        if self._checkpoint_state is not None:
+            self.restore_checkpoint_state(self._checkpoint_state)
+            self._checkpoint_state = None
+        else:
+            self.get_previously_saved_info()
+            self.load_crawl_state()
+        self.initialized = True
 
-        # Load Saved Files
-        self.get_previously_saved_info()
+    def get_checkpoint_state(self):
+        """
+        :return: the tracking state of the board as JSON compatible dictionary, for CrawlCheckpoint
+        """
+        if not self.initialized:
+            # keep the state of a board that was not used since the restart
+            return self._checkpoint_state
+        # dict() copies in one step, the background writer may change these while the checkpoint is written
+        thread_content_last_request = dict(self.thread_content_last_request)
+        tracking_threads = dict(self.tracking_threads)
+        # the retry queue is not kept, threads waiting for a retry are saved as never fetched, so a restart fetches them
+        for thread_id in list(self.retry_attempts):
+            if thread_id in tracking_threads:
+                tracking_threads[thread_id] = [0, tracking_threads[thread_id][1]]
+        return {
+            "tracking_threads": tracking_threads,
+            "thread_content_last_request": {thread_id: time.mktime(last_request) for thread_id, last_request in thread_content_last_request.items()},
+            "thread_validators": dict(self.thread_validators),
+            "thread_tails": dict(self.thread_tails),
+            "thread_list_last_request": time.mktime(self.thread_list_last_request) if self.thread_list_last_request is not None else None,
+            "thread_list_validators": self.thread_list_validators,
+            "activity": self.activity,
+            "thread_positions": self.thread_positions,
+            "reply_velocity": self.reply_velocity,
+            "reply_snapshots": self._reply_snapshots,
+        }
+
+    def restore_checkpoint_state(self, checkpoint_state):
+        """
+        Take over the tracking state saved by get_checkpoint_state
+        """
+        self.tracking_threads = {thread_id: list(tracking) for thread_id, tracking in checkpoint_state["tracking_threads"].items()}
+        self.thread_content_last_request = {
+            thread_id: time.localtime(last_request) for thread_id, last_request in checkpoint_state["thread_content_last_request"].items()
+        }
+        self.thread_validators = {thread_id: tuple(validators) for thread_id, validators in checkpoint_state["thread_validators"].items()}
+        self.thread_tails = {thread_id: tuple(tail) for thread_id, tail in checkpoint_state["thread_tails"].items()}
+        if checkpoint_state["thread_list_last_request"] is not None:
+            self.thread_list_last_request = time.localtime(checkpoint_state["thread_list_last_request"])
+        self.thread_list_validators = tuple(checkpoint_state["thread_list_validators"])
+        self.activity = checkpoint_state["activity"]
+        self.thread_positions = checkpoint_state["thread_positions"]
+        self.reply_velocity = checkpoint_state["reply_velocity"]
+        self._reply_snapshots = {thread_id: tuple(snapshot) for thread_id, snapshot in checkpoint_state["reply_snapshots"].items()}
+        self.logger.debug(f"{len(self.tracking_threads)} threads of /{self.board_code}/ restored from the checkpoint")
 
     def update_saving_folder_info(self): #TODO, need to match the new logic where timestamp does not result duplicate file
         """
         Set up all the saving path in the class, this method is called repeatedly because save path is related to current timestamp
         """        
         timestamp = get_day()
+        if timestamp == self._saving_folder_day:
+            # folders were already created today
+            return
+        self._saving_folder_day = timestamp
         # #TODO, static and argument accept?
         self.thread_list_path = self.base_save_path / "saves" / timestamp / "threads_on_boards"
         self.thread_content_path = self.base_save_path / "saves" / timestamp / "threads" / self.board_code
@@ -55,55 +178,105 @@ class Board:
         Load previously saved data into the class to prevent downloading the same thread and help monitoring update
         """
         self.logger.debug("Checking for past captures of old threads in previous instances")
-        
-        for prev_thread_list_path in self.thread_list_path.iterdir(): # get file names inside the folder
-            if prev_thread_list_path.name.split("_")[0] == str(self.board_code): 
-                prev_thread_counts = 0
-                with open(prev_thread_list_path, "r") as prev_thread_list_file:
-                    prev_threads = json.load(prev_thread_list_file)
-                    for page in prev_threads:
-                        for threads in page["threads"]:
-                            self.tracking_threads[str(threads["no"])] = [int(threads["last_modified"]), int(threads["replies"])]
-                            prev_thread_counts += 1
-                self.logger.debug(f"{prev_thread_counts} past captures of old threads in previous instances of {self.board_code} discovered")
-                # old_monitor_dict will lookg like old_monitor_dict['po']['thread_no'] = [last modified, reply counts]
-                self.logger.debug(
-                    f"{prev_thread_counts} past captures of old threads in previous instances discovered"
-                )
-                return
+
+        # today's thread list, or the one of the last day before, so a restart after midnight does not request every thread again
+        prev_threads = read_latest_thread_list(self.base_save_path, self.board_code)
+        if prev_threads is not None:
+            prev_thread_counts = 0
+            for page in prev_threads:
+                for threads in page["threads"]:
+                    self.tracking_threads[str(threads["no"])] = [int(threads["last_modified"]), int(threads["replies"])]
+                    prev_thread_counts += 1
+            self.logger.debug(f"{prev_thread_counts} past captures of old threads in previous instances of {self.board_code} discovered")
+            # old_monitor_dict will lookg like old_monitor_dict['po']['thread_no'] = [last modified, reply counts]
+            self.logger.debug(
+                f"{prev_thread_counts} past captures of old threads in previous instances discovered"
+            )
+            return
 
         self.logger.info(f"No previous thread information for /{self.board_code}/, no old threads to monitor")        
 
+    def load_crawl_state(self):
+        """
+        Load the crawl state persisted by previous instances, so that requests are conditional right after a restart.
+        The persisted thread state replaces the one read from the thread list snapshot, because it only holds threads that were actually captured
+        """
+        if self.state_store is None:
+            return
+
+        board_state = self.state_store.load_board(self.board_code)
+        if board_state is not None:
+            self.thread_list_last_request = time.localtime(board_state["last_fetch"])
+            self.thread_list_validators = (board_state["http_last_modified"], board_state["etag"])
+
+        thread_states = self.state_store.load_threads(self.board_code)
+        if not thread_states:
+            return
+        self.tracking_threads = {}
+        for thread_id, thread_state in thread_states.items():
+            self.tracking_threads[thread_id] = [thread_state["last_modified"], thread_state["replies"]]
+            self.thread_content_last_request[thread_id] = time.localtime(thread_state["last_fetch"])
+            self.thread_validators[thread_id] = (thread_state["http_last_modified"], thread_state["etag"])
+            if thread_state["last_post_no"] is not None:
+                self.thread_tails[thread_id] = (thread_state["last_post_no"], thread_state["captured_replies"])
+        self.logger.debug(f"{len(thread_states)} threads of /{self.board_code}/ restored from the crawl state")
+
     def get_online_thread_list(self):
         """Request the list of thread IDs on the board
         :return: thread id list
         """
         #TODO this can probably be a class too because it can be written in the same way like get_thread_content
+        self.initialize()
+        if self.is_paused():
+            self.logger.debug(f"Board /{self.board_code}/ is paused, thread list not requested")
+            return None
         self.logger.debug(f"Board /{self.board_code}/ thread information requested")
-        if self.thread_list_last_request == None:
-            request_response = requests.get(self.thread_list_api)
-        else:
-            thread_list_request_interval = datetime.now() - datetime.fromtimestamp(time.mktime(self.thread_list_last_request)) 
-            if thread_list_request_interval < timedelta(seconds=10):
-                sleeping = 10 - thread_list_request_interval.total_seconds()
-                self.logger.info(f"Sleeping for {sleeping} seconds: time between requests for threads on board {self.board_code} too short")
-                time.sleep(sleeping)
-
-            last_modified_time_header = self._format_time_header(self.thread_list_last_request)
-            request_response = requests.get(self.thread_list_api, headers=last_modified_time_header)
+        endpoint = "catalog" if self.catalog_delta else "thread_list"
+        try:
+            if self.thread_list_last_request == None:
+                with self.stage_timer.span("fetch"):
+                    request_response = self.transport.get(self.thread_list_api, endpoint)
+            else:
+                thread_list_request_interval = datetime.now() - datetime.fromtimestamp(time.mktime(self.thread_list_last_request)) 
+                if thread_list_request_interval < timedelta(seconds=self.thread_list_request_interval):
+                    sleeping = self.thread_list_request_interval - thread_list_request_interval.total_seconds()
+                    self.logger.info(f"Sleeping for {sleeping} seconds: time between requests for threads on board {self.board_code} too short")
+                    with self.stage_timer.span("wait"):
+                        time.sleep(sleeping)
+
+                last_modified_time_header = self._conditional_headers(self.thread_list_last_request, self.thread_list_validators)
+                with self.stage_timer.span("fetch"):
+                    request_response = self.transport.get(self.thread_list_api, endpoint, headers=last_modified_time_header)
+        except requests.RequestException as e:
+            self.logger.error(f"Error when trying to fetch /{self.board_code}/: {e}")
+            self.circuit_breaker.record_failure()
+            return None
 
+        if request_response.status_code in [200, 304]:
+            self.circuit_breaker.record_success()
         if request_response.status_code == 200:
             self.thread_list_last_request = datetime.now().timetuple()
-            return request_response.json()
+            self.thread_list_validators = self._read_validators(request_response)
+            if self.state_store is not None:
+                self.state_store.record_board_fetch(self.board_code, time.mktime(self.thread_list_last_request), *self.thread_list_validators)
+            with self.stage_timer.span("parse"):
+                if self.catalog_delta:
+                    return self._read_catalog(request_response.json())
+                if self.raw_passthrough:
+                    return RawJson(request_response.content)
+                return request_response.json()
 
         if request_response.status_code == 304: 
             self.logger.info(f"No new threads on board /{self.board_code}/")
+            self._update_activity(0)
             return None
         
-        if request_response.status_code == 404: #TODO should probably implement retry mechanism, if the website is down our program is also down which is not good
-            self.logger.info(f"Error when trying to fetch /{self.board_code}/")
-            raise Exception(f"404 when trying to fetch /{self.board_code}/")
+        # the board is polled again on its next turn, until then the other boards go on
+        self.logger.error(f"Error when trying to fetch /{self.board_code}/, status code {request_response.status_code}")
+        self.circuit_breaker.record_failure()
+        return None
 
+    @timed_stage("write")
     def save_thread_list(self, thread_list):
         """Save the thread ID list in local directory
         """
@@ -118,63 +291,254 @@ class Board:
             if prev_thread_list_path.name.split("_")[0] == str(self.board_code): 
                 prev_thread_list_path.unlink()
         
-        with open(self.thread_list_path / filename, "w") as outfile:
-            json.dump(thread_list, outfile, indent=2)
+        if isinstance(thread_list, RawJson):
+            with open(self.thread_list_path / filename, "wb") as outfile:
+                outfile.write(thread_list.data)
+        else:
+            with open(self.thread_list_path / filename, "w") as outfile:
+                json.dump(thread_list, outfile, indent=2)
+        if self.trace_recorder is not None:
+            self.trace_recorder.record(self.board_code, thread_list)
 
     def get_thread_content(self, thread_id):
-        """Based on given thread ID, request the content of the thread
+        """Based on given thread ID, request the content of the thread once, a failed request is handed to the retry queue
 
         :return: thread content
         """        
-        thread_api_address = self.thread_content_api_prefix + "/" + str(thread_id) + ".json"
-
-        request_attempt = 0
-        request_response = None
-
-        while self._check_retry(request_response, thread_id, request_attempt) == True:
-            if thread_id not in self.thread_content_last_request:
-                # download thread content without header
-                request_response = requests.get(thread_api_address)
-                # record download time to thread_content_last_request if request is successful
-                if request_response.status_code in [200, 304]:
-                    self.thread_content_last_request[thread_id] = datetime.now().timetuple()
-            else:
-                # get last request time for this thread
-                last_modified_time_header = self._format_time_header(self.thread_content_last_request[thread_id])
-                # download thread content with header
-                request_response = requests.get(thread_api_address, headers=last_modified_time_header)
-                # record download time to thread_content_last_request if request is successful
-                if request_response.status_code in [200, 304]:
-                    self.thread_content_last_request[thread_id] = datetime.now().timetuple()
-
-            request_attempt += 1
-        time.sleep(self.thread_content_request_interval)
-        return request_response.json() if request_response is not None else None
+        request_response = self.request_thread_content(thread_id)
+        self._check_retry(request_response, thread_id)
+        with self.stage_timer.span("wait"):
+            time.sleep(self.thread_content_request_interval)
+        return self.read_thread_content(request_response)
+
+    def request_thread_content(self, thread_id):
+        """Send a single request for the content of the thread, with If-Modified-Since header if it was requested before
+
+        :return: request response, None if the request could not be sent
+        """
+        thread_api_address, headers = self.prepare_thread_request(thread_id)
+        try:
+            request_response = self.send_thread_request(thread_api_address, headers)
+        except requests.RequestException as e:
+            return self.record_thread_response(thread_id, None, e)
+        return self.record_thread_response(thread_id, request_response)
+
+    def prepare_thread_request(self, thread_id):
+        """
+        :return: (address, headers) of the request for the content of the thread, conditional if it was requested before
+        """
+        self.initialize()
+        thread_api_address = self.transport.endpoints.thread_content(self.board_code, thread_id)
+        if thread_id not in self.thread_content_last_request:
+            return thread_api_address, None
+        headers = self._conditional_headers(self.thread_content_last_request[thread_id], self.thread_validators.get(thread_id, (None, None)))
+        return thread_api_address, headers
+
+    def send_thread_request(self, thread_api_address, headers):
+        """Send a request made by prepare_thread_request. It only uses the transport and not the state of the board,
+        so it can run in another thread while the state is only changed by record_thread_response
+
+        :return: request response
+        """
+        with self.stage_timer.span("fetch"):
+            return self.transport.get(thread_api_address, "thread_content", headers=headers)
+
+    def record_thread_response(self, thread_id, request_response, error=None):
+        """Update the circuit breaker and the request state of the thread with the outcome of its request
+
+        :param error: exception of a request that could not be sent, request_response is None then
+        :return: request response, None if the request could not be sent
+        """
+        if error is not None:
+            self.logger.error(f"Request for thread {thread_id} on board /{self.board_code}/ failed: {error}")
+            self.circuit_breaker.record_failure()
+            return None
 
+        # a missing thread is not an error of the API
+        if request_response.status_code in [200, 304, 404]:
+            self.circuit_breaker.record_success()
+        else:
+            self.circuit_breaker.record_failure()
+
+        # record download time to thread_content_last_request if request is successful
+        if request_response.status_code in [200, 304]:
+            self.thread_content_last_request[thread_id] = datetime.now().timetuple()
+        if request_response.status_code == 200:
+            self.thread_validators[thread_id] = self._read_validators(request_response)
+        return request_response
+
+    @timed_stage("parse")
+    def read_thread_content(self, request_response):
+        """Read the thread content out of a response, only a 200 response carries content
+
+        :return: thread content, None for a missing, unchanged or failed request
+        """
+        if request_response is None or request_response.status_code != 200:
+            return None
+        if self.raw_passthrough:
+            return RawJson(request_response.content)
+        return request_response.json()
+
+    @timed_stage("write")
     def save_thread_content(self, thread_id, thread_content):
         """Save the thread content in local directory
         """
         if thread_content is None:
+            if thread_id in self.retry_attempts:
+                # saved once the retry succeeds
+                return
             self.logger.warning(f"Can't save board {self.board_code}, post {thread_id}, likely 404 during requesting, skip saving")
             return
 
-        self.update_saving_folder_info()
-        #TODO, need to match the new logic where timestamp does not result duplicate file
-        #TODO, static and argument accept?
-        filename = str(thread_id) + get_time() + ".json"
-        fullname = self.thread_content_path / filename
-
-        for saved_thread_path in self.thread_content_path.iterdir():
-            # check if the thread id is found in saved content, then delete it and save a new one
-            if int(saved_thread_path.name.split("_")[0]) == int(thread_id): 
-                #TODO this insure there is only one copy for one post, so date naming system needs to be changed
-                #TODO as well as moving dead threads to an fully saved folder
-                #TODO name the still tracking, saving folder as something like tracking saved
-                os.remove(saved_thread_path)
-            
-        with open(fullname, "w") as outfile:
-            json.dump(thread_content, outfile, indent=2)
+        post_numbers = read_post_numbers(thread_content)
+        if self.post_stream is not None or self.media_fetcher is not None:
+            # posts after the last captured one, the tail is replaced just below
+            last_post_no = self.thread_tails.get(thread_id, (0, 0))[0] or 0
+            if post_numbers and post_numbers[-1] > last_post_no:
+                new_posts = [post for post in load_json(thread_content)["posts"] if post["no"] > last_post_no]
+                if self.post_stream is not None:
+                    self.post_stream.publish(self.board_code, thread_id, new_posts)
+                if self.media_fetcher is not None:
+                    self.media_fetcher.publish(self.board_code, thread_id, new_posts)
+        if post_numbers:
+            self.thread_tails[thread_id] = (post_numbers[-1], len(post_numbers) - 1)
+
+        # the state is taken now, the write itself may happen later in the background writer
+        thread_state = self._get_thread_state(thread_id)
+        if self.writer is not None:
+            self.writer.submit(self._store_thread_content, thread_id, thread_content, thread_state)
+        else:
+            self._store_thread_content(thread_id, thread_content, thread_state)
 
+    def _store_thread_content(self, thread_id, thread_content, thread_state):
+        """
+        Write the thread content, then record its state in the crawl state store, so the state never runs ahead of the saved data
+        """
+        self.thread_store.save_thread(thread_id, thread_content)
+        if thread_state is not None:
+            self.state_store.record_thread_fetch(self.board_code, thread_id, *thread_state)
+        if self.search_index is not None:
+            self.search_index.add_thread(self.board_code, thread_content)
+
+    def capture_from_catalog(self, thread_ids):
+        """Capture the updates of threads that can be completed with the last replies shown in the catalog
+
+        :return: thread ids that still need a full fetch
+        """
+        threads_to_fetch = []
+        for thread_id in thread_ids:
+            delta = self._get_catalog_delta(thread_id)
+            if delta is None:
+                threads_to_fetch.append(thread_id)
+                continue
+            opening_post, new_posts = delta
+            self.save_thread_delta(thread_id, opening_post, new_posts)
+
+        captured_count = len(thread_ids) - len(threads_to_fetch)
+        self.delta_capture_count += captured_count
+        self.full_fetch_count += len(threads_to_fetch)
+        self.logger.info(f"{captured_count} thread updates on /{self.board_code}/ captured from the catalog, {len(threads_to_fetch)} need a full fetch")
+        return threads_to_fetch
+
+    @timed_stage("write")
+    def save_thread_delta(self, thread_id, opening_post, new_posts):
+        """
+        Save new posts of a thread that were captured without fetching the full thread
+        """
+        _, captured_replies = self.thread_tails[thread_id]
+        self.thread_tails[thread_id] = (new_posts[-1]["no"], captured_replies + len(new_posts))
+        if self.post_stream is not None:
+            self.post_stream.publish(self.board_code, thread_id, new_posts)
+        if self.media_fetcher is not None:
+            self.media_fetcher.publish(self.board_code, thread_id, new_posts)
+
+        thread_state = self._get_thread_state(thread_id)
+        if self.writer is not None:
+            self.writer.submit(self._store_thread_delta, thread_id, opening_post, new_posts, thread_state)
+        else:
+            self._store_thread_delta(thread_id, opening_post, new_posts, thread_state)
+
+    def _store_thread_delta(self, thread_id, opening_post, new_posts, thread_state):
+        """
+        Add the new posts to the stored thread, a thread the store cannot add them to is fully fetched after the next thread list
+        """
+        if not self.thread_store.append_posts(thread_id, opening_post, new_posts):
+            self.logger.info(f"No stored capture of /{self.board_code}/{thread_id} to add {len(new_posts)} posts to, requesting a full fetch")
+            # this may run on the writer thread, the capture state is only changed by the crawl thread
+            self._full_capture_requests.put(thread_id)
+            return
+        if thread_state is not None:
+            self.state_store.record_thread_fetch(self.board_code, thread_id, *thread_state)
+        if self.search_index is not None:
+            self.search_index.add_thread(self.board_code, {"posts": [opening_post] + new_posts})
+
+    def _get_catalog_delta(self, thread_id):
+        """The last replies in the catalog close the gap to our capture when they reach back to the last captured post
+        and account for every new reply, which also rules out deletions since the capture
+
+        :return: (opening post, new posts), None if the thread needs a full fetch
+        """
+        catalog_thread = self.catalog_threads.get(thread_id)
+        if catalog_thread is None or thread_id not in self.thread_tails:
+            return None
+        last_post_no, captured_replies = self.thread_tails[thread_id]
+
+        last_replies = catalog_thread.get("last_replies", [])
+        new_posts = [post for post in last_replies if post["no"] > last_post_no]
+        if not new_posts or catalog_thread["replies"] - captured_replies != len(new_posts):
+            return None
+        if len(last_replies) < catalog_thread["replies"]:
+            # the post right before the new ones has to be our last captured post
+            if len(last_replies) == len(new_posts) or last_replies[-len(new_posts) - 1]["no"] != last_post_no:
+                return None
+
+        opening_post = {
+            key: value for key, value in catalog_thread.items()
+            if key not in ("last_replies", "last_modified", "omitted_posts", "omitted_images")
+        }
+        return opening_post, new_posts
+
+    def _apply_full_capture_requests(self):
+        """
+        Forget the capture state of the threads the store could not add a delta to, so this thread list schedules a full fetch of them
+        """
+        while True:
+            try:
+                thread_id = self._full_capture_requests.get_nowait()
+            except queue.Empty:
+                return
+            self.thread_tails.pop(thread_id, None)
+            if thread_id in self.tracking_threads:
+                self.tracking_threads[thread_id] = [0, self.tracking_threads[thread_id][1]]
+
+    def _read_catalog(self, catalog):
+        """Keep the catalog entry of every thread for delta capture
+
+        :return: the catalog reduced to the format of the thread list
+        """
+        self.catalog_threads = {}
+        thread_list = []
+        for page in catalog:
+            threads = []
+            for thread in page["threads"]:
+                self.catalog_threads[str(thread["no"])] = thread
+                threads.append({"no": thread["no"], "last_modified": thread["last_modified"], "replies": thread["replies"]})
+            thread_list.append({"page": page["page"], "threads": threads})
+        return thread_list
+
+    def _get_thread_state(self, thread_id):
+        """
+        :return: arguments for CrawlStateStore.record_thread_fetch, None if there is no state store
+        """
+        if self.state_store is None or thread_id not in self.tracking_threads:
+            return None
+        last_modified, replies = self.tracking_threads[thread_id]
+        http_last_modified, etag = self.thread_validators.get(thread_id, (None, None))
+        last_fetch = time.mktime(self.thread_content_last_request[thread_id])
+        last_post_no, captured_replies = self.thread_tails.get(thread_id, (None, None))
+        return (last_modified, replies, last_fetch, http_last_modified, etag, last_post_no, captured_replies)
+
+    @timed_stage("diff")
     def get_threads_to_update(self, online_threads):
         """Comapre the currently tracking thread and the thread online, see if there are thread die out or require update
         :return: thread list require update (download)
@@ -185,13 +549,15 @@ class Board:
         birth_count = 0 # added new board's each thread or thread id does not exist in the previously saved id (monitoring_threads), but id exist in the currently extracted threadlist, meaning its a new thread
         update_count = 0 # when thread in threadlist matches id on monitoring_threads, and its last update is newer, then update it
         
+        self._apply_full_capture_requests()
         online_threads = self._process_online_threads(online_threads) # basically the current threads on board
+        self._update_thread_activity(online_threads)
 
         # Check if any tracking thread is dead(disappeared) online
         dead_thread_ids = []
         for thread_id in self.tracking_threads:
             if thread_id not in online_threads:
-                self.logger.debug(f"Thread died: /{self.board_code}/{thread_id}")
+                self.logger.debug("Thread died: /%s/%s", self.board_code, thread_id)
                 death_count += 1
                 dead_thread_ids.append(thread_id)
         
@@ -200,22 +566,31 @@ class Board:
             del self.tracking_threads[dead_thread_id]
             if dead_thread_id in self.thread_content_last_request:
                 del self.thread_content_last_request[dead_thread_id]
+            self.thread_validators.pop(dead_thread_id, None)
+            self.thread_tails.pop(dead_thread_id, None)
+            self.retry_attempts.pop(dead_thread_id, None)
+            if self.writer is not None:
+                self.writer.submit(self.thread_store.mark_thread_dead, dead_thread_id)
+            else:
+                self.thread_store.mark_thread_dead(dead_thread_id)
+        if self.state_store is not None:
+            self.state_store.remove_threads(self.board_code, dead_thread_ids)
 
         for thread_id in online_threads:
             if thread_id in self.tracking_threads:
                 # online thread is already being tracked, update if needed
                 tracked_last_modified_time, _ = self.tracking_threads[thread_id]
-                online_last_modified_time, _ = self.tracking_threads[thread_id]
+                online_last_modified_time, _ = online_threads[thread_id]
                 if (tracked_last_modified_time < online_last_modified_time):
-                    self.logger.debug(f"Thread updated: /{self.board_code}/{thread_id}")
+                    self.logger.debug("Thread updated: /%s/%s", self.board_code, thread_id)
                     self.tracking_threads[thread_id] = online_threads[thread_id]
                     threads_to_update.append(thread_id)  # posts to update records the board and thread we need to download the content of 
                     update_count += 1
                 else:
-                    self.logger.debug(f"Do not need to update thread /{self.board_code}/{thread_id}")
+                    self.logger.debug("Do not need to update thread /%s/%s", self.board_code, thread_id)
             else:
                 # online thread is not tracked, it's a new thread
-                self.logger.debug(f"New thread: /{self.board_code}/{thread_id}")
+                self.logger.debug("New thread: /%s/%s", self.board_code, thread_id)
                 self.tracking_threads[thread_id] = online_threads[thread_id]
                 threads_to_update.append(thread_id)
                 birth_count += 1
@@ -224,41 +599,139 @@ class Board:
         self.logger.info(f"Thread births in previous iteration: {birth_count}")
         self.logger.info(f"Thread updates in previous iteration: {update_count}")
         self.logger.info(f"{len(self.tracking_threads)} threads are currently being monitored.")
+        self._update_activity(death_count + birth_count + update_count)
+        self.change_counts["birth"] += birth_count
+        self.change_counts["death"] += death_count
+        self.change_counts["update"] += update_count
 
+        if self.catalog_delta:
+            threads_to_update = self.capture_from_catalog(threads_to_update)
         return threads_to_update
 
+    def get_poll_interval(self):
+        """Seconds until the thread list of the board should be polled again, so that a poll sees about
+        target_changes_per_poll changes, bounded by min_poll_interval and max_poll_interval
+
+        :return: poll interval in seconds
+        """
+        if self.activity is None:
+            return self.min_poll_interval
+        if self.activity <= 0:
+            return self.max_poll_interval
+        return min(max(self.target_changes_per_poll / self.activity, self.min_poll_interval), self.max_poll_interval)
+
+    def _update_activity(self, change_count):
+        """
+        Fold the changes seen in the latest thread list into the smoothed activity of the board
+        """
+        now = time.time()
+        if self._last_activity_update is not None and now > self._last_activity_update:
+            rate = change_count / (now - self._last_activity_update)
+            self.activity = rate if self.activity is None else 0.7 * self.activity + 0.3 * rate
+        self._last_activity_update = now
+
+    def _update_thread_activity(self, online_threads):
+        """
+        Update the position and reply velocity of every online thread, used to decide which threads to fetch first
+        """
+        now = time.time()
+        last_position = max(len(online_threads) - 1, 1)
+        thread_positions = {}
+        reply_velocity = {}
+        reply_snapshots = {}
+        for position, (thread_id, (_, replies)) in enumerate(online_threads.items()):
+            thread_positions[thread_id] = position / last_position
+            velocity = self.reply_velocity.get(thread_id, 0.0)
+            if thread_id in self._reply_snapshots:
+                previous_replies, previous_time = self._reply_snapshots[thread_id]
+                if now > previous_time:
+                    # exponential smoothing over the thread list snapshots
+                    velocity = 0.5 * velocity + 0.5 * max(replies - previous_replies, 0) / (now - previous_time)
+            reply_velocity[thread_id] = velocity
+            reply_snapshots[thread_id] = (replies, now)
+        self.thread_positions = thread_positions
+        self.reply_velocity = reply_velocity
+        self._reply_snapshots = reply_snapshots
+
     def _process_online_threads(self, online_threads):
         proccessed_threads = {}
-        for page in online_threads:
-            for thread in page["threads"]:
-                proccessed_threads[str(thread["no"])] = [int(thread["last_modified"]), int(thread["replies"])]
+        for thread_no, last_modified, replies in read_thread_list_entries(online_threads):
+            proccessed_threads[str(thread_no)] = [int(last_modified), int(replies)]
         return proccessed_threads
 
-    def _check_retry(self, request_response, thread_id, attempt):
+    def is_paused(self):
+        """
+        :return: True while the circuit breaker of the board is open and the board should not be requested
+        """
+        return self.circuit_breaker.is_open()
+
+    def forget_thread_update(self, thread_id):
+        """
+        Let the next thread list comparison see a thread as updated again, for an update that was not fetched
+        """
+        if thread_id in self.tracking_threads:
+            self.tracking_threads[thread_id] = [0, self.tracking_threads[thread_id][1]]
+
+    def defer_thread(self, thread_id):
+        """
+        Hand a thread to the retry queue until the circuit breaker lets requests through again, without counting an attempt
+        """
+        if self.retry_queue is None:
+            return
+        self.retry_attempts.setdefault(thread_id, 0)
+        self.retry_queue.push(self, thread_id, self.circuit_breaker.seconds_until_retry())
+
+    def _check_retry(self, request_response, thread_id):
+        """Hand a failed request to the retry queue, the request is given up after the queue's max attempts
+
+        :return: True if the request is retried later
+        """
         # TODO can change this to strategy mapping, having a factory class that generate strategy mapping for threadlist and thread, and a dict to map to return strategy and log info
-        if request_response == None:
-            return True
-            
-        if request_response.status_code == 304: # if the content does not change since last request, return none
-            self.logger.debug(f"Thread {thread_id} not updated since last request") 
-            return False
-        
-        if request_response.status_code == 200:
-            self.logger.debug("Recieved answer")
-            return False
-        
-        error_message = f"Request for thread {thread_id} on board /{self.board_code}/ was unsuccessful with error code {request_response.status_code}."
-        if request_response.status_code == 404:
-            self.logger.warning(f'{error_message} Skipping')
-            return False
-        
-        if attempt <= 5:
-            self.logger.error(f'{error_message} Current Attempt: {attempt}, now entering next attempt')
-            time.sleep(self.thread_content_request_interval * 5)
+        if request_response is not None:
+            if request_response.status_code == 304: # if the content does not change since last request, return none
+                self.logger.debug("Thread %s not updated since last request", thread_id)
+                self.retry_attempts.pop(thread_id, None)
+                return False
+
+            if request_response.status_code == 200:
+                self.logger.debug("Recieved answer")
+                self.retry_attempts.pop(thread_id, None)
+                return False
+
+            if request_response.status_code == 404:
+                self.logger.warning(f"Request for thread {thread_id} on board /{self.board_code}/ was unsuccessful with error code 404. Skipping")
+                self.retry_attempts.pop(thread_id, None)
+                return False
+
+        error = "no response" if request_response is None else f"error code {request_response.status_code}"
+        error_message = f"Request for thread {thread_id} on board /{self.board_code}/ was unsuccessful with {error}."
+        attempt = self.retry_attempts.get(thread_id, 0) + 1
+        delay = self.retry_queue.schedule(self, thread_id, attempt) if self.retry_queue is not None else None
+        if delay is not None:
+            self.retry_attempts[thread_id] = attempt
+            self.logger.error(f"{error_message} Attempt {attempt}, retrying in {delay:.0f} seconds")
             return True
+
+        self.logger.warning(f"{error_message} Giving up after {attempt} attempts")
+        self.retry_attempts.pop(thread_id, None)
+        if thread_id in self.tracking_threads:
+            # the next thread list queues the thread again
+            self.tracking_threads[thread_id] = [0, self.tracking_threads[thread_id][1]]
+        return False
+
+    def _conditional_headers(self, since, validators):
+        # prefer the validators sent by the server over our own request time
+        http_last_modified, etag = validators
+        if http_last_modified is not None:
+            headers = {"If-Modified-Since": http_last_modified}
         else:
-            self.logger.warning(f'{error_message} Returning None')
-            return False
+            headers = self._format_time_header(since)
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        return headers
+
+    def _read_validators(self, request_response):
+        return (request_response.headers.get("Last-Modified"), request_response.headers.get("ETag"))
 
     def _format_time_header(self, since):
         since = time.gmtime(time.mktime(since))
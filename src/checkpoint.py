@@ -0,0 +1,76 @@
+from pathlib import Path
+import json
+import time
+from storage import atomic_write_json
+
+
+class CrawlCheckpoint:
+    """
+    Compact JSON snapshot of the in-memory crawl state: the tracking state of every board, the threads waiting in the
+    scheduler and when each board is polled next. It is written periodically and on exit, so a restart resumes from
+    it instead of re-reading every board's thread list snapshot and the crawl state store
+    """
+    def __init__(self, checkpoint_path: Path):
+        self.checkpoint_path = Path(checkpoint_path)
+
+    def load(self):
+        """
+        :return: the last saved checkpoint, None if there is none or it can not be read
+        """
+        if not self.checkpoint_path.exists():
+            return None
+        try:
+            with open(self.checkpoint_path, "r") as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, boards, scheduler=None, poll_planner=None):
+        """
+        Write the state of the boards, and the scheduler queue and poll plan when they are used
+        """
+        checkpoint = {
+            "saved": time.time(),
+            "boards": {board.board_code: board.get_checkpoint_state() for board in boards},
+            "scheduler": scheduler.get_pending() if scheduler is not None else [],
+            "next_polls": poll_planner.get_next_polls() if poll_planner is not None else {},
+        }
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(self.checkpoint_path, checkpoint, separators=(",", ":"))
+
+
+class BoardListCache:
+    """
+    The list of board codes from boards.json kept on disk for ttl seconds, so a restart does not have to request it
+    """
+    def __init__(self, cache_path: Path, ttl: float = 86400):
+        self.cache_path = Path(cache_path)
+        self.ttl = ttl
+
+    def get(self):
+        """
+        :return: cached board codes, None if there are none or they are older than the ttl
+        """
+        if self.ttl <= 0 or not self.cache_path.exists():
+            return None
+        try:
+            with open(self.cache_path, "r") as infile:
+                cached = json.load(infile)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached["fetched"] > self.ttl:
+            return None
+        return cached["boards"]
+
+    def put(self, board_codes):
+        """
+        Store freshly requested board codes
+        """
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(self.cache_path, {"fetched": time.time(), "boards": board_codes})
+
+    def invalidate(self):
+        """
+        Forget the cached board codes, so they are requested again
+        """
+        self.cache_path.unlink(missing_ok=True)
@@ -0,0 +1,221 @@
+from pathlib import Path
+from datetime import datetime, timedelta
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from storage import SEGMENT_COMPRESSIONS, atomic_write_json, get_archive_path
+
+
+class DayCompactor:
+    """
+    Merges the loose JSON files of closed day partitions saves/<day> into one compressed archive per board under
+    archive/<day>/<board>, then removes the day partition. An archive is the board's latest capture of every thread
+    of the day in the format of a segment of the segmented storage mode, with the same sidecar index.jsonl, so a
+    single thread can be read back with storage.read_segment_record, next to the board's last thread list of the day
+
+    A day is closed grace_period seconds after midnight (UTC), so late writes of the day are not missed
+    """
+    def __init__(self, base_save_path: Path, logger, compression: str = "gzip", grace_period: float = 3600):
+        if compression not in SEGMENT_COMPRESSIONS:
+            raise ValueError(f"Unknown archive compression '{compression}', choose from {', '.join(SEGMENT_COMPRESSIONS)}")
+        self.base_save_path = Path(base_save_path)
+        self.logger = logger
+        self.compression = compression
+        self.grace_period = grace_period
+        self._closed = threading.Event()
+        self._thread = None
+
+    def get_closed_days(self):
+        """
+        :return: days with a saves folder that are closed for writing, oldest first
+        """
+        saves_path = self.base_save_path / "saves"
+        if not saves_path.exists():
+            return []
+        return sorted(day_path.name for day_path in saves_path.iterdir() if day_path.is_dir() and self.is_day_closed(day_path.name))
+
+    def is_day_closed(self, day):
+        """
+        :param day: day as "YYYY_MM_DD"
+        :return: True once the grace period after the end of the day (UTC) is over
+        """
+        last_open_day = (datetime.utcnow() - timedelta(seconds=self.grace_period)).strftime("%Y_%m_%d")
+        return day < last_open_day
+
+    def run(self):
+        """Compact every closed day
+
+        :return: number of compacted days
+        """
+        compacted_days = 0
+        for day in self.get_closed_days():
+            if self._closed.is_set():
+                break
+            self.compact_day(day)
+            compacted_days += 1
+        return compacted_days
+
+    def compact_day(self, day):
+        """Archive every board of a day, then remove the day partition. Boards that are already archived, e.g. by an
+        interrupted earlier run, are skipped
+
+        :return: dictionary with the number of archived threads and the size of the day before and after
+        """
+        day_path = self.base_save_path / "saves" / day
+        if not day_path.exists():
+            return None
+        board_codes = set()
+        if (day_path / "threads").exists():
+            board_codes.update(board_path.name for board_path in (day_path / "threads").iterdir() if board_path.is_dir())
+        if (day_path / "threads_on_boards").exists():
+            board_codes.update(thread_list_path.name.split("_")[0] for thread_list_path in (day_path / "threads_on_boards").glob("*.json"))
+
+        bytes_before = sum(file_path.stat().st_size for file_path in day_path.rglob("*") if file_path.is_file())
+        thread_count = 0
+        for board_code in sorted(board_codes):
+            if self._closed.is_set():
+                # the day partition stays until every board is archived
+                return None
+            if not get_archive_path(self.base_save_path, day, board_code).exists():
+                thread_count += self._compact_board(day, board_code)
+        shutil.rmtree(day_path)
+
+        bytes_after = sum(file_path.stat().st_size for file_path in (self.base_save_path / "archive" / day).rglob("*") if file_path.is_file())
+        self.logger.info(f"Compacted {day}: {thread_count} threads of {len(board_codes)} boards, {bytes_before} bytes to {bytes_after} bytes")
+        return {"threads": thread_count, "bytes_before": bytes_before, "bytes_after": bytes_after}
+
+    def start(self, interval: float = 3600):
+        """
+        Compact closed days in a background thread every interval seconds
+        """
+        self._thread = threading.Thread(target=self._run_periodically, args=(interval,), name="DayCompactor", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stop the background thread after the board it is working on
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _compact_board(self, day, board_code):
+        day_path = self.base_save_path / "saves" / day
+        archive_path = get_archive_path(self.base_save_path, day, board_code)
+        # written next to the final folder and renamed into place, so an archive is either complete or missing
+        temp_path = archive_path.with_name(archive_path.name + ".tmp")
+        if temp_path.exists():
+            shutil.rmtree(temp_path)
+        temp_path.mkdir(parents=True)
+
+        # names are <thread id>_<hh>_<mm>_<ss>.json, sorting keeps the latest file of a thread
+        thread_paths = {}
+        thread_content_path = day_path / "threads" / board_code
+        if thread_content_path.exists():
+            for thread_path in sorted(thread_content_path.glob("*.json")):
+                thread_paths[thread_path.name.split("_")[0]] = thread_path
+
+        compress = SEGMENT_COMPRESSIONS[self.compression]["compress"]
+        archive_name = f"archive.jsonl{SEGMENT_COMPRESSIONS[self.compression]['suffix']}"
+        index_lines = []
+        with open(temp_path / archive_name, "wb") as archive_file:
+            for thread_id, thread_path in sorted(thread_paths.items()):
+                try:
+                    with open(thread_path, "r") as infile:
+                        thread_content = json.load(infile)
+                except ValueError:
+                    self.logger.warning(f"Skipping unreadable capture {thread_path}")
+                    continue
+                record = {"thread_id": thread_id, "captured": thread_path.stat().st_mtime, "content": thread_content}
+                data = compress((json.dumps(record) + "\n").encode("utf-8"))
+                offset = archive_file.tell()
+                archive_file.write(data)
+                index_lines.append(json.dumps({"thread_id": thread_id, "segment": archive_name, "offset": offset, "length": len(data), "captured": record["captured"]}) + "\n")
+        with open(temp_path / "index.jsonl", "w") as index_file:
+            index_file.writelines(index_lines)
+
+        thread_list_paths = sorted((day_path / "threads_on_boards").glob(f"{board_code}_*.json"))
+        if thread_list_paths:
+            with open(thread_list_paths[-1], "r") as infile:
+                atomic_write_json(temp_path / "thread_list.json", json.load(infile))
+
+        os.replace(temp_path, archive_path)
+        return len(index_lines)
+
+    def _run_periodically(self, interval):
+        while True:
+            try:
+                self.run()
+            except Exception:
+                self.logger.exception("Day compaction failed")
+            if self._closed.wait(interval):
+                return
+
+
+def read_latest_thread_list(base_save_path: Path, board_code: str):
+    """
+    Find the last saved thread list of a board, today's or the one of the last earlier day it was saved on, also in
+    the compacted archives
+
+    :return: thread list in the format of the API, None if the board was never saved
+    """
+    base_save_path = Path(base_save_path)
+    days = {
+        day_path.name
+        for folder in ("saves", "archive") if (base_save_path / folder).exists()
+        for day_path in (base_save_path / folder).iterdir() if day_path.is_dir()
+    }
+    for day in sorted(days, reverse=True):
+        thread_list_path = get_archive_path(base_save_path, day, board_code) / "thread_list.json"
+        saved_thread_list_paths = sorted((base_save_path / "saves" / day / "threads_on_boards").glob(f"{board_code}_*.json"))
+        if saved_thread_list_paths:
+            thread_list_path = saved_thread_list_paths[-1]
+        if thread_list_path.exists():
+            with open(thread_list_path, "r") as infile:
+                return json.load(infile)
+    return None
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Compact closed day partitions of the snapshot saves into one compressed archive per board and day")
+    argparser.add_argument(
+        "--data-path",
+        type=str,
+        default=str(Path(__file__).resolve().parents[1] / "data"),
+        help="Path of the data folder (default: 'data' in the 4CTC repo folder)",
+    )
+    argparser.add_argument("--day", type=str, default=None, help="Only compact this day, as YYYY_MM_DD (default: every closed day)")
+    argparser.add_argument(
+        "--compression",
+        type=str,
+        choices=["gzip", "lzma"],
+        default="gzip",
+        help="Compression of the archives (default: gzip)",
+    )
+    argparser.add_argument(
+        "--grace-period",
+        type=float,
+        default=3600,
+        help="Seconds after midnight (UTC) after which a day is considered closed (default: 3600)",
+    )
+    argparser.add_argument(
+        "--force",
+        action="store_true",
+        help="Compact the --day even if it is not closed yet, captures the scraper still writes to that day are lost",
+    )
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s: %(message)s")
+    compactor = DayCompactor(Path(args.data_path), logging.getLogger("compaction"), args.compression, args.grace_period)
+    if args.day is not None and not args.force and not compactor.is_day_closed(args.day):
+        argparser.error(f"Day {args.day} is not closed yet, the scraper may still write to it (use --force to compact it anyway)")
+    start_time = time.time()
+    if args.day is not None:
+        compactor.compact_day(args.day)
+    else:
+        compactor.run()
+    logging.info(f"Done in {time.time() - start_time:.1f} seconds")
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from ratelimit import TokenBucket
+
+
+class Coordinator:
+    """
+    Central process of a sharded crawl. Workers connect over TCP, get a share of the boards and lease every request
+    token from the one TokenBucket held here, so all workers together keep to request_time_limit. A worker that
+    has not been heard from for worker_timeout seconds is considered dead and its boards go to the remaining workers
+
+    The protocol is one JSON object per line in both directions, requests look like ``{"op": "lease", "worker": "w1", "tokens": 1}``
+    with the ops "register", "lease", "heartbeat" and "leave", every answer carries the current boards of the worker
+    """
+    def __init__(self, board_codes, request_time_limit: float = 1, host: str = "127.0.0.1", port: int = 0, worker_timeout: float = 30, logger=None):
+        self.board_codes = list(board_codes)
+        self.rate_limiter = TokenBucket(request_time_limit)
+        self.worker_timeout = worker_timeout
+        self.logger = logger if logger is not None else logging.getLogger("coordinator")
+
+        self._lock = threading.Lock()
+        self._assignments = {} # worker id -> board codes
+        self._last_seen = {} # worker id -> time of its last message
+        self._closed = threading.Event()
+
+        coordinator = self
+
+        class CoordinatorHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = coordinator.handle_message(json.loads(line))
+                    except Exception as e:
+                        response = {"error": str(e)}
+                    self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+
+        self._server = _CoordinatorServer((host, port), CoordinatorHandler)
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name="Coordinator", daemon=True),
+            threading.Thread(target=self._reap_dead_workers, name="CoordinatorReaper", daemon=True),
+        ]
+
+    @property
+    def address(self):
+        """
+        :return: "host:port" the workers connect to
+        """
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        self.logger.info(f"Coordinating {len(self.board_codes)} boards on {self.address}")
+        return self
+
+    def close(self):
+        self._closed.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def get_assignments(self):
+        """
+        :return: copy of the boards of every worker
+        """
+        with self._lock:
+            return {worker_id: list(board_codes) for worker_id, board_codes in self._assignments.items()}
+
+    def handle_message(self, message):
+        """Answer one request of a worker
+
+        :return: response dictionary
+        """
+        worker_id = message["worker"]
+        op = message["op"]
+        response = {}
+        with self._lock:
+            if op == "register":
+                self._register(worker_id)
+            elif worker_id not in self._assignments:
+                # a worker declared dead that comes back has to register again, it may have lost its boards
+                self._register(worker_id)
+            if op == "lease":
+                response["wait"] = self.rate_limiter.reserve(message.get("tokens", 1))
+            elif op == "leave":
+                self._remove_worker(worker_id)
+                return {"boards": []}
+            self._last_seen[worker_id] = time.time()
+            response["boards"] = list(self._assignments[worker_id])
+        return response
+
+    def remove_worker(self, worker_id):
+        """
+        Give the boards of a failed worker to the remaining workers
+        """
+        with self._lock:
+            self._remove_worker(worker_id)
+
+    def _register(self, worker_id):
+        if worker_id in self._assignments:
+            return
+        self._assignments[worker_id] = []
+        self.logger.info(f"Worker {worker_id} joined")
+        self._assign_unassigned()
+        # a new worker takes boards from the busiest workers until the load is even
+        fair_share = len(self.board_codes) // len(self._assignments)
+        while len(self._assignments[worker_id]) < fair_share:
+            busiest = max(self._assignments, key=lambda other: len(self._assignments[other]))
+            if len(self._assignments[busiest]) <= fair_share:
+                break
+            self._assignments[worker_id].append(self._assignments[busiest].pop())
+        self._log_assignments()
+
+    def _remove_worker(self, worker_id):
+        if worker_id not in self._assignments:
+            return
+        del self._assignments[worker_id]
+        self._last_seen.pop(worker_id, None)
+        self.logger.warning(f"Worker {worker_id} left, reassigning its boards")
+        self._assign_unassigned()
+        self._log_assignments()
+
+    def _assign_unassigned(self):
+        if not self._assignments:
+            return
+        assigned = {board_code for board_codes in self._assignments.values() for board_code in board_codes}
+        for board_code in self.board_codes:
+            if board_code not in assigned:
+                least_loaded = min(self._assignments, key=lambda worker_id: len(self._assignments[worker_id]))
+                self._assignments[least_loaded].append(board_code)
+
+    def _log_assignments(self):
+        self.logger.info("Board assignments: " + "; ".join(
+            f"{worker_id}: {' '.join(board_codes) or '-'}" for worker_id, board_codes in sorted(self._assignments.items())
+        ))
+
+    def _reap_dead_workers(self):
+        while not self._closed.wait(max(self.worker_timeout / 3, 0.5)):
+            now = time.time()
+            with self._lock:
+                for worker_id, last_seen in list(self._last_seen.items()):
+                    if now - last_seen > self.worker_timeout:
+                        self.logger.warning(f"No message from worker {worker_id} for {now - last_seen:.0f} seconds")
+                        self._remove_worker(worker_id)
+
+
+class _CoordinatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class CoordinatorClient:
+    """
+    Connection of a worker to the Coordinator. It stands in for the TokenBucket of a single process crawl, every
+    token is leased from the coordinator, and a background heartbeat keeps the boards of the worker up to date in
+    assigned_boards
+    """
+    def __init__(self, coordinator_address: str, worker_id: str = None, heartbeat_interval: float = 5):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.waited_seconds: float = 0.0
+        host, port = coordinator_address.rsplit(":", 1)
+
+        self._lock = threading.Lock()
+        self._socket = socket.create_connection((host, int(port)))
+        self._reader = self._socket.makefile("rb")
+        self.assigned_boards = self._call("register")["boards"]
+
+        self._closed = threading.Event()
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="CoordinatorHeartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    def reserve(self, tokens: float = 1):
+        """
+        Lease tokens from the coordinator
+
+        :return: seconds to wait before the tokens can be used
+        """
+        waiting = self._call("lease", tokens=tokens)["wait"]
+        self.waited_seconds += waiting
+        return waiting
+
+    def acquire(self, tokens: float = 1):
+        """
+        Block the calling thread until the leased tokens are available
+
+        :return: seconds spent waiting
+        """
+        waiting = self.reserve(tokens)
+        if waiting > 0:
+            time.sleep(waiting)
+        return waiting
+
+    async def acquire_async(self, tokens: float = 1):
+        """
+        Same as acquire, but only suspends the calling coroutine
+
+        :return: seconds spent waiting
+        """
+        waiting = await asyncio.to_thread(self.reserve, tokens)
+        if waiting > 0:
+            await asyncio.sleep(waiting)
+        return waiting
+
+    def close(self):
+        """
+        Leave the crawl, so the coordinator hands the boards to the other workers right away
+        """
+        self._closed.set()
+        try:
+            self._call("leave")
+        except OSError:
+            pass
+        self._socket.close()
+
+    def _call(self, op, **fields):
+        with self._lock:
+            self._socket.sendall((json.dumps({"op": op, "worker": self.worker_id, **fields}) + "\n").encode("utf-8"))
+            line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Coordinator closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Coordinator error: {response['error']}")
+        self.assigned_boards = response["boards"]
+        return response
+
+    def _heartbeat(self):
+        while not self._closed.wait(self._heartbeat_interval):
+            try:
+                self._call("heartbeat")
+            except (OSError, RuntimeError):
+                # the next lease fails too and stops the worker
+                return
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Coordinate a crawl sharded over several hosts, workers join with 'python src/requester.py --coordinator-address <host>:<port>'")
+    argparser.add_argument("-b", "--boards", nargs="+", type=str, required=True, help="Board codes to crawl, e.g. 'a c g sci'")
+    argparser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on, use 0.0.0.0 for workers on other hosts (default: 127.0.0.1)")
+    argparser.add_argument("--port", type=int, default=7070, help="Port to listen on (default: 7070)")
+    argparser.add_argument("--request-time-limit", type=float, default=1, help="Minimum time in seconds between two requests of all workers together (default: 1)")
+    argparser.add_argument("--worker-timeout", type=float, default=30, help="Seconds without a message after which a worker's boards are reassigned (default: 30)")
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s: %(message)s")
+    coordinator = Coordinator(args.boards, max(args.request_time_limit, 1), args.host, args.port, args.worker_timeout).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        coordinator.close()
@@ -0,0 +1,249 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from storage import read_thread_file
+from utils import strip_html
+
+QUOTE_PATTERN = re.compile(r">>(\d+)")
+CROSS_BOARD_QUOTE_PATTERN = re.compile(r">>>/(\w+)/(\d+)")
+
+
+class CorpusBuilder:
+    """
+    Turns the saved threads into a text corpus: a posts table with the cleaned subject and text of every post, and
+    the reply graph made of the quote links (>>123) between posts. The thread files under saves/<day>/threads and the
+    archives of compacted days under archive/<day> are cleaned in a process pool, every post is written once, keyed
+    by board and post number, so repeated captures of a thread only add their new posts
+
+    The output folder holds posts/ and edges/ with gzip compressed JSON-Lines shards of at most shard_size records,
+    and manifest.sqlite3, which remembers the inputs and posts already written. A shard and the manifest entries of
+    its posts are committed together, so an interrupted build neither loses nor duplicates posts, and a rebuild only
+    reads inputs that are new or changed
+    """
+    def __init__(self, data_path: Path, output_path: Path, logger, workers: int = None, shard_size: int = 100000):
+        self.data_path = Path(data_path)
+        self.output_path = Path(output_path)
+        self.logger = logger
+        self.workers = workers or os.cpu_count()
+        self.shard_size = shard_size
+
+        (self.output_path / "posts").mkdir(parents=True, exist_ok=True)
+        (self.output_path / "edges").mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.output_path / "manifest.sqlite3"))
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS inputs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER,
+                size INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS posts (
+                board TEXT NOT NULL,
+                post_no INTEGER NOT NULL,
+                PRIMARY KEY (board, post_no)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def get_changed_inputs(self):
+        """
+        :return: (path, kind, board, mtime_ns, size) of the inputs that are new or changed since the last build, oldest day first
+        """
+        inputs = [(path, "thread") for path in self.data_path.glob("saves/*/threads/*/*.json")]
+        inputs += [(path, "segment") for path in self.data_path.glob("archive/*/*/archive.jsonl.*")]
+        changed_inputs = []
+        for path, kind in sorted(inputs, key=lambda item: (item[0].parts[-4] if item[1] == "thread" else item[0].parts[-3], str(item[0]))):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # removed by the running scraper since it was listed
+                continue
+            row = self._connection.execute("SELECT mtime_ns, size FROM inputs WHERE path = ?", (str(path),)).fetchone()
+            if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+                continue
+            changed_inputs.append((str(path), kind, path.parent.name, stat.st_mtime_ns, stat.st_size))
+        return changed_inputs
+
+    def prune_missing_inputs(self):
+        """Forget the inputs that no longer exist, e.g. day folders removed by compaction, their posts stay in the corpus
+
+        :return: number of inputs forgotten
+        """
+        missing_paths = [(path,) for path, in self._connection.execute("SELECT path FROM inputs") if not os.path.exists(path)]
+        self._connection.executemany("DELETE FROM inputs WHERE path = ?", missing_paths)
+        self._connection.commit()
+        return len(missing_paths)
+
+    def build(self):
+        """Clean the new and changed inputs and write their new posts and edges
+
+        :return: dictionary with the number of inputs, inputs forgotten, posts read, new posts, new edges, seconds and posts per second
+        """
+        start_time = time.time()
+        pruned_count = self.prune_missing_inputs()
+        changed_inputs = self.get_changed_inputs()
+        self.logger.info(f"{len(changed_inputs)} new or changed inputs, cleaning them in {self.workers} processes")
+
+        run_id = time.strftime("%Y%m%d_%H%M%S", time.gmtime(start_time))
+        posts_shard = _ShardWriter(self.output_path / "posts", f"posts-{run_id}")
+        edges_shard = _ShardWriter(self.output_path / "edges", f"edges-{run_id}")
+        stats = {"inputs": len(changed_inputs), "pruned_inputs": pruned_count, "posts_read": 0, "new_posts": 0, "new_edges": 0}
+        next_report_time = start_time + 10
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            jobs = [(path, kind, board_code) for path, kind, board_code, _, _ in changed_inputs]
+            # results come back in input order, so earlier days are written first
+            for (path, _, _, mtime_ns, size), cleaned_posts in zip(changed_inputs, executor.map(clean_input, jobs, chunksize=16)):
+                if cleaned_posts is None:
+                    # removed since it was listed, not recorded so it is not taken for done
+                    continue
+                for post_row, edges in cleaned_posts:
+                    stats["posts_read"] += 1
+                    inserted = self._connection.execute(
+                        "INSERT OR IGNORE INTO posts (board, post_no) VALUES (?, ?)", (post_row["board"], post_row["post"])
+                    ).rowcount
+                    if not inserted:
+                        continue
+                    posts_shard.write(post_row)
+                    for edge in edges:
+                        edges_shard.write(edge)
+                    stats["new_posts"] += 1
+                    stats["new_edges"] += len(edges)
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO inputs (path, mtime_ns, size) VALUES (?, ?, ?)", (path, mtime_ns, size)
+                )
+                if posts_shard.count >= self.shard_size or edges_shard.count >= self.shard_size:
+                    self._commit(posts_shard, edges_shard)
+
+                if time.time() >= next_report_time:
+                    next_report_time = time.time() + 10
+                    elapsed = time.time() - start_time
+                    self.logger.info(f"{stats['posts_read']} posts read ({stats['posts_read'] / elapsed:.0f} posts/s), {stats['new_posts']} new")
+        self._commit(posts_shard, edges_shard)
+
+        stats["seconds"] = time.time() - start_time
+        stats["posts_per_second"] = stats["posts_read"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+        return stats
+
+    def close(self):
+        self._connection.close()
+
+    def _commit(self, posts_shard, edges_shard):
+        # the shards are in place before the manifest says their posts are written
+        posts_shard.finish()
+        edges_shard.finish()
+        self._connection.commit()
+
+
+class _ShardWriter:
+    """
+    Writes records to numbered gzip JSON-Lines shards, a shard is written under a temporary name until finish
+    """
+    def __init__(self, folder: Path, prefix: str):
+        self.folder = folder
+        self.prefix = prefix
+        self.count = 0
+        self._shard_number = 0
+        self._file = None
+        self._temp_path = None
+
+    def write(self, record):
+        if self._file is None:
+            self._shard_number += 1
+            self._temp_path = self.folder / f"{self.prefix}-{self._shard_number:05d}.jsonl.gz.tmp"
+            self._file = gzip.open(self._temp_path, "wt", encoding="utf-8")
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def finish(self):
+        """
+        Close the current shard and move it into place, the next record starts a new shard
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._temp_path, self._temp_path.with_suffix(""))
+        self._file = None
+        self.count = 0
+
+
+def clean_input(job):
+    """Read and clean all posts of an input, runs in the worker processes
+
+    :param job: (path, kind, board code), kind is "thread" for a thread file or "segment" for the archive of a compacted day
+    :return: list of (post row, reply edges) pairs, None if the input was removed by the running scraper
+    """
+    path, kind, board_code = job
+    cleaned_posts = []
+    try:
+        for thread_content in read_thread_file(path, kind):
+            for post in thread_content.get("posts", []):
+                cleaned_posts.append(clean_post(board_code, post))
+    except FileNotFoundError:
+        return None
+    return cleaned_posts
+
+
+def clean_post(board_code, post):
+    """Turn a post of the API into a corpus row. The text is the comment without HTML and without the quote links,
+    which become the reply edges instead, lines that only held quote links are dropped
+
+    :return: (post row, list of reply edges)
+    """
+    thread_no = post["no"] if post.get("resto", 0) == 0 else post["resto"]
+    comment = strip_html(post.get("com"))
+
+    edges = {}
+    for target_board, target_no in CROSS_BOARD_QUOTE_PATTERN.findall(comment):
+        edges[(target_board, int(target_no))] = None
+    comment = CROSS_BOARD_QUOTE_PATTERN.sub("", comment)
+    for target_no in QUOTE_PATTERN.findall(comment):
+        edges[(board_code, int(target_no))] = None
+    comment = QUOTE_PATTERN.sub("", comment)
+    text = "\n".join(line.strip() for line in comment.splitlines() if line.strip())
+
+    post_row = {
+        "board": board_code,
+        "thread": thread_no,
+        "post": post["no"],
+        "time": post.get("time"),
+        "subject": strip_html(post.get("sub")),
+        "text": text,
+    }
+    reply_edges = [
+        {"board": board_code, "thread": thread_no, "source": post["no"], "target_board": target_board, "target": target_no}
+        for target_board, target_no in edges
+    ]
+    return post_row, reply_edges
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Build a text corpus (posts and reply edges) from the saved threads, only new and changed inputs are read")
+    argparser.add_argument(
+        "--data-path",
+        type=str,
+        default=str(Path(__file__).resolve().parents[1] / "data"),
+        help="Path of the data folder (default: 'data' in the 4CTC repo folder)",
+    )
+    argparser.add_argument("--output-path", type=str, default=None, help="Folder of the corpus (default: 'corpus' in the data folder)")
+    argparser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    argparser.add_argument("--shard-size", type=int, default=100000, help="Maximum number of records per shard file (default: 100000)")
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s: %(message)s")
+    output_path = Path(args.output_path) if args.output_path else Path(args.data_path) / "corpus"
+    builder = CorpusBuilder(Path(args.data_path), output_path, logging.getLogger("corpus"), args.workers, args.shard_size)
+    stats = builder.build()
+    builder.close()
+    print(f"Inputs:      {stats['inputs']} ({stats['pruned_inputs']} removed inputs forgotten)")
+    print(f"Posts read:  {stats['posts_read']} ({stats['posts_per_second']:.0f} posts/s)")
+    print(f"New posts:   {stats['new_posts']}")
+    print(f"New edges:   {stats['new_edges']}")
+    print(f"Duration:    {stats['seconds']:.1f} s")
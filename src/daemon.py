@@ -0,0 +1,71 @@
+from pathlib import Path
+import signal
+import threading
+import time
+from utils import load_and_validate_config
+
+
+class ConfigWatcher:
+    """
+    Tells a long-running Requester when to reload its configuration: when the modification time of the configuration
+    file changed, which is checked at most every check_interval seconds, or when a reload was requested, e.g. by SIGHUP
+    """
+    def __init__(self, config_path=None, check_interval: float = 5):
+        self.config_path = Path(config_path) if config_path else None
+        self.check_interval = check_interval
+        self._modified_time = self._read_modified_time()
+        self._next_check_time = time.time() + check_interval
+        self._reload_requested = threading.Event()
+
+    def request_reload(self):
+        """
+        Reload on the next check, safe to call from a signal handler
+        """
+        self._reload_requested.set()
+
+    def reload_due(self):
+        """
+        :return: True if the configuration should be reloaded now
+        """
+        if self._reload_requested.is_set():
+            self._reload_requested.clear()
+            self._modified_time = self._read_modified_time()
+            return True
+        if time.time() < self._next_check_time:
+            return False
+        self._next_check_time = time.time() + self.check_interval
+        modified_time = self._read_modified_time()
+        if modified_time == self._modified_time:
+            return False
+        self._modified_time = modified_time
+        return True
+
+    def load(self):
+        """Read and validate the configuration file
+
+        :return: configuration dictionary, None when running without a configuration file
+        """
+        if self.config_path is None:
+            return None
+        return load_and_validate_config(self.config_path)
+
+    def _read_modified_time(self):
+        if self.config_path is None:
+            return None
+        try:
+            return self.config_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+
+def install_signal_handler(signal_name, handler):
+    """Call handler() when the process gets the signal, only possible from the main thread
+
+    :param signal_name: e.g. "SIGHUP"
+    :return: True if the handler was installed, False where the signal does not exist, e.g. SIGHUP on Windows
+    """
+    signal_number = getattr(signal, signal_name, None)
+    if signal_number is None or threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signal_number, lambda signum, frame: handler())
+    return True
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import requests
+
+
+class AsyncThreadFetcher:
+    """
+    Fetch the content of many threads of a board concurrently with asyncio.
+    A fixed pool of workers keeps at most ``max_concurrent_requests`` requests in flight, and every request takes a
+    token from the shared rate limiter before it is sent, so network latency overlaps while the request rate stays
+    the same as in the sequential pipeline. Only the requests themselves run in worker threads, the boards are read
+    and updated on the thread that calls fetch_jobs, so their state, circuit breakers and the retry queue need no locks
+    """
+    def __init__(self, rate_limiter, logger, max_concurrent_requests: int = 4):
+        self.rate_limiter = rate_limiter
+        self.logger = logger
+        self.max_concurrent_requests = max_concurrent_requests
+        # one event loop for every batch, so its worker threads are kept between batches
+        self._loop = asyncio.new_event_loop()
+
+    def fetch_threads(self, board, thread_ids):
+        """Request and save the content of all given threads of a board, returns once every thread is done
+
+        :return: number of threads that were captured
+        """
+        return self.fetch_jobs([(board, thread_id) for thread_id in thread_ids])
+
+    def fetch_jobs(self, jobs):
+        """Request and save the content of threads that may belong to different boards, in the given order
+
+        :param jobs: list of (board, thread id) pairs
+        :return: number of threads that were captured
+        """
+        if not jobs:
+            return 0
+        return self._loop.run_until_complete(self._fetch_all(jobs))
+
+    def close(self):
+        """
+        Stop the worker threads and close the event loop
+        """
+        self._loop.run_until_complete(self._loop.shutdown_default_executor())
+        self._loop.close()
+
+    async def _fetch_all(self, jobs):
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        progress = {"done": 0, "captured": 0, "total": len(jobs), "start_time": time.time()}
+        n_workers = min(self.max_concurrent_requests, len(jobs))
+        workers = [asyncio.create_task(self._worker(queue, progress)) for _ in range(n_workers)]
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        return progress["captured"]
+
+    async def _worker(self, queue, progress):
+        while True:
+            board, thread_id = await queue.get()
+            try:
+                if board.is_paused():
+                    # the breaker opened during the batch, the thread waits until the board resumes
+                    board.defer_thread(thread_id)
+                    continue
+                thread_content = await self._fetch_thread(board, thread_id)
+                board.save_thread_content(thread_id, thread_content)
+                progress["done"] += 1
+                if thread_content is not None:
+                    progress["captured"] += 1
+
+                done, total = progress["done"], progress["total"]
+                remaining = (time.time() - progress["start_time"]) / done * (total - done)
+                self.logger.debug("%d/%d: Capturing post %s in /%s/ approximate seconds remaining for this batch %.0f", done, total, thread_id, board.board_code, remaining)
+            except Exception:
+                self.logger.exception(f"Unexpected error when capturing thread {thread_id} on board /{board.board_code}/")
+            finally:
+                queue.task_done()
+
+    async def _fetch_thread(self, board, thread_id):
+        # a failed request goes to the retry queue of the board instead of holding up this worker
+        board.stage_timer.add("wait", await self.rate_limiter.acquire_async())
+        thread_api_address, headers = board.prepare_thread_request(thread_id)
+        error = None
+        try:
+            request_response = await asyncio.to_thread(board.send_thread_request, thread_api_address, headers)
+        except requests.RequestException as e:
+            request_response, error = None, e
+        request_response = board.record_thread_response(thread_id, request_response, error)
+        board._check_retry(request_response, thread_id)
+        return board.read_thread_content(request_response)
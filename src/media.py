@@ -0,0 +1,182 @@
+from pathlib import Path
+import base64
+import hashlib
+import os
+import queue
+import threading
+import requests
+from ratelimit import TokenBucket
+from transport import Transport
+
+MEDIA_CAPTURES = ("thumbnails", "files", "both")
+
+
+def get_media_path(media_path, kind, md5, ext):
+    """
+    :param kind: "files" or "thumbnails"
+    :param md5: md5 of the file as hex digits
+    :return: path of a file in the content addressed store, <media path>/<kind>/<first two digits of md5>/<md5><ext>
+    """
+    return Path(media_path) / kind / md5[:2] / f"{md5}{ext if kind == 'files' else 's.jpg'}"
+
+
+class MediaFetcher:
+    """
+    Downloads the files and thumbnails attached to newly captured posts. They are stored content addressed by the md5
+    the API gives for every file, so a file that is reposted in many threads is only downloaded once, and the posts
+    point to their file through their md5. The downloads run in worker threads with their own connection pool and
+    their own byte rate limit, so they never take request tokens or connections from the thread fetches. Files wait
+    on a bounded queue, when it is full they are dropped and counted instead of holding up the capture
+    """
+    def __init__(
+        self,
+        media_path: Path,
+        logger,
+        media_base_url: str = "https://i.4cdn.org",
+        capture: str = "both",
+        workers: int = 2,
+        rate_limit_kb: int = 1024,
+        max_queue_size: int = 10000,
+        timeout=(10, 60),
+    ):
+        if capture not in MEDIA_CAPTURES:
+            raise ValueError(f"Unknown media capture '{capture}', choose from {', '.join(MEDIA_CAPTURES)}")
+        self.media_path = Path(media_path)
+        self.logger = logger
+        self.kinds = ["files", "thumbnails"] if capture == "both" else [capture]
+        # downloads hang up a worker until the (connect, read) timeout, not forever
+        self.transport = Transport(media_base_url, pool_maxsize=workers, timeout=timeout)
+        self._byte_bucket = None
+        if rate_limit_kb > 0:
+            # one token per byte, a second of downloads can be taken at once
+            self._byte_bucket = TokenBucket(1 / (rate_limit_kb * 1024), capacity=rate_limit_kb * 1024)
+        self.counts = {"downloaded": 0, "duplicate": 0, "failed": 0, "dropped": 0}
+        self.downloaded_bytes: int = 0
+        self._lock = threading.Lock()
+        self._queued = set() # (kind, md5) of the files queued or being downloaded
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = [threading.Thread(target=self._run, name=f"MediaFetcher-{i}", daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def publish(self, board_code, thread_id, posts):
+        """
+        Queue the files of new posts of a thread that are not stored yet
+        """
+        for post in posts:
+            if "tim" not in post or "md5" not in post or post.get("filedeleted"):
+                continue
+            md5 = base64.b64decode(post["md5"]).hex()
+            for kind in self.kinds:
+                self._submit(kind, board_code, post, md5)
+
+    def qsize(self):
+        """
+        :return: number of files waiting for a worker
+        """
+        return self._queue.qsize()
+
+    def summary(self):
+        """
+        :return: one line summary of the downloads, meant for logging
+        """
+        with self._lock:
+            counts = dict(self.counts)
+        return (
+            f"{counts['downloaded']} downloaded ({self.downloaded_bytes / 1024 / 1024:.1f} MB), {counts['duplicate']} duplicates, "
+            f"{counts['failed']} failed, {counts['dropped']} dropped, {self.qsize()} waiting"
+        )
+
+    def close(self):
+        """
+        Stop the workers after their current download, the files still queued are not downloaded
+        """
+        skipped_count = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            skipped_count += 1
+        if skipped_count:
+            self.logger.info(f"Stopping media capture, {skipped_count} queued files are not downloaded")
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.transport.close()
+
+    def _submit(self, kind, board_code, post, md5):
+        path = get_media_path(self.media_path, kind, md5, post.get("ext", ""))
+        key = (kind, md5)
+        with self._lock:
+            if key in self._queued or path.exists():
+                self.counts["duplicate"] += 1
+                return
+            self._queued.add(key)
+        try:
+            self._queue.put_nowait((kind, board_code, post["tim"], post.get("ext", ""), post.get("fsize", 0), md5, path))
+        except queue.Full:
+            with self._lock:
+                self._queued.discard(key)
+                if self.counts["dropped"] % 1000 == 0:
+                    self.logger.warning(f"Media queue is full, dropping files ({self.counts['dropped']} dropped so far)")
+                self.counts["dropped"] += 1
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                result = self._download(*job)
+                with self._lock:
+                    self.counts[result] += 1
+            except Exception:
+                self.logger.exception(f"Media download of {job[2]}{job[3]} failed")
+                with self._lock:
+                    self.counts["failed"] += 1
+            finally:
+                if job is not None:
+                    with self._lock:
+                        self._queued.discard((job[0], job[5]))
+                self._queue.task_done()
+
+    def _download(self, kind, board_code, tim, ext, fsize, md5, path):
+        """Download one file or thumbnail into the store
+
+        :return: "downloaded" or "failed"
+        """
+        # the size of a file is known up front, the one of a thumbnail only after its download
+        expected_bytes = fsize if kind == "files" else 0
+        if self._byte_bucket is not None and expected_bytes > 0:
+            self._byte_bucket.acquire(expected_bytes)
+        if kind == "files":
+            url, endpoint = self.transport.endpoints.media_file(board_code, tim, ext), "media_file"
+        else:
+            url, endpoint = self.transport.endpoints.thumbnail(board_code, tim), "thumbnail"
+        try:
+            request_response = self.transport.get(url, endpoint)
+        except requests.RequestException as e:
+            self.logger.debug("Media request %s failed: %s", url, e)
+            return "failed"
+        if request_response.status_code != 200:
+            self.logger.debug("Media request %s answered %d", url, request_response.status_code)
+            return "failed"
+
+        content = request_response.content
+        if self._byte_bucket is not None and len(content) > expected_bytes:
+            self._byte_bucket.acquire(len(content) - expected_bytes)
+        # thumbnails are made by the site, only the files themselves have the md5 to check against
+        if kind == "files" and hashlib.md5(content).hexdigest() != md5:
+            self.logger.warning(f"Media file {url} does not match its md5, not stored")
+            return "failed"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, "wb") as outfile:
+            outfile.write(content)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.downloaded_bytes += len(content)
+        return "downloaded"
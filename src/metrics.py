@@ -0,0 +1,119 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+
+class MetricFamily:
+    """
+    One metric in the Prometheus text format, with its samples for every label combination
+    """
+    def __init__(self, name, metric_type, documentation):
+        self.name = name
+        self.metric_type = metric_type
+        self.documentation = documentation
+        self.samples = []
+
+    def add(self, value, labels=None, suffix=""):
+        """
+        Add a sample, suffix is appended to the name, e.g. "_bucket" for histograms
+        """
+        self.samples.append((self.name + suffix, labels or {}, value))
+        return self
+
+    def add_histogram(self, upper_bounds, bucket_counts, total, count, labels=None):
+        """
+        Add the samples of a histogram from the number of observations in each bucket (not cumulative)
+        """
+        labels = labels or {}
+        cumulative = 0
+        for upper_bound, bucket_count in zip(upper_bounds, bucket_counts):
+            cumulative += bucket_count
+            self.add(cumulative, {**labels, "le": str(upper_bound)}, "_bucket")
+        self.add(count, {**labels, "le": "+Inf"}, "_bucket")
+        self.add(total, labels, "_sum")
+        self.add(count, labels, "_count")
+        return self
+
+    def render(self):
+        """
+        :return: the metric in the Prometheus text exposition format
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for name, labels, value in self.samples:
+            if labels:
+                label_text = ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint serving the metrics on /metrics from a background thread. The metrics are collected when they
+    are requested, by calling collect, which returns a list of MetricFamily
+    """
+    def __init__(self, collect, port: int, host: str = "127.0.0.1", logger=None):
+        self.collect = collect
+        self.logger = logger
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True)
+
+    @property
+    def port(self):
+        return self._server.server_port
+
+    def start(self):
+        self._thread.start()
+        if self.logger is not None:
+            self.logger.info(f"Serving metrics on http://{self._server.server_address[0]}:{self.port}/metrics")
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        metrics_server = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                try:
+                    body = "".join(family.render() for family in metrics_server.collect()).encode("utf-8")
+                except Exception:
+                    if metrics_server.logger is not None:
+                        metrics_server.logger.exception("Unexpected error when collecting metrics")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes are too frequent for the scraper log
+                pass
+
+        return MetricsHandler
+
+
+def status_label(status_code):
+    """
+    :return: label of a response status, server errors are grouped as "5xx"
+    """
+    return "5xx" if 500 <= status_code < 600 else str(status_code)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
@@ -0,0 +1,376 @@
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+
+class MockBoard:
+    """
+    Synthetic board for the mock API. Threads get new replies and new threads push the last thread off the board at
+    fixed rates, the state is advanced lazily whenever the board is requested
+    """
+    def __init__(self, board_code, threads_per_board, replies_per_thread, replies_per_second, threads_per_second, rng, start_post_no, media_files=(), media_rate=0.0):
+        self.board_code = board_code
+        self.threads_per_board = threads_per_board
+        self.replies_per_second = replies_per_second
+        self.threads_per_second = threads_per_second
+        self.rng = rng
+        self.media_files = media_files # file contents shared by all boards, posts attach them again and again like reposts
+        self.media_rate = media_rate
+        self.media = {} # tim -> index in media_files of the file attached to a post
+        self.next_post_no = start_post_no
+        self.threads = {} # thread id -> list of posts, the first one is the opening post
+        self.bump_order = [] # thread ids, most recently bumped first
+        self.archived = [] # ids of threads that fell off the board
+        self.last_advance = time.time()
+        self._pending_replies = 0.0
+        self._pending_threads = 0.0
+
+        for _ in range(threads_per_board):
+            thread_id = self._new_thread()
+            for _ in range(rng.randint(0, replies_per_thread * 2)):
+                self._new_reply(thread_id)
+
+    def advance(self):
+        """
+        Add the replies and threads that were posted since the last request
+        """
+        now = time.time()
+        elapsed = now - self.last_advance
+        self.last_advance = now
+        self._pending_replies += elapsed * self.replies_per_second
+        self._pending_threads += elapsed * self.threads_per_second
+
+        while self._pending_threads >= 1:
+            self._pending_threads -= 1
+            self._new_thread()
+            while len(self.bump_order) > self.threads_per_board:
+                dead_thread_id = self.bump_order.pop()
+                for post in self.threads.pop(dead_thread_id):
+                    self.media.pop(post.get("tim"), None)
+                self.archived = (self.archived + [dead_thread_id])[-3000:]
+        while self._pending_replies >= 1:
+            self._pending_replies -= 1
+            # busy threads near the top of the board get most replies
+            position = min(int(self.rng.expovariate(5 / len(self.bump_order))), len(self.bump_order) - 1)
+            self._new_reply(self.bump_order[position])
+
+    def thread_list(self, with_last_replies=False):
+        """
+        :return: threads.json, or catalog.json with with_last_replies, of the board, 15 threads per page
+        """
+        pages = []
+        for start in range(0, len(self.bump_order), 15):
+            threads = []
+            for thread_id in self.bump_order[start:start + 15]:
+                posts = self.threads[thread_id]
+                if with_last_replies:
+                    threads.append({
+                        **posts[0],
+                        "replies": len(posts) - 1,
+                        "last_modified": posts[0]["last_modified"],
+                        "omitted_posts": max(len(posts) - 6, 0),
+                        "last_replies": posts[1:][-5:],
+                    })
+                else:
+                    threads.append({"no": thread_id, "last_modified": posts[0]["last_modified"], "replies": len(posts) - 1})
+            pages.append({"page": len(pages) + 1, "threads": threads})
+        return pages
+
+    def thread_content(self, thread_id):
+        """
+        :return: thread content, None if the thread is not on the board
+        """
+        posts = self.threads.get(thread_id)
+        if posts is None:
+            return None
+        opening_post = {key: value for key, value in posts[0].items() if key != "last_modified"}
+        return {"posts": [{**opening_post, "replies": len(posts) - 1}] + posts[1:]}
+
+    def _new_thread(self):
+        thread_id = self._next_post_no()
+        now = int(time.time())
+        self.threads[thread_id] = [{
+            "no": thread_id, "resto": 0, "time": now, "last_modified": now, "sub": f"Thread {thread_id}", "com": self._comment(),
+            **self._attach_file(thread_id, now),
+        }]
+        self.bump_order.insert(0, thread_id)
+        return thread_id
+
+    def _new_reply(self, thread_id):
+        now = int(time.time())
+        post_no = self._next_post_no()
+        reply = {"no": post_no, "resto": thread_id, "time": now, "com": self._comment()}
+        if self.media_files and self.rng.random() < self.media_rate:
+            reply.update(self._attach_file(post_no, now))
+        self.threads[thread_id].append(reply)
+        self.threads[thread_id][0]["last_modified"] = now
+        self.bump_order.remove(thread_id)
+        self.bump_order.insert(0, thread_id)
+
+    def _attach_file(self, post_no, now):
+        """
+        :return: file fields of a post, a fixed file when the mock API has no media files
+        """
+        if not self.media_files:
+            return {"tim": now * 1000, "ext": ".jpg", "md5": "gP8R0+qEv/MBLCVaFcKY9Q==", "fsize": 1024}
+        # a few popular files get most reposts
+        index = min(int(self.rng.expovariate(5 / len(self.media_files))), len(self.media_files) - 1)
+        tim = now * 1000 + post_no % 1000
+        self.media[tim] = index
+        content = self.media_files[index]
+        md5 = base64.b64encode(hashlib.md5(content).digest()).decode()
+        return {"tim": tim, "ext": ".jpg", "md5": md5, "fsize": len(content), "w": 800, "h": 600, "tn_w": 250, "tn_h": 187}
+
+    def _next_post_no(self):
+        self.next_post_no += 1
+        return self.next_post_no
+
+    def _comment(self):
+        words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "eiusmod"]
+        return " ".join(self.rng.choice(words) for _ in range(self.rng.randint(3, 60)))
+
+
+class MockApiServer:
+    """
+    Local stand-in for the 4chan API, serving synthetic boards.json, threads.json, catalog.json, archive.json and
+    thread/<id>.json, so the scraper can be run and measured without touching the live site.
+    Conditional requests are answered with 304 when nothing changed. To see how the scraper copes, every response
+    can be delayed, and a share of the requests can be answered with 503, thread requests with 404, and conditional
+    requests with a stale 304. With media_files, posts carry files out of a pool of that many random files, which are
+    served with their thumbnails like on the media host, <board>/<tim>.jpg and <board>/<tim>s.jpg
+    """
+    def __init__(
+        self,
+        boards: int = 4,
+        threads_per_board: int = 150,
+        replies_per_thread: int = 30,
+        replies_per_second: float = 2,
+        threads_per_second: float = 0.05,
+        latency: float = 0.05,
+        not_modified_rate: float = 0.0,
+        not_found_rate: float = 0.0,
+        error_rate: float = 0.0,
+        port: int = 0,
+        seed: int = 0,
+        media_files: int = 0,
+        media_rate: float = 0.2,
+    ):
+        self.latency = latency
+        self.not_modified_rate = not_modified_rate
+        self.not_found_rate = not_found_rate
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        media_rng = random.Random(seed - 1)
+        self.media_files = [media_rng.randbytes(media_rng.randint(2048, 65536)) for _ in range(media_files)]
+
+        self._lock = threading.Lock()
+        self.boards = {}
+        for i in range(boards):
+            board_code = _board_code(i)
+            self.boards[board_code] = MockBoard(
+                board_code, threads_per_board, replies_per_thread, replies_per_second, threads_per_second,
+                random.Random(seed + i + 1), start_post_no=(i + 1) * 10_000_000, media_files=self.media_files, media_rate=media_rate,
+            )
+        self.request_counts = {} # (endpoint, status code) -> requests
+        self.bytes_sent = 0
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MockApiServer", daemon=True)
+
+    @property
+    def api_base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, path, headers):
+        """Answer one request
+
+        :return: (status code, body or None, Last-Modified timestamp or None)
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if path == "/boards.json":
+            return 200, {"boards": [{"board": board_code} for board_code in self.boards]}, None
+
+        with self._lock:
+            draw = self.rng.random()
+        if draw < self.error_rate:
+            return 503, None, None
+        # like a thread that was pruned between the thread list and its request
+        if draw < self.error_rate + self.not_found_rate and "/thread/" in path:
+            return 404, None, None
+        media_match = re.fullmatch(r"/(\w+)/(\d+)(s?)\.jpg", path)
+        if media_match is not None:
+            return self._respond_media(*media_match.groups())
+        match = re.fullmatch(r"/(\w+)/(threads|catalog|archive)\.json", path) or re.fullmatch(r"/(\w+)/thread/(\d+)\.json", path)
+        if match is None or match.group(1) not in self.boards:
+            return 404, None, None
+
+        board = self.boards[match.group(1)]
+        with self._lock:
+            board.advance()
+            if match.group(2) == "archive":
+                return 200, list(board.archived), None
+            if match.group(2) in ("threads", "catalog"):
+                body = board.thread_list(with_last_replies=match.group(2) == "catalog")
+                last_modified = max((posts[0]["last_modified"] for posts in board.threads.values()), default=None)
+            else:
+                body = board.thread_content(int(match.group(2)))
+                if body is None:
+                    return 404, None, None
+                last_modified = board.threads[int(match.group(2))][0]["last_modified"]
+
+        if_modified_since = headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and (last_modified <= since or 0 <= draw - self.error_rate - self.not_found_rate < self.not_modified_rate):
+                return 304, None, last_modified
+        return 200, body, last_modified
+
+    def _respond_media(self, board_code, tim, thumbnail):
+        board = self.boards.get(board_code)
+        with self._lock:
+            index = board.media.get(int(tim)) if board is not None else None
+        if index is None:
+            return 404, None, None
+        content = self.media_files[index]
+        # the thumbnail is a smaller file of its own
+        return 200, content[:2048] if thumbnail else content, None
+
+    def count_requests(self, endpoint=None, status_code=None):
+        """
+        :return: number of requests answered, optionally only for one endpoint ("boards", "threads", "catalog", "archive", "thread",
+            "media_file" or "thumbnail") and status
+        """
+        with self._lock:
+            return sum(
+                count for (request_endpoint, request_status), count in self.request_counts.items()
+                if endpoint in (None, request_endpoint) and status_code in (None, request_status)
+            )
+
+    def _record(self, path, status_code, n_bytes):
+        if path == "/boards.json":
+            endpoint = "boards"
+        elif "/thread/" in path:
+            endpoint = "thread"
+        elif path.endswith("s.jpg"):
+            endpoint = "thumbnail"
+        elif path.endswith(".jpg"):
+            endpoint = "media_file"
+        else:
+            endpoint = path.rsplit("/", 1)[-1].split(".")[0]
+        with self._lock:
+            key = (endpoint, status_code)
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+            self.bytes_sent += n_bytes
+
+    def _make_handler(self):
+        mock_api = self
+
+        class MockApiHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, like the CDN
+
+            def do_GET(self):
+                status_code, body, last_modified = mock_api.respond(self.path, self.headers)
+                data = b""
+                self.send_response(status_code)
+                if last_modified is not None:
+                    self.send_header("Last-Modified", formatdate(last_modified, usegmt=True))
+                if isinstance(body, bytes):
+                    data = body
+                    self.send_header("Content-Type", "image/jpeg")
+                elif body is not None:
+                    data = json.dumps(body).encode("utf-8")
+                    self.send_header("Content-Type", "application/json")
+                    if "gzip" in self.headers.get("Accept-Encoding", ""):
+                        data = gzip.compress(data, compresslevel=1)
+                        self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                mock_api._record(self.path, status_code, len(data))
+
+            def log_message(self, format, *args):
+                pass
+
+        return MockApiHandler
+
+
+def _board_code(i):
+    """
+    :return: short board code for the i-th synthetic board, "a" to "z" then "aa", "ab" ...
+    """
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return letters[i] if i < len(letters) else letters[i // len(letters) - 1] + letters[i % len(letters)]
+
+
+def add_mock_api_arguments(argparser):
+    """
+    Add the settings of the mock API to an argument parser
+    """
+    argparser.add_argument("--boards", type=int, default=4, help="Number of synthetic boards (default: 4)")
+    argparser.add_argument("--threads-per-board", type=int, default=150, help="Threads on each board (default: 150)")
+    argparser.add_argument("--replies-per-thread", type=int, default=30, help="Average number of replies of the initial threads (default: 30)")
+    argparser.add_argument("--replies-per-second", type=float, default=2, help="New replies per second on each board (default: 2)")
+    argparser.add_argument("--threads-per-second", type=float, default=0.05, help="New threads per second on each board (default: 0.05)")
+    argparser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response (default: 0.05)")
+    argparser.add_argument("--not-modified-rate", type=float, default=0.0, help="Share of conditional requests answered with a stale 304 (default: 0)")
+    argparser.add_argument("--not-found-rate", type=float, default=0.0, help="Share of thread requests answered with 404 (default: 0)")
+    argparser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests other than boards.json answered with 503 (default: 0)")
+    argparser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data (default: 0)")
+    argparser.add_argument("--media-files", type=int, default=0, help="Number of distinct files attached to posts and served as media, 0 serves none (default: 0)")
+    argparser.add_argument("--media-rate", type=float, default=0.2, help="Share of replies with a file attached (default: 0.2)")
+
+
+def get_mock_api_settings(args):
+    """
+    :return: keyword arguments of MockApiServer from arguments added by add_mock_api_arguments
+    """
+    return {
+        "boards": args.boards,
+        "threads_per_board": args.threads_per_board,
+        "replies_per_thread": args.replies_per_thread,
+        "replies_per_second": args.replies_per_second,
+        "threads_per_second": args.threads_per_second,
+        "latency": args.latency,
+        "not_modified_rate": args.not_modified_rate,
+        "not_found_rate": args.not_found_rate,
+        "error_rate": args.error_rate,
+        "seed": args.seed,
+        "media_files": args.media_files,
+        "media_rate": args.media_rate,
+    }
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Serve a synthetic 4chan API locally")
+    argparser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    add_mock_api_arguments(argparser)
+    args = argparser.parse_args()
+
+    mock_api = MockApiServer(port=args.port, **get_mock_api_settings(args)).start()
+    print(f"Serving the mock API on {mock_api.api_base_url}, run the scraper with --api-base-url {mock_api.api_base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock_api.close()
@@ -0,0 +1,198 @@
+from pathlib import Path
+from contextlib import contextmanager
+import functools
+import signal
+import sys
+import threading
+import time
+import traceback
+
+STAGES = ("wait", "fetch", "parse", "diff", "write")
+
+
+class StageTimer:
+    """
+    Time the crawl spends in each stage: waiting for the rate limit and the request intervals, fetching, parsing
+    responses, diffing thread lists and writing captures. Spans nest, a span only counts the time it does not spend
+    in a span inside it, so the stages of a sweep add up to at most its duration. With concurrent fetching the spans
+    of all threads are added up
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.total_seconds = dict.fromkeys(STAGES, 0.0) # since start, for the metrics
+        self._sweep_seconds = dict.fromkeys(STAGES, 0.0)
+        self._sweep_counts = dict.fromkeys(STAGES, 0)
+
+    @contextmanager
+    def span(self, stage):
+        """
+        Count the time of the with block in a stage
+        """
+        stack = self._local.__dict__.setdefault("stack", [])
+        now = time.perf_counter()
+        if stack:
+            # the outer span pauses until this one ends
+            self.add(stack[-1][0], now - stack[-1][1], count=False)
+        stack.append([stage, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            stage, start_time = stack.pop()
+            self.add(stage, now - start_time)
+            if stack:
+                stack[-1][1] = now
+
+    def add(self, stage, seconds, count=True):
+        """
+        Count time spent in a stage outside of a span, e.g. a wait reported by the rate limiter
+        """
+        with self._lock:
+            self.total_seconds[stage] += seconds
+            self._sweep_seconds[stage] += seconds
+            if count:
+                self._sweep_counts[stage] += 1
+
+    def start_sweep(self):
+        """
+        Forget the stage times of the current sweep
+        """
+        with self._lock:
+            self._sweep_seconds = dict.fromkeys(STAGES, 0.0)
+            self._sweep_counts = dict.fromkeys(STAGES, 0)
+
+    def sweep_summary(self, sweep_seconds):
+        """Summarize the stages since start_sweep and start the next sweep
+
+        :param sweep_seconds: duration of the sweep, the time outside of all stages is reported as other
+        :return: one line summary, meant for logging
+        """
+        with self._lock:
+            seconds, counts = self._sweep_seconds, self._sweep_counts
+        self.start_sweep()
+        parts = [f"{stage} {seconds[stage]:.2f}s ({counts[stage]})" for stage in STAGES]
+        parts.append(f"other {max(sweep_seconds - sum(seconds.values()), 0):.2f}s")
+        return ", ".join(parts)
+
+
+def timed_stage(stage):
+    """
+    Decorator counting a method in a stage of the stage_timer of its object
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.stage_timer.span(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def format_thread_stacks():
+    """
+    :return: the current stack of every thread of the process, as text
+    """
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    parts = []
+    for thread_id, frame in sys._current_frames().items():
+        parts.append(f"Thread {thread_names.get(thread_id, thread_id)}:\n" + "".join(traceback.format_stack(frame)))
+    return "\n".join(parts)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every interval seconds for a while and writes them in the collapsed stack format
+    (one "thread;outer function;...;inner function count" line per distinct stack), which flamegraph.pl, speedscope
+    and similar tools read. Started with the signal of install, so a running crawl can be profiled when it slows down
+    """
+    def __init__(self, profile_path: Path, logger, duration: float = 30, interval: float = 0.01):
+        self.profile_path = Path(profile_path)
+        self.logger = logger
+        self.duration = duration
+        self.interval = interval
+        self._thread = None
+
+    def install(self, signal_number=getattr(signal, "SIGUSR1", None)):
+        """Profile for duration seconds whenever the process gets the signal, only possible from the main thread
+
+        :return: True if the signal handler was installed, False where the signal does not exist, e.g. on Windows
+        """
+        if signal_number is None or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signal_number, lambda signum, frame: self.start())
+        return True
+
+    def start(self):
+        """
+        Start profiling in a background thread, unless a profile is being taken already
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        profile_file_path = self.profile_path / f"profile_{time.strftime('%Y_%m_%d_%H_%M_%S', time.gmtime())}.collapsed"
+        self.logger.info(f"Profiling for {self.duration:.0f} seconds into {profile_file_path}")
+        own_thread_id = threading.get_ident()
+        stack_counts = {}
+        sample_count = 0
+        end_time = time.monotonic() + self.duration
+        while time.monotonic() < end_time:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack = ";".join([thread_names.get(thread_id, str(thread_id))] + frames[::-1])
+                stack_counts[stack] = stack_counts.get(stack, 0) + 1
+            sample_count += 1
+            time.sleep(self.interval)
+
+        self.profile_path.mkdir(parents=True, exist_ok=True)
+        with open(profile_file_path, "w") as outfile:
+            for stack, count in sorted(stack_counts.items()):
+                outfile.write(f"{stack} {count}\n")
+        self.logger.info(f"Profile of {sample_count} samples written to {profile_file_path}")
+
+
+class StallWatchdog:
+    """
+    Logs the stack of every thread when no request finished for stall_timeout seconds, to see where a stuck crawl
+    hangs. It logs once per stall and again after requests finished in between
+    """
+    def __init__(self, get_last_progress, logger, stall_timeout: float = 600):
+        """
+        :param get_last_progress: returns the time.monotonic() time of the last finished request
+        """
+        self.get_last_progress = get_last_progress
+        self.logger = logger
+        self.stall_timeout = stall_timeout
+        self.stall_count = 0 # stalls seen since start
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="StallWatchdog", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        stalled = False
+        while not self._closed.wait(min(self.stall_timeout / 4, 30)):
+            idle_seconds = time.monotonic() - self.get_last_progress()
+            if idle_seconds < self.stall_timeout:
+                stalled = False
+            elif not stalled:
+                stalled = True
+                self.stall_count += 1
+                self.logger.warning(f"No request finished for {idle_seconds:.0f} seconds, stacks of all threads:\n{format_thread_stacks()}")
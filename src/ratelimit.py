@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every request of the scraper, one token is needed per request and tokens refill at one per
+    ``request_time_limit`` seconds, so the overall request rate stays within the API rules no matter how many requests
+    are waiting for a token at the same time
+    """
+    def __init__(self, request_time_limit: float = 1, capacity: float = 1):
+        self._lock = threading.Lock()
+        self._rate: float = 1 / request_time_limit
+        self._capacity: float = capacity
+        self._tokens: float = capacity
+        self._last_refill: float = time.monotonic()
+        self.waited_seconds: float = 0.0 # total time callers were told to wait for tokens
+
+    def reserve(self, tokens: float = 1):
+        """
+        Take tokens from the bucket, going into debt if there are not enough of them.
+        The caller has to wait the returned amount of seconds before using the tokens
+
+        :return: seconds to wait before the tokens can be used
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+            self._last_refill = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0
+            waiting = -self._tokens / self._rate
+            self.waited_seconds += waiting
+            return waiting
+
+    def set_rate(self, request_time_limit: float):
+        """
+        Change the rate to one token per request_time_limit seconds, tokens gained so far are kept
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+            self._last_refill = now
+            self._rate = 1 / request_time_limit
+
+    def acquire(self, tokens: float = 1):
+        """
+        Block the calling thread until the tokens are available
+
+        :return: seconds spent waiting
+        """
+        waiting = self.reserve(tokens)
+        if waiting > 0:
+            time.sleep(waiting)
+        return waiting
+
+    async def acquire_async(self, tokens: float = 1):
+        """
+        Same as acquire, but only suspends the calling coroutine
+
+        :return: seconds spent waiting
+        """
+        waiting = self.reserve(tokens)
+        if waiting > 0:
+            await asyncio.sleep(waiting)
+        return waiting
@@ -0,0 +1,62 @@
+import json
+import re
+
+# a key only matches outside of strings, quotes inside strings are escaped
+_POST_NUMBER_PATTERN = re.compile(rb'(?<!\\)"no"\s*:\s*(\d+)')
+_OBJECT_PATTERN = re.compile(rb"\{[^{}]*\}")
+_THREAD_LIST_FIELD_PATTERNS = {
+    field: re.compile(rb'(?<!\\)"' + field.encode() + rb'"\s*:\s*(\d+)') for field in ("no", "last_modified", "replies")
+}
+
+
+class RawJson:
+    """
+    A JSON response of the API kept as its body bytes, so it can be written to storage as it is instead of being
+    parsed and serialized again. The few fields the crawl needs are read from the bytes with regular expressions,
+    the whole document is only parsed when something asks for it, e.g. the post stream or the search index
+    """
+    def __init__(self, data: bytes):
+        self.data = data
+        self._parsed = None
+
+    def parse(self):
+        """
+        :return: the parsed document, parsed once on the first call
+        """
+        if self._parsed is None:
+            self._parsed = json.loads(self.data)
+        return self._parsed
+
+
+def load_json(content):
+    """
+    :return: the parsed document of a RawJson, anything else as it is
+    """
+    if isinstance(content, RawJson):
+        return content.parse()
+    return content
+
+
+def read_post_numbers(thread_content):
+    """
+    :return: post numbers of a thread in order, without parsing a RawJson
+    """
+    if isinstance(thread_content, RawJson):
+        return [int(post_no) for post_no in _POST_NUMBER_PATTERN.findall(thread_content.data)]
+    return [post["no"] for post in thread_content["posts"]]
+
+
+def read_thread_list_entries(thread_list):
+    """
+    :param thread_list: threads.json as pages of threads, parsed or RawJson
+    :return: list of (thread number, last_modified, replies) of every thread in board order
+    """
+    if isinstance(thread_list, RawJson):
+        # the threads are the only objects without objects inside them
+        entries = []
+        for thread in _OBJECT_PATTERN.findall(thread_list.data):
+            fields = [pattern.search(thread) for pattern in _THREAD_LIST_FIELD_PATTERNS.values()]
+            if all(fields):
+                entries.append(tuple(int(field.group(1)) for field in fields))
+        return entries
+    return [(thread["no"], thread["last_modified"], thread["replies"]) for page in thread_list for thread in page["threads"]]
@@ -1,9 +1,38 @@
 import time
 import logging
+import multiprocessing
+import sys
+import threading
 from pathlib import Path
-import requests
+from backfill import ArchiveBackfiller
 from board import Board
-from utils import LoggerManager, get_argparser, load_and_validate_config
+from checkpoint import BoardListCache, CrawlCheckpoint
+from compaction import DayCompactor
+from coordinator import Coordinator, CoordinatorClient
+from daemon import ConfigWatcher, install_signal_handler
+from media import MediaFetcher
+from fetcher import AsyncThreadFetcher
+from metrics import MetricFamily, MetricsServer, status_label
+from profiler import STAGES, SamplingProfiler, StageTimer, StallWatchdog
+from ratelimit import TokenBucket
+from retry import CircuitBreaker, RetryQueue
+from scheduler import BoardPollPlanner, ThreadScheduler
+from state_store import CrawlStateStore
+from search_index import SearchIndex, get_default_index_path
+from simulator import TraceRecorder
+from sinks import PostStream, create_post_sink
+from storage import WriteBehindWriter
+from transport import LATENCY_BUCKETS, Transport
+from utils import LoggerManager, get_argparser, load_and_validate_config, get_optional_settings
+
+# settings a daemon applies when its configuration changes, the others take effect after a restart
+LIVE_SETTINGS = {
+    "boards", "exclude_boards", "request_time_limit", "save_log", "clean_log", "json_log", "log_max_mb", "log_backup_count",
+    "debug_log_sampling", "min_poll_interval", "max_poll_interval", "scheduler_refresh_interval", "retry_max_attempts",
+    "retry_base_delay", "retry_max_delay", "breaker_failure_threshold", "breaker_reset_timeout", "board_list_ttl",
+    "daemon", "config_watch_interval",
+}
+LOG_SETTINGS = ["save_log", "json_log", "log_max_mb", "log_backup_count", "debug_log_sampling"]
 
 class Requester:
     """
@@ -16,26 +45,218 @@ class Requester:
         request_time_limit: float = 1,
         output_path: str = str(Path(__file__).resolve().parents[1]),
         save_log: bool = True,
-        clean_log: bool = True
+        clean_log: bool = True,
+        async_fetch: bool = False,
+        max_concurrent_requests: int = 4,
+        persist_state: bool = True,
+        storage_mode: str = "snapshot",
+        write_behind: bool = False,
+        write_queue_size: int = 256,
+        segment_compression: str = "gzip",
+        search_index: bool = False,
+        scheduling: str = "round_robin",
+        scheduler_refresh_interval: float = 60,
+        adaptive_polling: bool = False,
+        min_poll_interval: float = 10,
+        max_poll_interval: float = 300,
+        catalog_delta: bool = False,
+        backfill: bool = False,
+        backfill_interval: float = 3600,
+        metrics_port: int = 0,
+        api_base_url: str = "https://a.4cdn.org",
+        checkpoint_interval: float = 300,
+        board_list_ttl: float = 86400,
+        workers: int = 1,
+        coordinator_address: str = "",
+        worker_id: str = "",
+        post_sink: str = "",
+        post_sink_path: str = "",
+        post_sink_queue_size: int = 10000,
+        post_sink_backpressure: str = "block",
+        post_sink_rotate_mb: int = 100,
+        compaction_interval: float = 0,
+        retry_max_attempts: int = 6,
+        retry_base_delay: float = 5,
+        retry_max_delay: float = 300,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 60,
+        json_log: bool = False,
+        log_max_mb: int = 50,
+        log_backup_count: int = 5,
+        debug_log_sampling: int = 10,
+        record_traces: bool = False,
+        profile_seconds: float = 0,
+        stall_timeout: float = 0,
+        raw_passthrough: bool = False,
+        daemon: bool = False,
+        config_watch_interval: float = 5,
+        media_capture: str = "",
+        media_base_url: str = "https://i.4cdn.org",
+        media_workers: int = 2,
+        media_rate_limit_kb: int = 1024,
+        media_queue_size: int = 10000,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+        config_path: str = ""
     ):
+        # kept to start worker processes with the same settings
+        self._settings: dict = {key: value for key, value in locals().items() if key != "self"}
         if output_path == "":
             output_path = str(Path(__file__).resolve().parents[1])
         output_path = Path(output_path)
         self._base_save_path: Path = output_path / "data" # .resolve() creates absolute path
-        print(self._base_save_path)
+        # stderr, the standard output may carry the post stream
+        print(self._base_save_path, file=sys.stderr)
         # Setup Logger
-        self._log_manager = LoggerManager(self._base_save_path, "log", save_log)
+        self._log_manager = LoggerManager(self._base_save_path, "log", save_log, json_log, log_max_mb, log_backup_count, debug_log_sampling)
         self._log_manager.setup_logging(stream_log_level=logging.INFO)
         self.logger = self._log_manager.get_logger()
         self._clean_log = clean_log
 
-        # Setup request time interval variables
-        self._last_request = None
+        # Setup request time interval variables, one token bucket is shared by all requests
         self._request_time_limit: float = request_time_limit
+        self._coordinator_client = None
+        if coordinator_address:
+            # worker of a sharded crawl, the boards and the request tokens come from the coordinator
+            self._coordinator_client = CoordinatorClient(coordinator_address, worker_id or None)
+            self._rate_limiter = self._coordinator_client
+        else:
+            self._rate_limiter = TokenBucket(request_time_limit)
 
-        # Setup monitoring boards
+        # Setup the pooled HTTP transport shared by all boards
+        self._transport = Transport(api_base_url, pool_maxsize=max_concurrent_requests, timeout=(connect_timeout, read_timeout))
+        self._board_list_cache = BoardListCache(self._base_save_path / "state" / "board_list.json", board_list_ttl)
         self._include_boards: list = boards
         self._exclude_boards: bool = exclude_boards
+
+        # Sharded crawl on this host, this process only coordinates the worker processes
+        if workers > 1:
+            self._run_workers(workers)
+            return
+
+        # Setup the crawl state store, so conditional requests survive restarts
+        self._state_store = None
+        if persist_state:
+            self._state_store = CrawlStateStore(self._base_save_path / "state" / "crawl_state.sqlite3")
+
+        # Setup concurrent thread fetching, None keeps the sequential pipeline
+        self._async_fetcher = None
+        self._fetch_batch_size = 1
+        if async_fetch:
+            self._async_fetcher = AsyncThreadFetcher(self._rate_limiter, self.logger, max_concurrent_requests)
+            self._fetch_batch_size = max_concurrent_requests * 2
+
+        # Setup thread scheduling, None keeps going through the boards one after another
+        if scheduling not in ["round_robin", "priority"]:
+            raise ValueError(f"Unknown scheduling '{scheduling}', choose from round_robin, priority")
+        self._adaptive_polling: bool = adaptive_polling
+        if adaptive_polling and scheduling != "priority":
+            self.logger.info("Adaptive polling uses the priority scheduling")
+            scheduling = "priority"
+        self._scheduler = ThreadScheduler() if scheduling == "priority" else None
+        self._scheduler_refresh_interval: float = scheduler_refresh_interval
+        self._poll_planner = None
+        self._min_poll_interval: float = min_poll_interval
+        self._max_poll_interval: float = max_poll_interval
+        self._catalog_delta: bool = catalog_delta
+
+        # Setup the retries of failed requests and the circuit breaker settings of the boards
+        self._retry_queue = RetryQueue(retry_base_delay, retry_max_delay, retry_max_attempts)
+        self._breaker_failure_threshold: int = breaker_failure_threshold
+        self._breaker_reset_timeout: float = breaker_reset_timeout
+
+        # Setup how thread contents are stored
+        self._storage_mode: str = storage_mode
+        self._storage_options: dict = {}
+        if storage_mode == "segmented":
+            self._storage_options["compression"] = segment_compression
+        self._raw_passthrough: bool = raw_passthrough
+        self._writer = None
+        if write_behind:
+            self._writer = WriteBehindWriter(self.logger, write_queue_size)
+
+        # Setup the archive backfill, None never captures the archived state of threads. It runs in the background with
+        # one download at a time, the live crawl waits for at most one of its requests at the shared rate limiter
+        self._backfiller = None
+        if backfill:
+            self._backfiller = ArchiveBackfiller(
+                self._transport, self._rate_limiter, self.logger, self._base_save_path, 1, backfill_interval=backfill_interval
+            )
+
+        # Setup live full-text indexing of captured posts
+        self._search_index = None
+        if search_index:
+            self._search_index = SearchIndex(get_default_index_path(self._base_save_path))
+
+        # Setup the stream of newly captured posts, an empty post_sink disables it
+        self._post_stream = None
+        if post_sink:
+            self._post_stream = PostStream(
+                create_post_sink(post_sink, self._base_save_path, post_sink_path, post_sink_rotate_mb),
+                self.logger,
+                post_sink_queue_size,
+                post_sink_backpressure,
+            )
+
+        # Setup the capture of the files of new posts, an empty media_capture disables it
+        self._media_fetcher = None
+        if media_capture:
+            self._media_fetcher = MediaFetcher(
+                self._base_save_path / "media", self.logger, media_base_url, media_capture, media_workers, media_rate_limit_kb, media_queue_size,
+                timeout=(connect_timeout, read_timeout),
+            )
+
+        # Setup the recording of every thread list as traces for the crawl simulator
+        self._trace_recorder = TraceRecorder(self._base_save_path) if record_traces else None
+
+        # Setup the timing of the crawl stages, the profiler of a running crawl and the stall watchdog, the profiler
+        # and the watchdog are off by default. The signal handler of the profiler can only be installed from the main
+        # thread, a requester embedded in another thread leaves the process' SIGUSR1 alone
+        self._stage_timer = StageTimer()
+        self._profiler = None
+        if profile_seconds > 0:
+            self._profiler = SamplingProfiler(self._base_save_path / "profiles", self.logger, profile_seconds)
+            if not self._profiler.install():
+                self.logger.warning("Profiling on SIGUSR1 is not available, it needs the signal and the requester in the main thread")
+                self._profiler = None
+        self._watchdog = None
+        if stall_timeout > 0:
+            self._watchdog = StallWatchdog(lambda: self._transport.stats.last_request_time, self.logger, stall_timeout)
+
+        # Setup the metrics endpoint, port 0 disables it
+        self._metrics_server = None
+        if metrics_port:
+            self._metrics_server = MetricsServer(self._collect_metrics, metrics_port, logger=self.logger)
+
+        # Setup the warm start state, a checkpoint interval of 0 disables the checkpoint
+        self._checkpoint = None
+        self._checkpoint_interval: float = checkpoint_interval
+        self._next_checkpoint_time: float = time.time() + checkpoint_interval
+        self._checkpoint_data = None
+        if checkpoint_interval > 0:
+            self._checkpoint = CrawlCheckpoint(self._base_save_path / "state" / "checkpoint.json")
+            self._checkpoint_data = self._checkpoint.load()
+
+        # Setup the compaction of closed days, an interval of 0 leaves the day partitions as they are
+        self._compactor = None
+        self._compaction_interval: float = compaction_interval
+        if compaction_interval > 0:
+            self._compactor = DayCompactor(self._base_save_path, self.logger, segment_compression)
+
+        # Setup the daemon mode: the configuration is reloaded when its file changes or on SIGHUP, the board list is
+        # refreshed every board_list_ttl seconds, and SIGTERM stops the crawl with a final flush of the state
+        self._stop_event = threading.Event()
+        self._daemon: bool = daemon
+        self._config_watcher = None
+        self._board_list_ttl: float = board_list_ttl
+        self._next_board_list_refresh: float = time.time() + (board_list_ttl or 3600)
+        self._retired_boards = {} # board code -> Board that was retired, its state is kept in case it comes back
+        if daemon:
+            self._config_watcher = ConfigWatcher(config_path or None, config_watch_interval)
+            install_signal_handler("SIGHUP", self._config_watcher.request_reload)
+            install_signal_handler("SIGTERM", self._stop_event.set)
+
+        # Setup monitoring boards
         self._monitoring_boards = self._set_monitoring_boards()
 
         # Start scraping pipeline
@@ -48,16 +269,264 @@ class Requester:
         self.logger.info("Beginning monitoring")
         self.logger.info(f"Storing data in path: {self._base_save_path}")
         self.logger.debug("Monitoring Started")
-        self._run_scraping_pipeline()
+        if self._metrics_server is not None:
+            self._metrics_server.start()
+        if self._compactor is not None:
+            self._compactor.start(self._compaction_interval)
+        if self._backfiller is not None:
+            self._backfiller.start(lambda: [board.board_code for board in self._monitoring_boards])
+        if self._watchdog is not None:
+            self._watchdog.start()
+        try:
+            if self._scheduler is not None:
+                self._run_scheduled_pipeline()
+            else:
+                self._run_scraping_pipeline()
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        """
+        Write out everything still queued and close the open resources
+        """
+        self.logger.info("Shutting down, flushing pending writes")
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+        if self._watchdog is not None:
+            self._watchdog.close()
+        if self._compactor is not None:
+            self._compactor.close()
+        if self._backfiller is not None:
+            self._backfiller.close()
+        if self._writer is not None:
+            self._writer.close()
+        if self._checkpoint is not None:
+            # after the writer is drained, so the checkpoint never runs ahead of the saved data
+            self._save_checkpoint()
+        if self._state_store is not None:
+            self._state_store.close()
+        if self._search_index is not None:
+            self._search_index.close()
+        if self._post_stream is not None:
+            self._post_stream.close()
+        if self._media_fetcher is not None:
+            self._media_fetcher.close()
+        if self._async_fetcher is not None:
+            self._async_fetcher.close()
+        self._transport.close()
+        if self._coordinator_client is not None:
+            self._coordinator_client.close()
+        self._log_manager.close()
+
+    def _run_workers(self, n_workers):
+        """
+        Split the boards over worker processes on this host. The workers lease their request tokens from a coordinator
+        in this process, so together they keep to request_time_limit, and each writes to its own partition under
+        <output_path>/partitions/<worker id>. The boards of a worker that stops are reassigned to the others
+        """
+        coordinator = Coordinator(self._get_board_codes(), self._request_time_limit, logger=self.logger).start()
+        # spawn, so the workers do not inherit the coordinator's sockets and threads
+        context = multiprocessing.get_context("spawn")
+        processes = {}
+        for i in range(n_workers):
+            worker_id = f"worker-{i}"
+            worker_settings = {
+                **self._settings,
+                "boards": [],
+                "output_path": str(self._base_save_path.parent / "partitions" / worker_id),
+                "workers": 1,
+                "coordinator_address": coordinator.address,
+                "worker_id": worker_id,
+                # every worker serves its own metrics on the following ports
+                "metrics_port": self._settings["metrics_port"] + i + 1 if self._settings["metrics_port"] else 0,
+            }
+            processes[worker_id] = context.Process(target=run_worker, args=(worker_settings,), name=worker_id)
+            processes[worker_id].start()
+
+        try:
+            while processes:
+                time.sleep(1)
+                for worker_id, process in list(processes.items()):
+                    if not process.is_alive():
+                        self.logger.warning(f"Worker {worker_id} stopped with exit code {process.exitcode}")
+                        coordinator.remove_worker(worker_id)
+                        del processes[worker_id]
+        finally:
+            # on Ctrl-C the workers get the interrupt too and shut down on their own
+            for process in processes.values():
+                process.join(timeout=60)
+                if process.is_alive():
+                    process.terminate()
+            coordinator.close()
+            self._transport.close()
+            self._log_manager.close()
+
+    def _sync_board_assignment(self):
+        """
+        Follow the boards the coordinator assigns to this worker, boards move between workers when one joins or fails
+        """
+        if self._coordinator_client is None:
+            return
+        assigned_boards = list(self._coordinator_client.assigned_boards)
+        monitoring_boards = {board.board_code: board for board in self._monitoring_boards}
+        for board_code, board in monitoring_boards.items():
+            if board_code not in assigned_boards:
+                self.logger.info(f"/{board_code}/ was assigned to another worker")
+                self._retire_board(board)
+        for board_code in assigned_boards:
+            if board_code not in monitoring_boards:
+                self.logger.info(f"/{board_code}/ was assigned to this worker")
+                self._add_board(board_code)
+
+    def _add_board(self, board_code):
+        """
+        Start monitoring a board, a board that was retired before continues with the state it had
+        """
+        board = self._retired_boards.pop(board_code, None) or self._create_board(board_code)
+        self._monitoring_boards.append(board)
+        if self._poll_planner is not None:
+            self._poll_planner.add(board)
+
+    def _retire_board(self, board):
+        """
+        Stop monitoring a board and drop its waiting fetches and retries
+        """
+        self._monitoring_boards.remove(board)
+        if self._poll_planner is not None:
+            self._poll_planner.remove(board)
+        if self._scheduler is not None:
+            self._scheduler.drop_board(board)
+        self._retry_queue.drop_board(board)
+        self._retired_boards[board.board_code] = board
+
+    def _run_daemon_tasks(self):
+        """
+        In daemon mode, apply a changed configuration and refresh the board list when it is due
+        """
+        if not self._daemon:
+            return
+        if self._config_watcher.reload_due():
+            self._reload_config()
+        if time.time() >= self._next_board_list_refresh:
+            self._next_board_list_refresh = time.time() + (self._board_list_ttl or 3600)
+            self._sync_board_set()
+
+    def _reload_config(self):
+        """
+        Read the configuration file again and apply the settings that changed, see LIVE_SETTINGS
+        """
+        try:
+            config = self._config_watcher.load()
+        except (FileNotFoundError, ValueError) as e:
+            self.logger.error(f"Configuration not reloaded, keeping the current one: {e}")
+            return
+        if config is None:
+            # started without a configuration file, a reload only requests the board list again
+            self.logger.info("Reload requested, refreshing the board list")
+            self._board_list_cache.invalidate()
+            self._sync_board_set()
+            return
+
+        required_keys = ["boards", "exclude_boards", "request_time_limit", "output_path", "save_log", "clean_log"]
+        settings = {key: config.get(key, self._settings[key]) for key in required_keys}
+        settings.update(get_optional_settings(config))
+        changed = {key for key, value in settings.items() if self._settings.get(key) != value}
+        if not changed:
+            self.logger.info("Configuration reloaded, nothing changed")
+            return
+        self.logger.info(f"Configuration reloaded, changed: {', '.join(sorted(changed))}")
+        self._settings.update(settings)
+
+        if changed.intersection(LOG_SETTINGS):
+            self._log_manager.reconfigure(*(settings[key] for key in LOG_SETTINGS))
+        if "clean_log" in changed:
+            self._clean_log = settings["clean_log"]
+        if "request_time_limit" in changed:
+            if self._coordinator_client is not None:
+                self.logger.warning("The request rate of a worker is set by its coordinator")
+            else:
+                self._request_time_limit = settings["request_time_limit"]
+                self._rate_limiter.set_rate(self._request_time_limit)
+        if changed.intersection(["min_poll_interval", "max_poll_interval"]):
+            self._min_poll_interval = settings["min_poll_interval"]
+            self._max_poll_interval = settings["max_poll_interval"]
+            for board in self._monitoring_boards:
+                board.min_poll_interval = max(self._min_poll_interval, board.thread_list_request_interval)
+                board.max_poll_interval = max(self._max_poll_interval, board.min_poll_interval)
+        if "scheduler_refresh_interval" in changed:
+            self._scheduler_refresh_interval = settings["scheduler_refresh_interval"]
+            if self._poll_planner is not None:
+                self._poll_planner.fixed_interval = self._scheduler_refresh_interval
+        self._retry_queue.base_delay = settings["retry_base_delay"]
+        self._retry_queue.max_delay = settings["retry_max_delay"]
+        self._retry_queue.max_attempts = settings["retry_max_attempts"]
+        if changed.intersection(["breaker_failure_threshold", "breaker_reset_timeout"]):
+            self._breaker_failure_threshold = settings["breaker_failure_threshold"]
+            self._breaker_reset_timeout = settings["breaker_reset_timeout"]
+            for board in self._monitoring_boards:
+                board.circuit_breaker.failure_threshold = self._breaker_failure_threshold
+                board.circuit_breaker.reset_timeout = self._breaker_reset_timeout
+        if "board_list_ttl" in changed:
+            self._board_list_ttl = settings["board_list_ttl"]
+            self._board_list_cache.ttl = self._board_list_ttl
+        if "config_watch_interval" in changed:
+            self._config_watcher.check_interval = settings["config_watch_interval"]
+        if changed.intersection(["boards", "exclude_boards"]):
+            self._include_boards = settings["boards"]
+            self._exclude_boards = settings["exclude_boards"]
+            self._sync_board_set()
+
+        restart_settings = changed.difference(LIVE_SETTINGS)
+        if restart_settings:
+            self.logger.warning(f"Changes of {', '.join(sorted(restart_settings))} take effect after a restart")
+
+    def _sync_board_set(self):
+        """
+        Add the boards that should be monitored now and retire the ones that should not, e.g. after the boards in the
+        configuration changed or boards.json lists new boards. The boards that stay keep all their state
+        """
+        if self._coordinator_client is not None:
+            # the coordinator decides the boards of a worker
+            return
+        try:
+            board_codes = self._get_board_codes()
+        except (KeyError, OSError, ValueError) as e:
+            self.logger.error(f"Board list not updated, keeping the current boards: {e}")
+            return
+        monitoring_boards = {board.board_code: board for board in self._monitoring_boards}
+        for board_code, board in monitoring_boards.items():
+            if board_code not in board_codes:
+                self.logger.info(f"Retiring /{board_code}/")
+                self._retire_board(board)
+        for board_code in board_codes:
+            if board_code not in monitoring_boards:
+                self.logger.info(f"Adding /{board_code}/")
+                self._add_board(board_code)
     
     def _run_scraping_pipeline(self):
         self.logger.debug("scraping_pipeline_monitoring entered")
 
         # Data Collection Loop
-        while True:
+        while not self._stop_event.is_set():
             self.logger.debug("Started loop")
-            #TODO add check new board mechanism?
-            for board in self._monitoring_boards:
+            self._sync_board_assignment()
+            if not self._monitoring_boards:
+                # a worker has no boards until another worker fails
+                self._stop_event.wait(5)
+            polled_count = 0 # boards and retries requested in this round
+            for board in list(self._monitoring_boards):
+                # boards added on the way join the next round
+                self._run_daemon_tasks()
+                if self._stop_event.is_set():
+                    break
+                if board not in self._monitoring_boards:
+                    continue
+                if board.is_paused():
+                    self.logger.debug(f"Skipping /{board.board_code}/, its circuit breaker is open")
+                    continue
+                sweep_start_time = time.time()
+                self._stage_timer.start_sweep()
+                polled_count += 1
 
                 self._check_time_and_wait()
                 online_thread_list = board.get_online_thread_list()
@@ -67,30 +536,228 @@ class Requester:
                     threads_to_update = board.get_threads_to_update(online_thread_list)
                     
                     self.logger.info(f"Updating posts in {board.board_code}")
-                    n_threads_to_update = len(threads_to_update)
-                    i = 1
-                    for thread_id in threads_to_update: #TODO incorporate getting thread content"s" without looping here?
-                        start_time = time.time()
-
-                        self._check_time_and_wait()
-                        thread_content = board.get_thread_content(thread_id)
-                        board.save_thread_content(thread_id, thread_content)
-
-                        current_time_diff = (time.time() - start_time) * (n_threads_to_update - i)
-                        self.logger.debug(f"{i}/{n_threads_to_update}: Capturing post {thread_id} in /{board.board_code}/ approximate seconds remaining for this board {current_time_diff:n}")
-                        i += 1
+                    if self._async_fetcher is not None:
+                        self._async_fetcher.fetch_threads(board, threads_to_update)
+                    else:
+                        self._fetch_threads_sequentially(board, threads_to_update)
+                board.last_sweep_seconds = time.time() - sweep_start_time
+                self.logger.info(f"Sweep of /{board.board_code}/ took {board.last_sweep_seconds:.1f}s: {self._stage_timer.sweep_summary(board.last_sweep_seconds)}")
                 self.logger.debug(f"Ended /{board.board_code}/ collection")
+                # retries go between the boards, so a failing thread never holds up the rest
+                polled_count += self._fetch_due_retries()
+            if polled_count == 0 and self._monitoring_boards:
+                # every board is paused by its circuit breaker, nothing to log until one of them is requested again
+                self._wait_for_paused_boards()
+                self._save_checkpoint_if_due()
+                continue
             self.logger.debug("Ended loop")
+            self.logger.info(f"Requests so far: {self._transport.stats.summary()}")
+            if self._media_fetcher is not None:
+                self.logger.info(f"Media: {self._media_fetcher.summary()}")
+            self._log_retry_state()
+            self._save_checkpoint_if_due()
 
             if self._clean_log:
                 self.logger.debug("Cleaning Log")
                 self._log_manager.cleanup_old_logs(days_to_keep=3)
 
+    def _run_scheduled_pipeline(self):
+        """
+        Scraping loop with priority scheduling. The thread lists of the boards that are due are refreshed, then the waiting
+        threads of all boards are fetched in order of priority until the queue is empty or the next board is due
+        """
+        self.logger.debug("scheduled_pipeline_monitoring entered")
+        next_polls = None
+        if self._checkpoint_data is not None:
+            next_polls = self._checkpoint_data["next_polls"]
+            self._scheduler.restore_pending(self._monitoring_boards, self._checkpoint_data["scheduler"])
+            self.logger.info(f"{len(self._scheduler)} waiting threads restored from the checkpoint")
+        self._poll_planner = BoardPollPlanner(self._monitoring_boards, self._adaptive_polling, self._scheduler_refresh_interval, next_polls)
+        next_report_time = time.time() + self._scheduler_refresh_interval
+        last_report_time = time.time()
+        self._stage_timer.start_sweep()
+
+        while not self._stop_event.is_set():
+            self._sync_board_assignment()
+            self._run_daemon_tasks()
+            polling_start_time = time.time()
+            for board in self._poll_planner.pop_due_boards():
+                self._refresh_board_schedule(board)
+                poll_interval = self._poll_planner.schedule(board)
+                self.logger.debug(f"Next poll of /{board.board_code}/ in {poll_interval:.0f} seconds")
+
+            # fetching gets at least as much time as polling took, so short poll intervals cannot starve it
+            fetch_deadline = max(
+                time.time() + self._poll_planner.seconds_until_next_poll(),
+                time.time() + (time.time() - polling_start_time),
+            )
+            while len(self._scheduler) > 0 and time.time() < fetch_deadline and not self._stop_event.is_set():
+                self._fetch_due_retries()
+                self._fetch_jobs(self._scheduler.pop_batch(self._fetch_batch_size))
+            self._fetch_due_retries()
+            if len(self._scheduler) == 0:
+                idle_seconds = min(self._poll_planner.seconds_until_next_poll(), self._retry_queue.seconds_until_next())
+                if self._config_watcher is not None:
+                    idle_seconds = min(idle_seconds, self._config_watcher.check_interval)
+                with self._stage_timer.span("wait"):
+                    self._stop_event.wait(idle_seconds)
+            self._save_checkpoint_if_due()
+
+            if time.time() >= next_report_time:
+                next_report_time = time.time() + self._scheduler_refresh_interval
+                self.logger.info(f"Requests so far: {self._transport.stats.summary()}")
+                self.logger.info(f"Scheduler: {self._scheduler.summary()}")
+                if self._media_fetcher is not None:
+                    self.logger.info(f"Media: {self._media_fetcher.summary()}")
+                # the stages of every poll and fetch since the last report
+                self.logger.info(f"Stages over the last {time.time() - last_report_time:.0f}s: {self._stage_timer.sweep_summary(time.time() - last_report_time)}")
+                last_report_time = time.time()
+                self._log_retry_state()
+                if self._adaptive_polling:
+                    self.logger.info("Poll intervals: " + ", ".join(
+                        f"/{board.board_code}/ {board.get_poll_interval():.0f}s" for board in self._monitoring_boards
+                    ))
+
+                if self._clean_log:
+                    self.logger.debug("Cleaning Log")
+                    self._log_manager.cleanup_old_logs(days_to_keep=3)
+
+    def _refresh_board_schedule(self, board):
+        """
+        Request the thread list of a board, record its dead threads and queue its threads that need an update
+        """
+        if board.is_paused():
+            self.logger.debug(f"Skipping /{board.board_code}/, its circuit breaker is open")
+            return
+        sweep_start_time = time.time()
+        self._check_time_and_wait()
+        online_thread_list = board.get_online_thread_list()
+        if online_thread_list is not None:
+            board.save_thread_list(online_thread_list)
+            tracked_before = set(board.tracking_threads)
+            threads_to_update = board.get_threads_to_update(online_thread_list)
+            self._scheduler.record_deaths(board, tracked_before.difference(board.tracking_threads))
+            self._scheduler.push_board_threads(board, threads_to_update)
+        board.last_sweep_seconds = time.time() - sweep_start_time
+
+    def _save_checkpoint_if_due(self):
+        """
+        Write the checkpoint every checkpoint_interval seconds
+        """
+        if self._checkpoint is None or time.time() < self._next_checkpoint_time:
+            return
+        self._next_checkpoint_time = time.time() + self._checkpoint_interval
+        self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        start_time = time.time()
+        self._checkpoint.save(self._monitoring_boards, self._scheduler, self._poll_planner)
+        self.logger.debug(f"Checkpoint written in {time.time() - start_time:.3f} seconds")
+
+    def _fetch_due_retries(self):
+        """Request the failed threads whose backoff is over
+
+        :return: number of threads requested
+        """
+        jobs = []
+        for board, thread_id in self._retry_queue.pop_due():
+            if thread_id not in board.tracking_threads:
+                # died while waiting
+                board.retry_attempts.pop(thread_id, None)
+                continue
+            jobs.append((board, thread_id))
+        self._fetch_jobs(jobs)
+        return len(jobs)
+
+    def _wait_for_paused_boards(self):
+        """
+        Wait until the first circuit breaker lets requests through again or the next retry is due
+        """
+        idle_seconds = min(
+            [board.circuit_breaker.seconds_until_retry() for board in self._monitoring_boards] + [self._retry_queue.seconds_until_next()]
+        )
+        if self._config_watcher is not None:
+            idle_seconds = min(idle_seconds, self._config_watcher.check_interval)
+        self.logger.debug("All boards paused, waiting %.1f seconds", idle_seconds)
+        with self._stage_timer.span("wait"):
+            self._stop_event.wait(idle_seconds)
+
+    def _log_retry_state(self):
+        """
+        Log the retry queue and the circuit breakers that are not closed
+        """
+        self.logger.info(f"Retries: {self._retry_queue.summary()}")
+        breakers = [board.circuit_breaker.summary() for board in self._monitoring_boards if board.circuit_breaker.state != "closed"]
+        if breakers:
+            self.logger.warning(f"Circuit breakers: {'; '.join(breakers)}")
+
+    def _fetch_jobs(self, jobs):
+        """
+        Request and save a batch of (board, thread id) pairs, in order
+        """
+        for board, _ in jobs:
+            # threads restored from the checkpoint may belong to boards that were not polled yet
+            board.initialize()
+        if self._async_fetcher is not None:
+            self._async_fetcher.fetch_jobs(jobs)
+            return
+        for board, thread_id in jobs:
+            if board.is_paused():
+                board.defer_thread(thread_id)
+                continue
+            self._check_time_and_wait()
+            thread_content = board.get_thread_content(thread_id)
+            board.save_thread_content(thread_id, thread_content)
+
+    def _fetch_threads_sequentially(self, board, threads_to_update):
+        """
+        Request and save the threads one after another
+        """
+        n_threads_to_update = len(threads_to_update)
+        i = 1
+        for thread_id in threads_to_update: #TODO incorporate getting thread content"s" without looping here?
+            if self._stop_event.is_set():
+                # stopping, the next start fetches the remaining updates
+                board.forget_thread_update(thread_id)
+                continue
+            if board.is_paused():
+                # the breaker opened on the way, the remaining threads wait until the board resumes
+                board.defer_thread(thread_id)
+                continue
+            start_time = time.time()
+
+            self._check_time_and_wait()
+            thread_content = board.get_thread_content(thread_id)
+            board.save_thread_content(thread_id, thread_content)
+
+            current_time_diff = (time.time() - start_time) * (n_threads_to_update - i)
+            self.logger.debug("%d/%d: Capturing post %s in /%s/ approximate seconds remaining for this board %.0f", i, n_threads_to_update, thread_id, board.board_code, current_time_diff)
+            i += 1
+
     def _set_monitoring_boards(self):
         """
         Preparing self.monitoring_boards which is essentially a list of board code that the program should monitor
+        A worker of a sharded crawl starts with the boards the coordinator assigned to it
+        """
+        if self._coordinator_client is not None:
+            board_list = list(self._coordinator_client.assigned_boards)
+        else:
+            board_list = self._get_board_codes()
+
+        # initialize Board class list, the boards load their saved state on first use
+        monitoring_boards = [self._create_board(board) for board in board_list]
+        self.logger.debug("Old monitors retrieved")
+        #TODO Caculate overall pre_threads after all boards are initialized
+        #self.logger.debug(f"{old_threads} past captures of old threads in previous instances discovered")
+
+        return monitoring_boards
+
+    def _get_board_codes(self):
+        """
         Process includes checking self._include_boards and self._exclude_boards
         if exclude_boards then self._include_boards become the ones not to monitor
+
+        :return: codes of the boards to monitor
         """
         available_boards = self._get_4chan_board_list()
 
@@ -108,35 +775,132 @@ class Requester:
             if board not in available_boards:
                 self.logger.info(f"Board code '{board}' is not available in 4chan")
                 raise KeyError(f"Board code '{board}' is not available in 4chan")
+        return board_list
 
-        # initialize Board class list
-        monitoring_boards = []
-        for board in board_list:
-            monitoring_boards.append(Board(board, self.logger))
-        self.logger.debug("Old monitors retrieved")
-        #TODO Caculate overall pre_threads after all boards are initialized
-        #self.logger.debug(f"{old_threads} past captures of old threads in previous instances discovered")
-
-        return monitoring_boards
+    def _create_board(self, board_code):
+        """
+        :return: Board sharing the transport, storage and settings of this Requester, restored from the checkpoint if it has the board
+        """
+        board_checkpoint_states = self._checkpoint_data["boards"] if self._checkpoint_data is not None else {}
+        return Board(
+            board_code,
+            self.logger,
+            self._transport,
+            base_save_path=self._base_save_path,
+            state_store=self._state_store,
+            storage_mode=self._storage_mode,
+            writer=self._writer,
+            storage_options=self._storage_options,
+            search_index=self._search_index,
+            post_stream=self._post_stream,
+            media_fetcher=self._media_fetcher,
+            trace_recorder=self._trace_recorder,
+            stage_timer=self._stage_timer,
+            raw_passthrough=self._raw_passthrough,
+            retry_queue=self._retry_queue,
+            circuit_breaker=CircuitBreaker(f"/{board_code}/", self.logger, self._breaker_failure_threshold, self._breaker_reset_timeout),
+            min_poll_interval=self._min_poll_interval,
+            max_poll_interval=self._max_poll_interval,
+            catalog_delta=self._catalog_delta,
+            checkpoint_state=board_checkpoint_states.get(board_code),
+        )
     
     def _get_4chan_board_list(self):
+        cached_codes = self._board_list_cache.get()
+        if cached_codes is not None:
+            self.logger.debug("Using the cached board list")
+            return cached_codes
         self._check_time_and_wait()
         self.logger.debug("chan information requested")
-        boards = requests.get("http://a.4cdn.org/boards.json")
+        boards = self._transport.get(self._transport.endpoints.board_list(), "board_list")
         boards_info = boards.json()
         codes = [board["board"] for board in boards_info["boards"]]
+        self._board_list_cache.put(codes)
         return codes
 
+    def _collect_metrics(self):
+        """
+        :return: list of MetricFamily describing the current state of the scraper, for the metrics endpoint
+        """
+        requests_total = MetricFamily("fourctc_requests_total", "counter", "HTTP requests by endpoint and response status")
+        latency = MetricFamily("fourctc_request_duration_seconds", "histogram", "HTTP request latency by endpoint")
+        downloaded = MetricFamily("fourctc_downloaded_bytes_total", "counter", "Bytes received from the API by endpoint, before decompression")
+        for endpoint, stats in sorted(self._transport.stats.snapshot().items()):
+            status_counts = {}
+            for status_code, count in stats["status_codes"].items():
+                status = status_label(status_code)
+                status_counts[status] = status_counts.get(status, 0) + count
+            for status, count in sorted(status_counts.items()):
+                requests_total.add(count, {"endpoint": endpoint, "status": status})
+            latency.add_histogram(LATENCY_BUCKETS, stats["latency_buckets"], stats["seconds"], stats["requests"], {"endpoint": endpoint})
+            downloaded.add(stats["wire_bytes"], {"endpoint": endpoint})
+
+        written = MetricFamily("fourctc_written_bytes_total", "counter", "Bytes of thread content written to disk by board")
+        tracked = MetricFamily("fourctc_tracked_threads", "gauge", "Threads currently monitored by board")
+        changes = MetricFamily("fourctc_thread_changes_total", "counter", "Thread births, deaths and updates seen in the thread lists by board")
+        sweep = MetricFamily("fourctc_board_sweep_seconds", "gauge", "Duration of the last poll of a board including its thread fetches")
+        for board in self._monitoring_boards:
+            labels = {"board": board.board_code}
+            if board.thread_store is not None:
+                written.add(board.thread_store.bytes_written, labels)
+            tracked.add(len(board.tracking_threads), labels)
+            for change, count in board.change_counts.items():
+                changes.add(count, {**labels, "change": change})
+            if board.last_sweep_seconds is not None:
+                sweep.add(board.last_sweep_seconds, labels)
+
+        stages = MetricFamily("fourctc_stage_seconds_total", "counter", "Time spent in the stages of the crawl: wait, fetch, parse, diff and write")
+        for stage in STAGES:
+            stages.add(self._stage_timer.total_seconds[stage], {"stage": stage})
+        rate_limit_wait = MetricFamily("fourctc_rate_limit_wait_seconds_total", "counter", "Time spent waiting for the request rate limit")
+        rate_limit_wait.add(self._rate_limiter.waited_seconds)
+        queue_depth = MetricFamily("fourctc_queue_depth", "gauge", "Items waiting in the internal queues")
+        if self._writer is not None:
+            queue_depth.add(self._writer.qsize(), {"queue": "write_behind"})
+        if self._scheduler is not None:
+            queue_depth.add(len(self._scheduler), {"queue": "scheduler"})
+        if self._post_stream is not None:
+            queue_depth.add(self._post_stream.qsize(), {"queue": "post_stream"})
+        if self._media_fetcher is not None:
+            queue_depth.add(self._media_fetcher.qsize(), {"queue": "media"})
+        queue_depth.add(len(self._retry_queue), {"queue": "retry"})
+        retries = MetricFamily("fourctc_retries_total", "counter", "Retries of failed thread requests that were scheduled or given up")
+        retries.add(self._retry_queue.retried_count, {"result": "scheduled"})
+        retries.add(self._retry_queue.given_up_count, {"result": "given_up"})
+        breaker_open = MetricFamily("fourctc_circuit_breaker_open", "gauge", "1 while the circuit breaker of a board pauses it")
+        breaker_trips = MetricFamily("fourctc_circuit_breaker_trips_total", "counter", "Times the circuit breaker of a board opened")
+        for board in self._monitoring_boards:
+            breaker_open.add(int(board.circuit_breaker.state == "open"), {"board": board.board_code})
+            breaker_trips.add(board.circuit_breaker.trip_count, {"board": board.board_code})
+        streamed = MetricFamily("fourctc_streamed_posts_total", "counter", "New posts sent to the post stream sink, or dropped when its queue was full")
+        if self._post_stream is not None:
+            streamed.add(self._post_stream.streamed_records, {"result": "sent"})
+            streamed.add(self._post_stream.dropped_records, {"result": "dropped"})
+        media_files = MetricFamily("fourctc_media_files_total", "counter", "Media files by result: downloaded, already stored, failed or dropped when the queue was full")
+        media_bytes = MetricFamily("fourctc_media_bytes_total", "counter", "Bytes of media files and thumbnails downloaded")
+        if self._media_fetcher is not None:
+            for result, count in self._media_fetcher.counts.items():
+                media_files.add(count, {"result": result})
+            media_bytes.add(self._media_fetcher.downloaded_bytes)
+
+        return [
+            requests_total, latency, downloaded, written, tracked, changes, sweep, stages, rate_limit_wait, queue_depth, streamed, retries,
+            breaker_open, breaker_trips, media_files, media_bytes,
+        ]
+
     def _check_time_and_wait(self):
-        if self._last_request is None:
-            self._last_request = time.time()
-        else:
-            cur_time = time.time()
-            if cur_time - self._last_request >= self._request_time_limit:
-                self._last_request = cur_time
-            else:
-                time.sleep(self._request_time_limit - (cur_time - self._last_request))
-                self._last_request = time.time()
+        with self._stage_timer.span("wait"):
+            self._rate_limiter.acquire()
+
+
+def run_worker(requester_settings):
+    """
+    Entry point of a worker process of a sharded crawl, runs a Requester until it is interrupted
+    """
+    try:
+        Requester(**requester_settings)
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     argparser = get_argparser()
@@ -154,6 +918,8 @@ if __name__ == "__main__":
         output_path = config.get("output_path", str(Path(__file__).resolve().parents[1]))
         save_log = config.get("save_log", True)
         clean_log = config.get("clean_log", True)
+        optional_settings = get_optional_settings(config)
+        optional_settings["config_path"] = str(config_path)
     else:
         boards=args.boards
         exclude_boards=args.exclude
@@ -161,6 +927,7 @@ if __name__ == "__main__":
         output_path=args.output_path
         save_log=args.save_log
         clean_log=args.clean_log
+        optional_settings = get_optional_settings(args)
 
     requester_instance = Requester(
         boards=boards,
@@ -168,5 +935,6 @@ if __name__ == "__main__":
         request_time_limit=request_time_limit,
         output_path=output_path,
         save_log=save_log,
-        clean_log=clean_log
+        clean_log=clean_log,
+        **optional_settings
     )   
\ No newline at end of file
@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import math
+import random
+import time
+
+
+class RetryQueue:
+    """
+    Failed thread requests waiting for another attempt, shared by all boards. The n-th attempt of a request waits a
+    jittered exponential backoff, between half and all of min(base_delay * 2 ** (n - 1), max_delay) seconds, so the
+    retries of many threads are spread out instead of hitting the API at once. Nothing waits inline, the pipeline
+    takes the due requests with pop_due between its other work
+    """
+    def __init__(self, base_delay: float = 5, max_delay: float = 300, max_attempts: int = 6):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.retried_count = 0 # retries scheduled since start
+        self.given_up_count = 0 # requests given up after max_attempts since start
+        self._heap = [] # (due time, insertion order, board, thread id)
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def get_backoff(self, attempt):
+        """
+        :param attempt: number of attempts made so far
+        :return: jittered seconds to wait before the next attempt
+        """
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def schedule(self, board, thread_id, attempt):
+        """Queue the next attempt of a failed request after its backoff
+
+        :param attempt: number of attempts made so far
+        :return: seconds until the retry, None if the request is given up
+        """
+        if attempt >= self.max_attempts:
+            self.given_up_count += 1
+            return None
+        delay = self.get_backoff(attempt)
+        self.push(board, thread_id, delay)
+        self.retried_count += 1
+        return delay
+
+    def push(self, board, thread_id, delay):
+        """
+        Queue a request after a fixed delay, e.g. until the circuit breaker of its board closes
+        """
+        heapq.heappush(self._heap, (time.time() + delay, next(self._order), board, thread_id))
+
+    def pop_due(self):
+        """
+        :return: (board, thread id) pairs whose retry is due, in the order they became due
+        """
+        due_jobs = []
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, board, thread_id = heapq.heappop(self._heap)
+            due_jobs.append((board, thread_id))
+        return due_jobs
+
+    def seconds_until_next(self):
+        """
+        :return: seconds until the next retry is due, infinity if nothing is waiting
+        """
+        if not self._heap:
+            return math.inf
+        return max(self._heap[0][0] - time.time(), 0)
+
+    def drop_board(self, board):
+        """
+        Forget the waiting retries of a board that is no longer monitored
+        """
+        self._heap = [entry for entry in self._heap if entry[2] is not board]
+        heapq.heapify(self._heap)
+
+    def summary(self):
+        """
+        :return: one line description of the retry state, for the log
+        """
+        next_retry = f", next in {self.seconds_until_next():.0f}s" if self._heap else ""
+        return f"{len(self._heap)} waiting{next_retry}, {self.retried_count} retries scheduled, {self.given_up_count} requests given up"
+
+
+class CircuitBreaker:
+    """
+    Pauses a board while the API keeps failing for it. After failure_threshold failures in a row the breaker opens
+    and the board is not requested for reset_timeout seconds. Then it is half open: requests go through again, the
+    first success closes the breaker, the first failure opens it again for twice as long, up to max_reset_timeout
+    """
+    def __init__(self, name, logger, failure_threshold: int = 5, reset_timeout: float = 60, max_reset_timeout: float = 1800):
+        self.name = name
+        self.logger = logger
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.trip_count = 0 # times the breaker opened since start
+        self._open_until = 0.0
+        self._current_timeout = reset_timeout
+
+    def is_open(self):
+        """
+        :return: True while requests should not be sent, an open breaker turns half open once its timeout is over
+        """
+        if self.state == "open" and time.time() >= self._open_until:
+            self.state = "half_open"
+            self.logger.info(f"Circuit breaker of {self.name} half open, trying again")
+        return self.state == "open"
+
+    def seconds_until_retry(self):
+        """
+        :return: seconds until an open breaker lets requests through again, 0 if it does already
+        """
+        if self.state != "open":
+            return 0.0
+        return max(self._open_until - time.time(), 0.0)
+
+    def record_success(self):
+        if self.state != "closed":
+            self.logger.info(f"Circuit breaker of {self.name} closed, requests succeed again")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._current_timeout = self.reset_timeout
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open":
+            self._current_timeout = min(self._current_timeout * 2, self.max_reset_timeout)
+            self._open()
+        elif self.state == "closed" and self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def summary(self):
+        """
+        :return: one line description of the breaker state, for the log
+        """
+        if self.state == "open":
+            return f"{self.name} paused for {self.seconds_until_retry():.0f}s more after {self.consecutive_failures} failures"
+        return f"{self.name} {self.state.replace('_', ' ')}"
+
+    def _open(self):
+        self.state = "open"
+        self.trip_count += 1
+        self._open_until = time.time() + self._current_timeout
+        self.logger.warning(
+            f"Circuit breaker of {self.name} open after {self.consecutive_failures} failures in a row, pausing for {self._current_timeout:.0f} seconds"
+        )
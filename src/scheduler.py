@@ -0,0 +1,201 @@
+import heapq
+import itertools
+import math
+import time
+
+
+def score_thread(position, replies_per_minute, waiting_seconds, is_new):
+    """
+    Priority of fetching a thread, higher is more urgent.
+
+    :param position: position of the thread on the board, 0 for the first thread of page 1 and 1 for the last thread of the last page
+    :param replies_per_minute: recent reply velocity of the thread
+    :param waiting_seconds: time since the thread changed without us capturing it
+    :param is_new: whether the thread was never captured
+    :return: priority score
+    """
+    # threads close to the end of the last page are the next ones to be pruned
+    death_risk = 3.0 * position ** 2
+    churn = math.log1p(replies_per_minute)
+    staleness = 0.5 * math.log1p(max(waiting_seconds, 0) / 60)
+    return death_risk + churn + staleness + (0.5 if is_new else 0.0)
+
+
+class BoardPollPlanner:
+    """
+    Decides when the thread list of each board is polled next. With adaptive polling every board is polled on its own
+    interval from Board.get_poll_interval, busy boards often and quiet boards rarely, otherwise every board is polled
+    every fixed_interval seconds. clock gives the current time, the crawl simulator replaces it with simulated time
+    """
+    def __init__(self, boards, adaptive: bool = False, fixed_interval: float = 60, next_polls=None, clock=time.time):
+        self.adaptive = adaptive
+        self.fixed_interval = fixed_interval
+        self.clock = clock
+        self._heap = []
+        self._counter = itertools.count()
+        now = self.clock()
+        next_polls = next_polls or {} # board code -> time of its next poll, e.g. from a checkpoint
+        for board in boards:
+            heapq.heappush(self._heap, (next_polls.get(board.board_code, now), next(self._counter), board))
+
+    def pop_due_boards(self):
+        """
+        :return: boards whose next poll is due, in the order they became due
+        """
+        now = self.clock()
+        due_boards = []
+        while self._heap and self._heap[0][0] <= now:
+            due_boards.append(heapq.heappop(self._heap)[2])
+        return due_boards
+
+    def schedule(self, board):
+        """Plan the next poll of a board that was just polled
+
+        :return: seconds until the next poll
+        """
+        interval = board.get_poll_interval() if self.adaptive else self.fixed_interval
+        heapq.heappush(self._heap, (self.clock() + interval, next(self._counter), board))
+        return interval
+
+    def add(self, board):
+        """
+        Start polling a board, its first poll is due right away
+        """
+        heapq.heappush(self._heap, (self.clock(), next(self._counter), board))
+
+    def remove(self, board):
+        """
+        Stop polling a board
+        """
+        self._heap = [entry for entry in self._heap if entry[2] is not board]
+        heapq.heapify(self._heap)
+
+    def get_next_polls(self):
+        """
+        :return: dictionary of board code to the time of its next poll
+        """
+        return {board.board_code: poll_time for poll_time, _, board in self._heap}
+
+    def seconds_until_next_poll(self):
+        """
+        :return: seconds until the next board is due, 0 if one is due already
+        """
+        if not self._heap:
+            return self.fixed_interval
+        return max(self._heap[0][0] - self.clock(), 0)
+
+
+class ThreadScheduler:
+    """
+    Priority queue of threads waiting to be fetched across all boards, the thread most likely to die or with the most
+    activity is fetched first. It also counts the threads that died while still waiting, which are the threads whose
+    final replies were lost. clock gives the current time, the crawl simulator replaces it with simulated time
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._heap = []
+        self._pending = {} # (board code, thread id) -> [score, board, thread id, valid]
+        self._counter = itertools.count()
+
+        self.pushed_count = 0
+        self.fetched_count = 0
+        self.death_count = 0
+        self.missed_death_count = 0 # threads that died before their final capture
+
+    def __len__(self):
+        return len(self._pending)
+
+    def push_board_threads(self, board, thread_ids):
+        """
+        Score the threads of a board from its latest thread list and queue them, threads already waiting get their new score
+        """
+        now = self.clock()
+        # threads still waiting from earlier lists are rescored too, their position has changed
+        waiting_thread_ids = [thread_id for board_code, thread_id in self._pending if board_code == board.board_code]
+        for thread_id in set(thread_ids).union(waiting_thread_ids):
+            last_modified, _ = board.tracking_threads[thread_id]
+            last_request = board.thread_content_last_request.get(thread_id)
+            # a change we have not captured yet has been waiting since last_modified
+            if last_request is None or time.mktime(last_request) < last_modified:
+                waiting_seconds = now - last_modified
+            else:
+                waiting_seconds = 0
+            score = score_thread(
+                board.thread_positions.get(thread_id, 0.0),
+                board.reply_velocity.get(thread_id, 0.0) * 60,
+                waiting_seconds,
+                last_request is None,
+            )
+            self.push(board, thread_id, score)
+
+    def push(self, board, thread_id, score):
+        """
+        Queue a thread, or change its score if it is already waiting
+        """
+        key = (board.board_code, thread_id)
+        if key in self._pending:
+            # lazy deletion, the old heap entry is skipped when popped
+            self._pending[key][3] = False
+        else:
+            self.pushed_count += 1
+        entry_state = [score, board, thread_id, True]
+        self._pending[key] = entry_state
+        heapq.heappush(self._heap, (-score, next(self._counter), entry_state))
+
+    def pop_batch(self, size):
+        """
+        :return: up to size (board, thread id) pairs with the highest scores
+        """
+        batch = []
+        while self._heap and len(batch) < size:
+            _, _, entry_state = heapq.heappop(self._heap)
+            _, board, thread_id, valid = entry_state
+            if not valid:
+                continue
+            del self._pending[(board.board_code, thread_id)]
+            batch.append((board, thread_id))
+        self.fetched_count += len(batch)
+        return batch
+
+    def get_pending(self):
+        """
+        :return: list of [board code, thread id, score] of the threads waiting to be fetched
+        """
+        return [[board_code, thread_id, entry_state[0]] for (board_code, thread_id), entry_state in self._pending.items()]
+
+    def restore_pending(self, boards, pending):
+        """
+        Queue the threads of get_pending again, threads of boards that are not monitored any more are dropped
+        """
+        boards_by_code = {board.board_code: board for board in boards}
+        for board_code, thread_id, score in pending:
+            if board_code in boards_by_code:
+                self.push(boards_by_code[board_code], thread_id, score)
+
+    def drop_board(self, board):
+        """
+        Drop the waiting threads of a board that is not crawled any more
+        """
+        for key in [key for key in self._pending if key[0] == board.board_code]:
+            self._pending.pop(key)[3] = False
+
+    def record_deaths(self, board, dead_thread_ids):
+        """
+        Count the threads that died on a board, and drop the ones that were still waiting to be fetched
+        """
+        self.death_count += len(dead_thread_ids)
+        for thread_id in dead_thread_ids:
+            entry_state = self._pending.pop((board.board_code, thread_id), None)
+            if entry_state is not None:
+                entry_state[3] = False
+                self.missed_death_count += 1
+
+    def summary(self):
+        """
+        :return: one line summary of the scheduler, meant for logging
+        """
+        missed_share = self.missed_death_count / self.death_count * 100 if self.death_count else 0.0
+        return (
+            f"{len(self)} threads waiting, {self.fetched_count} fetched, {self.death_count} deaths, "
+            f"{self.missed_death_count} ({missed_share:.1f}%) died before their final capture"
+        )
@@ -0,0 +1,197 @@
+from pathlib import Path
+import argparse
+import sqlite3
+import threading
+from rawjson import load_json, read_post_numbers
+from storage import THREAD_FILE_LAYOUTS, read_thread_file
+from utils import strip_html
+
+
+class SearchIndex:
+    """
+    SQLite full-text index over the collected posts. The plain text of every post's subject and comment goes into an
+    FTS5 table, board, thread number, post number and time are indexed columns of the posts table.
+    The highest indexed post of every thread is kept, so indexing a thread again only reads the posts after it
+    """
+    def __init__(self, db_path: Path):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+
+        # Threads may be indexed from the background writer thread
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS posts (
+                    id INTEGER PRIMARY KEY,
+                    board TEXT NOT NULL,
+                    thread_no INTEGER NOT NULL,
+                    post_no INTEGER NOT NULL,
+                    time INTEGER,
+                    sub TEXT,
+                    com TEXT,
+                    UNIQUE (board, post_no)
+                );
+                CREATE INDEX IF NOT EXISTS posts_thread ON posts (board, thread_no);
+                CREATE INDEX IF NOT EXISTS posts_time ON posts (time);
+                CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5 (sub, com, content='posts', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+                    INSERT INTO posts_fts (rowid, sub, com) VALUES (new.id, new.sub, new.com);
+                END;
+                CREATE TABLE IF NOT EXISTS indexed_threads (
+                    board TEXT NOT NULL,
+                    thread_no INTEGER NOT NULL,
+                    last_post_no INTEGER NOT NULL,
+                    PRIMARY KEY (board, thread_no)
+                );
+                CREATE TABLE IF NOT EXISTS indexed_files (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    size INTEGER
+                );
+                """
+            )
+
+    def add_thread(self, board_code, thread_content):
+        """Index the posts of a thread after the highest post indexed so far, post numbers only grow within a thread.
+        The opening post comes first in a thread, its number is the thread number
+
+        :return: number of newly indexed posts
+        """
+        post_numbers = read_post_numbers(thread_content)
+        if not post_numbers:
+            return 0
+        thread_no = post_numbers[0]
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT last_post_no FROM indexed_threads WHERE board = ? AND thread_no = ?", (board_code, thread_no)
+            ).fetchone()
+        last_post_no = row[0] if row is not None else 0
+        # nothing new, a RawJson capture is not even parsed
+        if max(post_numbers) <= last_post_no:
+            return 0
+
+        rows = [
+            (board_code, thread_no, post["no"], post.get("time"), strip_html(post.get("sub")), strip_html(post.get("com")))
+            for post in load_json(thread_content)["posts"] if post["no"] > last_post_no
+        ]
+        with self._lock, self._connection:
+            # the rowcount leaves out the trigger's inserts into the FTS table, total_changes would count them too
+            new_posts = self._connection.executemany(
+                "INSERT OR IGNORE INTO posts (board, thread_no, post_no, time, sub, com) VALUES (?, ?, ?, ?, ?, ?)", rows
+            ).rowcount
+            self._connection.execute(
+                """INSERT INTO indexed_threads (board, thread_no, last_post_no) VALUES (?, ?, ?)
+                   ON CONFLICT (board, thread_no) DO UPDATE SET last_post_no = MAX(last_post_no, excluded.last_post_no)""",
+                (board_code, thread_no, max(post_numbers)),
+            )
+            return new_posts
+
+    def index_saves(self, data_path: Path, logger=None):
+        """Index the threads of every storage mode in a data folder: the compacted archives, the snapshot saves, the
+        segments and the append-only thread logs, oldest layout first. Files that did not change since they were last
+        indexed are skipped
+
+        :return: number of newly indexed posts
+        """
+        new_posts = 0
+        for pattern, kind in THREAD_FILE_LAYOUTS:
+            for thread_file in sorted(Path(data_path).glob(pattern)):
+                new_posts += self._index_file(thread_file, kind, logger)
+        return new_posts
+
+    def _index_file(self, thread_file, kind, logger):
+        """
+        :return: number of newly indexed posts of the file, the board is the name of its folder in every layout
+        """
+        try:
+            stat = thread_file.stat()
+        except FileNotFoundError:
+            # a snapshot replaced by the scraper or a day folder removed by compaction
+            return 0
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mtime_ns, size FROM indexed_files WHERE path = ?", (str(thread_file),)
+            ).fetchone()
+        if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return 0
+
+        file_new_posts = 0
+        try:
+            for thread_content in read_thread_file(thread_file, kind):
+                file_new_posts += self.add_thread(thread_file.parent.name, thread_content)
+        except (FileNotFoundError, EOFError):
+            # removed while it was read, or a segment member the scraper is still writing, read again next time
+            return file_new_posts
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO indexed_files (path, mtime_ns, size) VALUES (?, ?, ?)",
+                (str(thread_file), stat.st_mtime_ns, stat.st_size),
+            )
+        if logger is not None:
+            logger.debug(f"Indexed {file_new_posts} new posts from {thread_file}")
+        return file_new_posts
+
+    def search(self, query, board_code=None, limit=20):
+        """Full-text search, best matches first
+
+        :param query: FTS5 query, e.g. 'word', '"exact phrase"' or 'com:word'
+        :return: list of dictionaries with board, thread_no, post_no, time and a snippet of the match
+        """
+        sql = """SELECT posts.board, posts.thread_no, posts.post_no, posts.time,
+                        snippet(posts_fts, -1, '[', ']', '...', 16)
+                 FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid
+                 WHERE posts_fts MATCH ?"""
+        parameters = [query]
+        if board_code is not None:
+            sql += " AND posts.board = ?"
+            parameters.append(board_code)
+        sql += " ORDER BY bm25(posts_fts) LIMIT ?"
+        parameters.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [
+            {"board": row[0], "thread_no": row[1], "post_no": row[2], "time": row[3], "snippet": row[4]}
+            for row in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def get_default_index_path(data_path: Path):
+    """
+    :return: location of the search index inside a data folder
+    """
+    return Path(data_path) / "search" / "posts.sqlite3"
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Build or query the full-text index of the collected posts")
+    argparser.add_argument(
+        "--data-path",
+        type=str,
+        default=str(Path(__file__).resolve().parents[1] / "data"),
+        help="Path of the data folder (default: 'data' in the 4CTC repo folder)",
+    )
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="Index the thread files of every storage mode that are new or changed")
+    query_parser = subparsers.add_parser("query", help="Search the index")
+    query_parser.add_argument("query", type=str, help="FTS5 query, e.g. 'word', '\"exact phrase\"' or 'com:word'")
+    query_parser.add_argument("-b", "--board", type=str, default=None, help="Only search this board")
+    query_parser.add_argument("--limit", type=int, default=20, help="Maximum number of results (default: 20)")
+    args = argparser.parse_args()
+
+    search_index = SearchIndex(get_default_index_path(args.data_path))
+    if args.command == "build":
+        print(f"{search_index.index_saves(args.data_path)} new posts indexed")
+    else:
+        for result in search_index.search(args.query, args.board, args.limit):
+            print(f"/{result['board']}/{result['thread_no']}#p{result['post_no']} ({result['time']}): {result['snippet']}")
+    search_index.close()
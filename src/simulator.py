@@ -0,0 +1,425 @@
+from pathlib import Path
+from bisect import bisect_right
+from datetime import datetime
+import argparse
+import gzip
+import itertools
+import json
+import math
+import time
+from board import Board
+from rawjson import read_thread_list_entries
+from scheduler import BoardPollPlanner, ThreadScheduler
+
+
+class TraceRecorder:
+    """
+    Keeps every thread list a board is polled with, as a trace to replay in the CrawlSimulator. Each poll is appended
+    as one line of the poll time and [thread id, last_modified, replies] of every thread in board order, to
+    traces/<board>/<YYYY_MM_DD>.jsonl.gz
+    """
+    def __init__(self, base_save_path: Path):
+        self.trace_path = Path(base_save_path) / "traces"
+
+    def record(self, board_code, thread_list, poll_time=None):
+        """
+        Append a thread list in the format of the API, parsed or RawJson, to the trace of the board
+        """
+        poll_time = poll_time if poll_time is not None else time.time()
+        threads = [list(entry) for entry in read_thread_list_entries(thread_list)]
+        trace_path = self.trace_path / board_code / (datetime.utcfromtimestamp(poll_time).strftime("%Y_%m_%d") + ".jsonl.gz")
+        trace_path.parent.mkdir(parents=True, exist_ok=True)
+        # every poll is its own gzip member, an interrupted write only loses that poll
+        with gzip.open(trace_path, "at", encoding="utf-8") as outfile:
+            outfile.write(json.dumps({"time": poll_time, "threads": threads}, separators=(",", ":")) + "\n")
+
+
+def load_traces(base_save_path: Path, board_codes=None, first_day=None, last_day=None):
+    """Read the recorded traces
+
+    :param board_codes: boards to read, None reads all recorded boards
+    :param first_day: / last_day: YYYY_MM_DD bounds of the days to read, None for no bound
+    :return: dictionary of board code to the list of (poll time, threads) in time order
+    """
+    traces = {}
+    trace_path = Path(base_save_path) / "traces"
+    if not trace_path.exists():
+        return traces
+    for board_path in sorted(trace_path.iterdir()):
+        if not board_path.is_dir() or (board_codes and board_path.name not in board_codes):
+            continue
+        polls = []
+        for day_path in sorted(board_path.glob("*.jsonl.gz")):
+            day = day_path.name.split(".")[0]
+            if (first_day and day < first_day) or (last_day and day > last_day):
+                continue
+            with gzip.open(day_path, "rt", encoding="utf-8") as infile:
+                try:
+                    for line in infile:
+                        poll = json.loads(line)
+                        polls.append((poll["time"], poll["threads"]))
+                except (EOFError, ValueError):
+                    # the last poll of a trace that is still being written
+                    pass
+        if polls:
+            traces[board_path.name] = sorted(polls, key=lambda poll: poll[0])
+    return traces
+
+
+class SimulatedClock:
+    """
+    Simulated time, passed as clock to BoardPollPlanner and ThreadScheduler
+    """
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class _ThreadHistory:
+    """
+    What really happened to a thread according to the trace: when each of its posts appeared and when it died
+    """
+    def __init__(self):
+        self.post_times = []
+        self.death_time = None
+        self.last_modified = None
+        self.replies = -1 # so the opening post counts as new
+        self.captured_posts = 0 # posts covered by the simulated captures so far
+        self.capture_count = 0
+
+    def add_posts(self, replies, last_modified, since):
+        """
+        Spread the posts that came since the last thread list evenly up to last_modified, the trace only shows their number
+        """
+        new_posts = replies - self.replies
+        if new_posts > 0:
+            until = max(last_modified, since)
+            self.post_times.extend(since + (until - since) * (i + 1) / new_posts for i in range(new_posts))
+        self.replies = replies
+        self.last_modified = last_modified
+
+
+class _SimulatedBoard:
+    """
+    Stands in for Board in the simulation: the crawler's view of the board, taken from the trace instead of the API,
+    next to the history of every thread the trace shows. Positions, reply velocity and activity are smoothed like in Board
+    """
+    get_poll_interval = Board.get_poll_interval
+
+    def __init__(self, board_code, polls, min_poll_interval, max_poll_interval):
+        self.board_code = board_code
+        self.poll_times = [poll_time for poll_time, _ in polls]
+        self.polls = polls
+        self.histories = self._build_histories(polls)
+
+        self.min_poll_interval = max(min_poll_interval, 10)
+        self.max_poll_interval = max(max_poll_interval, self.min_poll_interval)
+        self.target_changes_per_poll = 5
+        self.activity = None
+        self._last_activity_update = None
+
+        self.tracking_threads = {}
+        self.thread_content_last_request = {}
+        self.thread_positions = {}
+        self.reply_velocity = {}
+        self._reply_snapshots = {}
+        self.last_poll_time = None
+        self.poll_gaps = [] # seconds between two polls of the thread list
+
+    def read_thread_list(self, now):
+        """
+        :return: thread list the API would have answered at now, as dictionary of thread id to [last_modified, replies], None before the trace starts
+        """
+        poll_index = bisect_right(self.poll_times, now) - 1
+        if poll_index < 0:
+            return None
+        return {str(thread_id): [last_modified, replies] for thread_id, last_modified, replies in self.polls[poll_index][1]}
+
+    def update_activity(self, online_threads, change_count, now):
+        last_position = max(len(online_threads) - 1, 1)
+        thread_positions = {}
+        reply_velocity = {}
+        reply_snapshots = {}
+        for position, (thread_id, (_, replies)) in enumerate(online_threads.items()):
+            thread_positions[thread_id] = position / last_position
+            velocity = self.reply_velocity.get(thread_id, 0.0)
+            if thread_id in self._reply_snapshots:
+                previous_replies, previous_time = self._reply_snapshots[thread_id]
+                if now > previous_time:
+                    velocity = 0.5 * velocity + 0.5 * max(replies - previous_replies, 0) / (now - previous_time)
+            reply_velocity[thread_id] = velocity
+            reply_snapshots[thread_id] = (replies, now)
+        self.thread_positions = thread_positions
+        self.reply_velocity = reply_velocity
+        self._reply_snapshots = reply_snapshots
+
+        if self._last_activity_update is not None and now > self._last_activity_update:
+            rate = change_count / (now - self._last_activity_update)
+            self.activity = rate if self.activity is None else 0.7 * self.activity + 0.3 * rate
+        self._last_activity_update = now
+
+    @staticmethod
+    def _build_histories(polls):
+        histories = {}
+        alive = set()
+        previous_time = None
+        for poll_time, threads in polls:
+            online = set()
+            for thread_id, last_modified, replies in threads:
+                thread_id = str(thread_id)
+                online.add(thread_id)
+                history = histories.get(thread_id)
+                if history is None:
+                    history = histories[thread_id] = _ThreadHistory()
+                    # the posts of threads that were there when the trace started count from its start
+                    since = previous_time if previous_time is not None else poll_time
+                    history.add_posts(replies, min(last_modified, poll_time) if previous_time is not None else poll_time, since)
+                    continue
+                history.death_time = None # back on the board, e.g. after a glitch of the thread list
+                if replies > history.replies:
+                    history.add_posts(replies, min(last_modified, poll_time), history.last_modified)
+                else:
+                    # deleted posts lower the count
+                    history.replies = replies
+                    history.last_modified = last_modified
+            for thread_id in alive.difference(online):
+                histories[thread_id].death_time = poll_time
+            alive = online
+            previous_time = poll_time
+        return histories
+
+
+class CrawlSimulator:
+    """
+    Replays recorded thread list traces against a scheduling policy and a request budget, to predict the coverage of
+    a crawl before changing its settings. The crawler only sees the boards through the thread lists it polls, like
+    the Requester; every request costs request_time_limit seconds of simulated time, and a thread is captured with
+    all posts the trace shows at that time. Round robin polls the boards one after another and fetches every updated
+    thread, priority uses the BoardPollPlanner and ThreadScheduler of the Requester on simulated time
+
+    Post times between two polls of the trace are interpolated, so lags are estimates at the resolution of the trace
+    """
+    def __init__(self, traces, scheduling: str = "round_robin", request_time_limit: float = 1, adaptive_polling: bool = False,
+                 scheduler_refresh_interval: float = 60, min_poll_interval: float = 10, max_poll_interval: float = 300):
+        if scheduling not in ["round_robin", "priority"]:
+            raise ValueError(f"Unknown scheduling '{scheduling}', choose from round_robin, priority")
+        if adaptive_polling:
+            scheduling = "priority"
+        self.scheduling = scheduling
+        self.request_time_limit = request_time_limit
+        self.adaptive_polling = adaptive_polling
+        self.scheduler_refresh_interval = scheduler_refresh_interval
+        self.boards = [_SimulatedBoard(board_code, polls, min_poll_interval, max_poll_interval) for board_code, polls in sorted(traces.items())]
+        if not self.boards:
+            raise ValueError("No traces to replay, record them with the record_traces setting")
+        self.start_time = min(board.poll_times[0] for board in self.boards)
+        self.end_time = max(board.poll_times[-1] for board in self.boards)
+        self.clock = SimulatedClock(self.start_time)
+        self.request_counts = {"thread_list": 0, "thread_content": 0, "thread_gone": 0}
+        self._capture_lags = {board.board_code: [] for board in self.boards}
+
+    def run(self):
+        """Replay the traces from their start to their end
+
+        :return: dictionary of the simulated coverage, see summary
+        """
+        wall_start_time = time.time()
+        if self.scheduling == "priority":
+            self._run_priority()
+        else:
+            self._run_round_robin()
+        return self.summary(time.time() - wall_start_time)
+
+    def summary(self, wall_seconds):
+        """
+        :return: dictionary with the requests spent, the threads that died before their final posts were captured,
+            capture lag percentiles in seconds overall and by board, the board staleness and the speed-up over real time
+        """
+        threads = died = missed_before_death = never_captured = posts = captured_posts = 0
+        for board in self.boards:
+            for history in board.histories.values():
+                threads += 1
+                posts += len(history.post_times)
+                captured_posts += history.captured_posts
+                if history.death_time is None:
+                    continue
+                died += 1
+                if history.captured_posts < len(history.post_times):
+                    missed_before_death += 1
+                if history.capture_count == 0:
+                    never_captured += 1
+        all_lags = sorted(lag for lags in self._capture_lags.values() for lag in lags)
+        simulated_seconds = self.end_time - self.start_time
+        return {
+            "scheduling": self.scheduling + (" (adaptive)" if self.adaptive_polling else ""),
+            "request_time_limit": self.request_time_limit,
+            "simulated_seconds": simulated_seconds,
+            "speedup": simulated_seconds / wall_seconds if wall_seconds > 0 else math.inf,
+            "requests": dict(self.request_counts, total=self.request_counts["thread_list"] + self.request_counts["thread_content"]),
+            "threads": threads,
+            "died": died,
+            "missed_before_death": missed_before_death,
+            "never_captured": never_captured,
+            "posts": posts,
+            "captured_posts": captured_posts,
+            "capture_lag": _percentiles(all_lags),
+            "boards": {
+                board.board_code: {
+                    "capture_lag": _percentiles(sorted(self._capture_lags[board.board_code])),
+                    "mean_poll_gap": sum(board.poll_gaps) / len(board.poll_gaps) if board.poll_gaps else None,
+                    "max_poll_gap": max(board.poll_gaps) if board.poll_gaps else None,
+                }
+                for board in self.boards
+            },
+        }
+
+    def _run_round_robin(self):
+        while self.clock.now < self.end_time:
+            for board in self.boards:
+                if board.last_poll_time is not None and self.clock.now - board.last_poll_time < board.min_poll_interval:
+                    # the Board waits out the 10 seconds between two thread lists
+                    self.clock.now = board.last_poll_time + board.min_poll_interval
+                threads_to_update, _ = self._poll(board)
+                for thread_id in threads_to_update:
+                    self._fetch(board, thread_id)
+
+    def _run_priority(self):
+        scheduler = ThreadScheduler(clock=self.clock)
+        poll_planner = BoardPollPlanner(self.boards, self.adaptive_polling, self.scheduler_refresh_interval, clock=self.clock)
+        while self.clock.now < self.end_time:
+            polling_start_time = self.clock.now
+            for board in poll_planner.pop_due_boards():
+                threads_to_update, dead_thread_ids = self._poll(board)
+                scheduler.record_deaths(board, dead_thread_ids)
+                scheduler.push_board_threads(board, threads_to_update)
+                poll_planner.schedule(board)
+
+            fetch_deadline = self.clock.now + max(poll_planner.seconds_until_next_poll(), self.clock.now - polling_start_time)
+            while len(scheduler) > 0 and self.clock.now < fetch_deadline:
+                for board, thread_id in scheduler.pop_batch(1):
+                    self._fetch(board, thread_id)
+            if len(scheduler) == 0:
+                self.clock.now += poll_planner.seconds_until_next_poll()
+
+    def _poll(self, board):
+        """
+        Request the thread list of a board and update the crawler's view of it like Board.get_threads_to_update
+
+        :return: thread ids to update and thread ids that died
+        """
+        now = self.clock.now
+        self._spend_request("thread_list")
+        if board.last_poll_time is not None:
+            board.poll_gaps.append(now - board.last_poll_time)
+        board.last_poll_time = now
+        online_threads = board.read_thread_list(now)
+        if online_threads is None:
+            return [], []
+
+        dead_thread_ids = [thread_id for thread_id in board.tracking_threads if thread_id not in online_threads]
+        for thread_id in dead_thread_ids:
+            del board.tracking_threads[thread_id]
+            board.thread_content_last_request.pop(thread_id, None)
+        threads_to_update = []
+        for thread_id, (last_modified, replies) in online_threads.items():
+            if thread_id not in board.tracking_threads or board.tracking_threads[thread_id][0] < last_modified:
+                threads_to_update.append(thread_id)
+            board.tracking_threads[thread_id] = [last_modified, replies]
+        board.update_activity(online_threads, len(dead_thread_ids) + len(threads_to_update), now)
+        return threads_to_update, dead_thread_ids
+
+    def _fetch(self, board, thread_id):
+        """
+        Request a thread, capturing every post the trace shows at this time
+        """
+        now = self.clock.now
+        history = board.histories[thread_id]
+        if history.death_time is not None and history.death_time <= now:
+            self._spend_request("thread_gone")
+            return
+        self._spend_request("thread_content")
+        board.thread_content_last_request[thread_id] = time.localtime(now)
+        captured_posts = bisect_right(history.post_times, now)
+        lags = self._capture_lags[board.board_code]
+        for post_time in itertools.islice(history.post_times, history.captured_posts, captured_posts):
+            lags.append(now - post_time)
+        history.captured_posts = max(history.captured_posts, captured_posts)
+        history.capture_count += 1
+
+    def _spend_request(self, kind):
+        self.request_counts[kind] += 1
+        self.clock.now += self.request_time_limit
+
+
+def _percentiles(sorted_values):
+    if not sorted_values:
+        return {"p50": None, "p90": None, "p99": None}
+    return {
+        name: sorted_values[min(int(len(sorted_values) * share), len(sorted_values) - 1)]
+        for name, share in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+    }
+
+
+def _format_seconds(seconds):
+    return "-" if seconds is None else f"{seconds:.0f}s"
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Replay recorded thread list traces to predict the coverage of scheduling policies and request budgets")
+    argparser.add_argument(
+        "--data-path",
+        type=str,
+        default=str(Path(__file__).resolve().parents[1] / "data"),
+        help="Path of the data folder with the traces (default: 'data' in the 4CTC repo folder)",
+    )
+    argparser.add_argument("-b", "--boards", nargs="*", default=[], help="Boards to replay (default: all recorded boards)")
+    argparser.add_argument("--first-day", type=str, default=None, help="First day of the traces to replay, as YYYY_MM_DD")
+    argparser.add_argument("--last-day", type=str, default=None, help="Last day of the traces to replay, as YYYY_MM_DD")
+    argparser.add_argument(
+        "--scheduling",
+        nargs="+",
+        choices=["round_robin", "priority", "adaptive"],
+        default=["round_robin", "priority"],
+        help="Scheduling policies to compare, 'adaptive' is priority scheduling with adaptive polling (default: round_robin priority)",
+    )
+    argparser.add_argument("--request-time-limit", nargs="+", type=float, default=[1], help="Request budgets to compare, seconds per request (default: 1)")
+    argparser.add_argument("--scheduler-refresh-interval", type=float, default=60, help="Seconds between two polls of a board with priority scheduling (default: 60)")
+    argparser.add_argument("--min-poll-interval", type=float, default=10, help="Lower bound of the adaptive poll interval (default: 10)")
+    argparser.add_argument("--max-poll-interval", type=float, default=300, help="Upper bound of the adaptive poll interval (default: 300)")
+    argparser.add_argument("--json", action="store_true", help="If provided, print the full results as JSON")
+    args = argparser.parse_args()
+
+    traces = load_traces(Path(args.data_path), args.boards, args.first_day, args.last_day)
+    results = []
+    for scheduling, request_time_limit in itertools.product(args.scheduling, args.request_time_limit):
+        simulator = CrawlSimulator(
+            traces,
+            "priority" if scheduling == "adaptive" else scheduling,
+            request_time_limit,
+            scheduling == "adaptive",
+            args.scheduler_refresh_interval,
+            args.min_poll_interval,
+            args.max_poll_interval,
+        )
+        results.append(simulator.run())
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            lag = result["capture_lag"]
+            print(
+                f"{result['scheduling']}, {result['request_time_limit']:g}s per request: "
+                f"{result['requests']['total']} requests ({result['requests']['thread_gone']} for dead threads), "
+                f"{result['missed_before_death']} of {result['died']} dead threads missed posts ({result['never_captured']} never captured), "
+                f"{result['captured_posts']} of {result['posts']} posts captured, "
+                f"lag p50 {_format_seconds(lag['p50'])} p90 {_format_seconds(lag['p90'])} p99 {_format_seconds(lag['p99'])}, "
+                f"{result['simulated_seconds'] / 3600:.1f}h replayed {result['speedup']:.0f}x faster than real time"
+            )
+            for board_code, board_result in result["boards"].items():
+                print(
+                    f"    /{board_code}/ lag p90 {_format_seconds(board_result['capture_lag']['p90'])}, "
+                    f"poll gap mean {_format_seconds(board_result['mean_poll_gap'])} max {_format_seconds(board_result['max_poll_gap'])}"
+                )
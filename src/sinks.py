@@ -0,0 +1,208 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+
+class PostSink(ABC):
+    """
+    Destination of the stream of newly captured posts, gets the records as NDJSON lines
+    """
+    @abstractmethod
+    def write_lines(self, lines):
+        """
+        Write encoded NDJSON lines, each ending with a newline
+        """
+
+    def close(self):
+        pass
+
+
+class StdoutSink(PostSink):
+    """
+    Writes the records to the standard output, e.g. to pipe them into a consumer process
+    """
+    def write_lines(self, lines):
+        sys.stdout.buffer.write(b"".join(lines))
+        sys.stdout.buffer.flush()
+
+
+class UnixSocketSink(PostSink):
+    """
+    Listens on a Unix domain socket and sends the records to every connected consumer, consumers get the posts
+    captured after they connected. A consumer that does not take a record within send_timeout seconds is disconnected
+    """
+    def __init__(self, socket_path: Path, send_timeout: float = 10):
+        self.socket_path = Path(socket_path)
+        self.send_timeout = send_timeout
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            # left over from an earlier run
+            self.socket_path.unlink()
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(str(self.socket_path))
+        self._server.listen()
+        self._consumers = []
+        self._lock = threading.Lock()
+        self._accept_thread = threading.Thread(target=self._accept_consumers, name="UnixSocketSink", daemon=True)
+        self._accept_thread.start()
+
+    def write_lines(self, lines):
+        data = b"".join(lines)
+        with self._lock:
+            consumers = list(self._consumers)
+        for consumer in consumers:
+            try:
+                consumer.sendall(data)
+            except OSError:
+                with self._lock:
+                    self._consumers.remove(consumer)
+                consumer.close()
+
+    def close(self):
+        self._server.close()
+        with self._lock:
+            for consumer in self._consumers:
+                consumer.close()
+            self._consumers = []
+        self.socket_path.unlink(missing_ok=True)
+
+    def _accept_consumers(self):
+        while True:
+            try:
+                consumer, _ = self._server.accept()
+            except OSError:
+                # the server socket was closed
+                return
+            consumer.settimeout(self.send_timeout)
+            with self._lock:
+                self._consumers.append(consumer)
+
+
+class RotatingFileSink(PostSink):
+    """
+    Appends the records to a file that is rotated when it reaches max_bytes, the rotated files are kept as
+    <name>.1 (newest) to <name>.<backup_count> (oldest)
+    """
+    def __init__(self, file_path: Path, max_bytes: int = 100 * 1024 * 1024, backup_count: int = 10):
+        self.file_path = Path(file_path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.file_path, "ab")
+
+    def write_lines(self, lines):
+        data = b"".join(lines)
+        if self._file.tell() > 0 and self._file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            rotated_path = self.file_path.with_name(f"{self.file_path.name}.{i}")
+            if rotated_path.exists():
+                os.replace(rotated_path, self.file_path.with_name(f"{self.file_path.name}.{i + 1}"))
+        if self.backup_count > 0:
+            os.replace(self.file_path, self.file_path.with_name(f"{self.file_path.name}.1"))
+        else:
+            self.file_path.unlink()
+        self._file = open(self.file_path, "ab")
+
+
+class PostStream:
+    """
+    Streams newly captured posts to a PostSink as NDJSON records of board, thread, capture time and post. Records wait
+    on a bounded queue for a background thread, so a slow consumer does not hold up the capture until the queue is full.
+    Then "block" waits for the sink and "drop" discards the records and counts them in dropped_records
+    """
+    def __init__(self, sink: PostSink, logger, max_queue_size: int = 10000, backpressure: str = "block"):
+        if backpressure not in ["block", "drop"]:
+            raise ValueError(f"Unknown backpressure '{backpressure}', choose from block, drop")
+        self.sink = sink
+        self.logger = logger
+        self.backpressure = backpressure
+        self.streamed_records: int = 0
+        self.dropped_records: int = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, name="PostStream", daemon=True)
+        self._thread.start()
+
+    def publish(self, board_code, thread_id, posts, capture_time=None):
+        """
+        Queue the records of new posts of a thread
+        """
+        capture_time = capture_time if capture_time is not None else time.time()
+        for post in posts:
+            record = {"board": board_code, "thread": int(thread_id), "post": post["no"], "captured": capture_time, "data": post}
+            if self.backpressure == "block":
+                self._queue.put(record)
+                continue
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                if self.dropped_records % 1000 == 0:
+                    self.logger.warning(f"Post stream queue is full, dropping records ({self.dropped_records} dropped so far)")
+                self.dropped_records += 1
+
+    def qsize(self):
+        """
+        :return: number of records waiting for the sink
+        """
+        return self._queue.qsize()
+
+    def close(self):
+        """
+        Send everything still queued and close the sink
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self.sink.close()
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            # take whatever else is waiting, so a burst of posts is written at once
+            while len(records) < 1000:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = records[-1] is None
+            records = [record for record in records if record is not None]
+            try:
+                if records:
+                    self.sink.write_lines([(json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8") for record in records])
+                    self.streamed_records += len(records)
+            except Exception:
+                self.logger.exception(f"Post stream sink failed, {len(records)} records lost")
+            finally:
+                for _ in range(len(records) + closing):
+                    self._queue.task_done()
+            if closing:
+                return
+
+
+def create_post_sink(post_sink: str, base_save_path: Path, sink_path: str = "", rotate_mb: int = 100):
+    """Create the sink of the post stream
+
+    :param post_sink: "stdout", "socket" or "file"
+    :param sink_path: socket or file path, defaults to data/stream/posts.sock and data/stream/posts.ndjson
+    :return: PostSink
+    """
+    if post_sink == "stdout":
+        return StdoutSink()
+    if post_sink == "socket":
+        return UnixSocketSink(sink_path or Path(base_save_path) / "stream" / "posts.sock")
+    if post_sink == "file":
+        return RotatingFileSink(sink_path or Path(base_save_path) / "stream" / "posts.ndjson", rotate_mb * 1024 * 1024)
+    raise ValueError(f"Unknown post sink '{post_sink}', choose from stdout, socket, file")
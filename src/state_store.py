@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class CrawlStateStore:
+    """
+    SQLite store of the crawl state that has to survive a restart: for every board and every tracked thread the
+    last fetch time and the HTTP validators (Last-Modified, ETag) of the last response, and for threads also the
+    last_modified and reply count they were captured with and the number of the last captured post.
+    Every update is its own transaction
+    """
+    def __init__(self, db_path: Path):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+
+        # Boards may record from worker threads when fetching concurrently
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS boards (
+                    board TEXT PRIMARY KEY,
+                    last_fetch REAL,
+                    http_last_modified TEXT,
+                    etag TEXT
+                )"""
+            )
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS threads (
+                    board TEXT NOT NULL,
+                    thread_id TEXT NOT NULL,
+                    last_modified INTEGER,
+                    replies INTEGER,
+                    last_fetch REAL,
+                    http_last_modified TEXT,
+                    etag TEXT,
+                    last_post_no INTEGER,
+                    captured_replies INTEGER,
+                    PRIMARY KEY (board, thread_id)
+                )"""
+            )
+
+    def load_board(self, board_code):
+        """
+        :return: dictionary with last_fetch, http_last_modified and etag of the board's thread list, None if unknown
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT last_fetch, http_last_modified, etag FROM boards WHERE board = ?", (board_code,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"last_fetch": row[0], "http_last_modified": row[1], "etag": row[2]}
+
+    def load_threads(self, board_code):
+        """
+        :return: dictionary of thread id to a dictionary with last_modified, replies, last_fetch, http_last_modified, etag, last_post_no and captured_replies
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                """SELECT thread_id, last_modified, replies, last_fetch, http_last_modified, etag, last_post_no, captured_replies
+                    FROM threads WHERE board = ?""",
+                (board_code,),
+            ).fetchall()
+        return {
+            row[0]: {
+                "last_modified": row[1],
+                "replies": row[2],
+                "last_fetch": row[3],
+                "http_last_modified": row[4],
+                "etag": row[5],
+                "last_post_no": row[6],
+                "captured_replies": row[7],
+            }
+            for row in rows
+        }
+
+    def record_board_fetch(self, board_code, last_fetch, http_last_modified=None, etag=None):
+        """
+        Store the state of the last successful thread list request of a board
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO boards (board, last_fetch, http_last_modified, etag) VALUES (?, ?, ?, ?)",
+                (board_code, last_fetch, http_last_modified, etag),
+            )
+
+    def record_thread_fetch(
+        self, board_code, thread_id, last_modified, replies, last_fetch, http_last_modified=None, etag=None, last_post_no=None, captured_replies=None
+    ):
+        """
+        Store the state of the last successful capture of a thread
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                """INSERT OR REPLACE INTO threads
+                    (board, thread_id, last_modified, replies, last_fetch, http_last_modified, etag, last_post_no, captured_replies)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (board_code, str(thread_id), last_modified, replies, last_fetch, http_last_modified, etag, last_post_no, captured_replies),
+            )
+
+    def remove_threads(self, board_code, thread_ids):
+        """
+        Forget dead threads
+        """
+        if not thread_ids:
+            return
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM threads WHERE board = ? AND thread_id = ?",
+                [(board_code, str(thread_id)) for thread_id in thread_ids],
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
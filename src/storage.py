@@ -0,0 +1,648 @@
+from pathlib import Path
+import argparse
+import gzip
+import json
+import lzma
+import os
+import queue
+import sys
+import threading
+import time
+from rawjson import RawJson, load_json
+from utils import get_time, get_day
+
+
+class SnapshotThreadStore:
+    """
+    Default storage of thread contents, one JSON file per thread under saves/<day>/threads/<board>.
+    The file of a thread is replaced by a new one every time the thread is captured. Which file belongs to which
+    thread is kept in memory, so the board folder is only scanned once a day instead of on every save
+    """
+    def __init__(self, board_code, base_save_path: Path, logger):
+        self.board_code = board_code
+        self.base_save_path = Path(base_save_path)
+        self.logger = logger
+        self.bytes_written = 0 # bytes written since the store was created
+
+        # thread id -> path of its file in the folder of self._indexed_day
+        self._indexed_day = None
+        self._saved_thread_paths = {}
+
+        # the last earlier day the board was saved on, so a thread continues from its capture before midnight
+        self._previous_day = None
+        self._previous_thread_paths = None # loaded on the first lookup
+        self._previous_archive_index = None # loaded on the first lookup, once the day is compacted
+
+    def get_thread_content_path(self):
+        """
+        :return: folder of today's thread files of the board, created and indexed on the first call of the day
+        """
+        timestamp = get_day()
+        thread_content_path = self.base_save_path / "saves" / timestamp / "threads" / self.board_code
+        if self._indexed_day != timestamp:
+            thread_content_path.mkdir(parents=True, exist_ok=True)
+            self._saved_thread_paths = self._scan_thread_content_path(thread_content_path)
+            self._indexed_day = timestamp
+            self._previous_day = find_previous_day(self.base_save_path, timestamp)
+            self._previous_thread_paths = None
+            self._previous_archive_index = None
+        return thread_content_path
+
+    def save_thread(self, thread_id, thread_content):
+        """Save the thread content in local directory
+        """
+        thread_content_path = self.get_thread_content_path()
+        #TODO, need to match the new logic where timestamp does not result duplicate file
+        #TODO, static and argument accept?
+        filename = str(thread_id) + get_time() + ".json"
+        fullname = thread_content_path / filename
+
+        self.bytes_written += atomic_write_json(fullname, thread_content, indent=2)
+
+        # this insure there is only one copy for one post
+        #TODO as well as moving dead threads to an fully saved folder
+        #TODO name the still tracking, saving folder as something like tracking saved
+        previous_path = self._saved_thread_paths.get(str(thread_id))
+        if previous_path is not None and previous_path != fullname:
+            try:
+                os.remove(previous_path)
+            except FileNotFoundError:
+                pass
+        self._saved_thread_paths[str(thread_id)] = fullname
+
+    def append_posts(self, thread_id, opening_post, new_posts):
+        """Add posts to the last saved content of the thread without fetching it again
+
+        :return: False if there is no saved content of the thread today or on the previous day to add them to
+        """
+        thread_content = self.read_thread(thread_id)
+        if thread_content is None:
+            return False
+        self.save_thread(thread_id, merge_new_posts(thread_content, opening_post, new_posts))
+        return True
+
+    def mark_thread_dead(self, thread_id):
+        """
+        Snapshots keep the last captured state of a dead thread as it is
+        """
+
+    def read_thread(self, thread_id):
+        """
+        :return: the last saved content of the thread today, or on the previous day it was saved, None if there is none
+        """
+        self.get_thread_content_path()
+        saved_thread_path = self._saved_thread_paths.get(str(thread_id))
+        if saved_thread_path is None:
+            return self._read_previous_day_thread(thread_id)
+        with open(saved_thread_path, "r") as infile:
+            return json.load(infile)
+
+    def _read_previous_day_thread(self, thread_id):
+        if self._previous_day is None:
+            return None
+        if self._previous_thread_paths is None:
+            self._previous_thread_paths = {}
+            previous_path = self.base_save_path / "saves" / self._previous_day / "threads" / self.board_code
+            if previous_path.exists():
+                # the day is closed, so only read, the compaction job may be working on it
+                for saved_thread_path in sorted(previous_path.glob("*.json")):
+                    self._previous_thread_paths[saved_thread_path.name.split("_")[0]] = saved_thread_path
+        saved_thread_path = self._previous_thread_paths.get(str(thread_id))
+        if saved_thread_path is not None:
+            try:
+                with open(saved_thread_path, "r") as infile:
+                    return json.load(infile)
+            except FileNotFoundError:
+                # compacted in the meantime
+                pass
+
+        if self._previous_archive_index is None:
+            archive_path = get_archive_path(self.base_save_path, self._previous_day, self.board_code)
+            if not archive_path.exists():
+                return None
+            self._previous_archive_index = read_segment_index(archive_path)
+        return read_archived_thread(self.base_save_path, self._previous_day, self.board_code, thread_id, self._previous_archive_index)
+
+    def _scan_thread_content_path(self, thread_content_path):
+        saved_thread_paths = {}
+        # names are <thread id>_<hh>_<mm>_<ss>.json, sorting keeps the latest file of a thread
+        for saved_thread_path in sorted(thread_content_path.iterdir()):
+            if saved_thread_path.name.endswith(".tmp"):
+                # left behind by a write that never finished
+                saved_thread_path.unlink()
+                continue
+            thread_id = saved_thread_path.name.split("_")[0]
+            if thread_id in saved_thread_paths:
+                os.remove(saved_thread_paths[thread_id])
+            saved_thread_paths[thread_id] = saved_thread_path
+        return saved_thread_paths
+
+
+class AppendOnlyThreadStore:
+    """
+    Incremental storage of thread contents, one JSON-Lines event log per thread under threads_log/<board>.
+    Each capture only appends the posts that were not seen before (keyed by post "no"), the posts that disappeared
+    since the last capture and a changed opening post. The death of a thread is appended as an event too, and the
+    full thread can be rebuilt from the log at any time with read_thread
+
+    Events look like ``{"event": "post", "captured": 1700000000.0, "post": {...}}``, the other event types are
+    "op" (opening post changed), "deleted" (with the post "no") and "died"
+    """
+    def __init__(self, board_code, base_save_path: Path, logger):
+        self.board_code = board_code
+        self.base_save_path = Path(base_save_path)
+        self.logger = logger
+        self.bytes_written = 0 # bytes written since the store was created
+        self.thread_log_path = self.base_save_path / "threads_log" / self.board_code
+        self.thread_log_path.mkdir(parents=True, exist_ok=True)
+
+        # Post numbers alive at the last capture and the last opening post of each thread, loaded lazily from the logs
+        self._live_posts = {}
+        self._opening_posts = {}
+
+    def get_thread_log_file(self, thread_id):
+        """
+        :return: path of the event log of the thread
+        """
+        return self.thread_log_path / f"{thread_id}.jsonl"
+
+    def save_thread(self, thread_id, thread_content):
+        """Append the changes since the last capture of the thread to its event log
+        """
+        thread_id = str(thread_id)
+        if thread_id not in self._live_posts:
+            self._load_thread_state(thread_id)
+        live_posts = self._live_posts[thread_id]
+        captured = time.time()
+
+        events = []
+        online_posts = set()
+        for post in load_json(thread_content)["posts"]:
+            online_posts.add(post["no"])
+            if post["no"] not in live_posts:
+                events.append({"event": "post", "captured": captured, "post": post})
+            elif post.get("resto") == 0 and post != self._opening_posts.get(thread_id):
+                events.append({"event": "op", "captured": captured, "post": post})
+            if post.get("resto") == 0:
+                self._opening_posts[thread_id] = post
+        for post_no in sorted(live_posts - online_posts):
+            events.append({"event": "deleted", "captured": captured, "no": post_no})
+        self._live_posts[thread_id] = online_posts
+
+        self._append_events(thread_id, events)
+
+    def append_posts(self, thread_id, opening_post, new_posts):
+        """Append new posts of the thread to its event log without a full capture, no deletions are recorded
+
+        :return: False if the thread was never captured
+        """
+        thread_id = str(thread_id)
+        if not self.get_thread_log_file(thread_id).exists():
+            return False
+        if thread_id not in self._live_posts:
+            self._load_thread_state(thread_id)
+        live_posts = self._live_posts[thread_id]
+        captured = time.time()
+
+        events = []
+        previous_opening_post = self._opening_posts.get(thread_id)
+        if previous_opening_post is not None:
+            updated_opening_post = {**previous_opening_post, **opening_post}
+            if updated_opening_post != previous_opening_post:
+                events.append({"event": "op", "captured": captured, "post": updated_opening_post})
+                self._opening_posts[thread_id] = updated_opening_post
+        for post in new_posts:
+            if post["no"] not in live_posts:
+                events.append({"event": "post", "captured": captured, "post": post})
+                live_posts.add(post["no"])
+
+        self._append_events(thread_id, events)
+        return True
+
+    def mark_thread_dead(self, thread_id):
+        """
+        Append a "died" marker to the event log of a thread that is no longer online
+        """
+        thread_id = str(thread_id)
+        self._live_posts.pop(thread_id, None)
+        self._opening_posts.pop(thread_id, None)
+        if self.get_thread_log_file(thread_id).exists():
+            self._append_events(thread_id, [{"event": "died", "captured": time.time()}])
+
+    def read_thread(self, thread_id):
+        """Rebuild the full thread from its event log
+
+        :return: thread content in the format of the API, with the extra keys "deleted_posts" and "died", None if the thread was never captured
+        """
+        log_file = self.get_thread_log_file(thread_id)
+        if not log_file.exists():
+            return None
+
+        posts = {}
+        deleted_posts = []
+        died = None
+        for event in self._read_events(log_file):
+            if event["event"] in ("post", "op"):
+                posts[event["post"]["no"]] = event["post"]
+            elif event["event"] == "deleted":
+                deleted_posts.append(event["no"])
+                posts.pop(event["no"], None)
+            elif event["event"] == "died":
+                died = event["captured"]
+        return {"posts": [posts[post_no] for post_no in sorted(posts)], "deleted_posts": deleted_posts, "died": died}
+
+    def _load_thread_state(self, thread_id):
+        live_posts = set()
+        log_file = self.get_thread_log_file(thread_id)
+        if log_file.exists():
+            drop_partial_line(log_file)
+            for event in self._read_events(log_file):
+                if event["event"] in ("post", "op"):
+                    live_posts.add(event["post"]["no"])
+                    if event["post"].get("resto") == 0:
+                        self._opening_posts[thread_id] = event["post"]
+                elif event["event"] == "deleted":
+                    live_posts.discard(event["no"])
+        self._live_posts[thread_id] = live_posts
+
+    def _append_events(self, thread_id, events):
+        if not events:
+            return
+        data = "".join(json.dumps(event) + "\n" for event in events)
+        with open(self.get_thread_log_file(thread_id), "a") as outfile:
+            outfile.write(data)
+        self.bytes_written += len(data)
+
+    def _read_events(self, log_file):
+        with open(log_file, "r") as infile:
+            for line in infile:
+                # a crash can leave the last line half written
+                if line.endswith("\n"):
+                    yield json.loads(line)
+
+
+class WriteBehindWriter:
+    """
+    Background writer that takes disk I/O out of the fetch loop. Save jobs are put on a bounded queue and run in order
+    by a single writer thread, when the queue is full the fetch loop waits, so memory use stays bounded
+    """
+    def __init__(self, logger, max_queue_size: int = 256):
+        self.logger = logger
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, name="WriteBehindWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, job, *args):
+        """
+        Queue a job, blocks while the queue is full
+        """
+        self._queue.put((job, args))
+
+    def qsize(self):
+        """
+        :return: number of jobs waiting to be written
+        """
+        return self._queue.qsize()
+
+    def flush(self):
+        """
+        Block until every queued job is done
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Write everything still queued and stop the writer thread
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                job, args = item
+                job(*args)
+            except Exception:
+                self.logger.exception("Write-behind job failed")
+            finally:
+                self._queue.task_done()
+
+
+def merge_new_posts(thread_content, opening_post, new_posts):
+    """Add posts that were captured without the full thread to an earlier capture of it
+
+    :param opening_post: fields of the opening post that may have changed, e.g. reply and image counts
+    :return: the merged thread content
+    """
+    known_posts = {post["no"] for post in thread_content["posts"]}
+    posts = list(thread_content["posts"])
+    if posts and posts[0].get("resto") == 0:
+        posts[0] = {**posts[0], **opening_post}
+    posts.extend(post for post in new_posts if post["no"] not in known_posts)
+    return {**thread_content, "posts": posts}
+
+
+def drop_partial_line(path: Path):
+    """
+    Cut off the half written last line a crash can leave in a JSON-Lines file, the next line would be appended to it otherwise
+    """
+    with open(path, "rb+") as infile:
+        data = infile.read()
+        if data and not data.endswith(b"\n"):
+            infile.truncate(data.rfind(b"\n") + 1)
+
+
+def atomic_write_json(path: Path, content, **dump_kwargs):
+    """
+    Write JSON to a temporary file next to path and rename it into place, so a crash never leaves a half written file.
+    A RawJson is written as its bytes, without the dump_kwargs
+
+    :return: size of the written file in bytes
+    """
+    temp_path = path.with_name(path.name + ".tmp")
+    if isinstance(content, RawJson):
+        with open(temp_path, "wb") as outfile:
+            outfile.write(content.data)
+    else:
+        with open(temp_path, "w") as outfile:
+            json.dump(content, outfile, **dump_kwargs)
+    size = temp_path.stat().st_size
+    os.replace(temp_path, path)
+    return size
+
+
+class SegmentedThreadStore:
+    """
+    Compressed storage of thread contents, rolling JSON-Lines segment files per board and day under
+    segments/<day>/<board>. Every capture is one line ``{"thread_id": ..., "captured": ..., "content": {...}}``
+    compressed on its own (a gzip member or an xz stream), so a segment is still a valid .gz/.xz file that can be
+    streamed as a whole, while the sidecar index.jsonl (thread id, segment, offset and length of each capture) lets
+    read_thread decompress a single thread without touching the rest of the segment
+    """
+    def __init__(self, board_code, base_save_path: Path, logger, compression: str = "gzip", max_segment_bytes: int = 64 * 1024 * 1024):
+        if compression not in SEGMENT_COMPRESSIONS:
+            raise ValueError(f"Unknown segment compression '{compression}', choose from {', '.join(SEGMENT_COMPRESSIONS)}")
+        self.board_code = board_code
+        self.base_save_path = Path(base_save_path)
+        self.logger = logger
+        self.bytes_written = 0 # bytes written since the store was created
+        self.compression = compression
+        self.max_segment_bytes = max_segment_bytes
+
+        # index of the folder of self._indexed_day, thread id -> latest index entry
+        self._indexed_day = None
+        self._index = {}
+        self._segment_number = 1
+
+    def get_segment_path(self, day=None):
+        """
+        :return: folder of the segments of the board for the given day (default today)
+        """
+        return self.base_save_path / "segments" / (day or get_day()) / self.board_code
+
+    def save_thread(self, thread_id, thread_content):
+        """Compress the capture and append it to the current segment of the day, rolling over to a new segment when it is full
+        """
+        segment_path = self._open_day()
+        record = {"thread_id": str(thread_id), "captured": time.time()}
+        if isinstance(thread_content, RawJson) and b"\n" not in thread_content.data:
+            # the response body goes into the record as it is, a body over several lines would break the JSON-Lines
+            line = json.dumps(record)[:-1].encode("utf-8") + b', "content": ' + thread_content.data + b"}\n"
+        else:
+            line = (json.dumps({**record, "content": load_json(thread_content)}) + "\n").encode("utf-8")
+        data = SEGMENT_COMPRESSIONS[self.compression]["compress"](line)
+
+        segment_file = segment_path / self._segment_name(self._segment_number)
+        if segment_file.exists() and segment_file.stat().st_size >= self.max_segment_bytes:
+            self._segment_number += 1
+            segment_file = segment_path / self._segment_name(self._segment_number)
+
+        with open(segment_file, "ab") as outfile:
+            offset = outfile.tell()
+            outfile.write(data)
+
+        index_entry = {"thread_id": str(thread_id), "segment": segment_file.name, "offset": offset, "length": len(data), "captured": record["captured"]}
+        index_line = json.dumps(index_entry) + "\n"
+        with open(segment_path / "index.jsonl", "a") as index_file:
+            index_file.write(index_line)
+        self.bytes_written += len(data) + len(index_line)
+        self._index[str(thread_id)] = index_entry
+
+    def append_posts(self, thread_id, opening_post, new_posts):
+        """Store a new capture of the thread made of its latest capture of the day and the given new posts
+
+        :return: False if the thread was not captured today
+        """
+        thread_content = self.read_thread(thread_id)
+        if thread_content is None:
+            return False
+        self.save_thread(thread_id, merge_new_posts(thread_content, opening_post, new_posts))
+        return True
+
+    def mark_thread_dead(self, thread_id):
+        """
+        Segments keep every capture of a dead thread as it is
+        """
+
+    def read_thread(self, thread_id, day=None):
+        """Decompress only the latest capture of a thread
+
+        :param day: day folder to read from as "YYYY_MM_DD" (default today)
+        :return: thread content, None if the thread was not captured that day
+        """
+        if day is None or day == get_day():
+            self._open_day()
+            index = self._index
+        else:
+            index = read_segment_index(self.get_segment_path(day))
+        index_entry = index.get(str(thread_id))
+        if index_entry is None:
+            return None
+        return read_segment_record(self.get_segment_path(day) / index_entry["segment"], index_entry["offset"], index_entry["length"])["content"]
+
+    def _open_day(self):
+        timestamp = get_day()
+        segment_path = self.get_segment_path(timestamp)
+        if self._indexed_day != timestamp:
+            segment_path.mkdir(parents=True, exist_ok=True)
+            if (segment_path / "index.jsonl").exists():
+                drop_partial_line(segment_path / "index.jsonl")
+            self._index = read_segment_index(segment_path)
+            segments = sorted(segment_path.glob("segment_*.jsonl*"))
+            self._segment_number = int(segments[-1].name.split("_")[1].split(".")[0]) if segments else 1
+            self._indexed_day = timestamp
+        return segment_path
+
+    def _segment_name(self, segment_number):
+        return f"segment_{segment_number:05d}.jsonl{SEGMENT_COMPRESSIONS[self.compression]['suffix']}"
+
+
+SEGMENT_COMPRESSIONS = {
+    "gzip": {"suffix": ".gz", "compress": lambda data: gzip.compress(data, mtime=0), "decompress": gzip.decompress},
+    "lzma": {"suffix": ".xz", "compress": lzma.compress, "decompress": lzma.decompress},
+}
+
+
+def read_segment_index(segment_path: Path):
+    """
+    Read the sidecar index of a segment folder, later captures of a thread replace earlier ones
+
+    :return: dictionary of thread id to its latest index entry
+    """
+    index = {}
+    index_path = Path(segment_path) / "index.jsonl"
+    if index_path.exists():
+        with open(index_path, "r") as index_file:
+            for line in index_file:
+                if line.endswith("\n"):
+                    index_entry = json.loads(line)
+                    index[index_entry["thread_id"]] = index_entry
+    return index
+
+
+def read_segment_record(segment_file: Path, offset: int, length: int):
+    """
+    Decompress a single record of a segment file
+
+    :return: the record, a dictionary with thread_id, captured and content
+    """
+    decompress = SEGMENT_COMPRESSIONS["lzma" if Path(segment_file).suffix == ".xz" else "gzip"]["decompress"]
+    with open(segment_file, "rb") as infile:
+        infile.seek(offset)
+        return json.loads(decompress(infile.read(length)))
+
+
+def get_archive_path(base_save_path: Path, day: str, board_code: str):
+    """
+    :return: folder of the compacted archive of a board's snapshot saves of a day, see compaction.DayCompactor
+    """
+    return Path(base_save_path) / "archive" / day / board_code
+
+
+def read_archived_thread(base_save_path: Path, day: str, board_code: str, thread_id, index=None):
+    """Decompress the capture of a thread from the compacted archive of a day
+
+    :param index: the already read index of the archive, read from disk if not given
+    :return: thread content, None if the thread is not in the archive
+    """
+    archive_path = get_archive_path(base_save_path, day, board_code)
+    index_entry = (index if index is not None else read_segment_index(archive_path)).get(str(thread_id))
+    if index_entry is None:
+        return None
+    return read_segment_record(archive_path / index_entry["segment"], index_entry["offset"], index_entry["length"])["content"]
+
+
+def find_previous_day(base_save_path: Path, day: str):
+    """
+    :return: the latest day before the given one that has a saves folder or a compacted archive, None if there is none
+    """
+    earlier_days = [
+        day_path.name
+        for folder in ("saves", "archive") if (Path(base_save_path) / folder).exists()
+        for day_path in (Path(base_save_path) / folder).iterdir()
+        if day_path.is_dir() and day_path.name < day
+    ]
+    return max(earlier_days) if earlier_days else None
+
+
+# glob patterns of the thread files of every storage mode in a data folder, older captures first, with the kind of
+# file read_thread_file reads them as
+THREAD_FILE_LAYOUTS = (
+    ("archive/*/*/archive.jsonl*", "segment"),
+    ("saves/*/threads/*/*.json", "thread"),
+    ("segments/*/*/segment_*.jsonl*", "segment"),
+    ("threads_log/*/*.jsonl", "log"),
+)
+
+
+def read_thread_file(path: Path, kind: str):
+    """Read the thread contents of a file of any storage mode, the board is the name of its folder in every layout
+
+    :param kind: "thread" for a snapshot file, "segment" for an archive or segment file, "log" for an append-only thread log
+    :return: generator of thread contents, a snapshot file that is being replaced by the scraper has none
+    """
+    path = Path(path)
+    if kind == "thread":
+        with open(path, "r") as infile:
+            try:
+                yield json.load(infile)
+            except ValueError:
+                return
+    elif kind == "segment":
+        # every record is compressed on its own, the concatenated members read as one stream
+        open_segment = lzma.open if path.suffix == ".xz" else gzip.open
+        with open_segment(path, "rt", encoding="utf-8") as infile:
+            for line in infile:
+                yield json.loads(line)["content"]
+    elif kind == "log":
+        # every post ever captured, a deleted post is kept like in the snapshots
+        posts = {}
+        with open(path, "r") as infile:
+            for line in infile:
+                # a crash can leave the last line half written
+                if not line.endswith("\n"):
+                    continue
+                event = json.loads(line)
+                if event["event"] in ("post", "op"):
+                    posts[event["post"]["no"]] = event["post"]
+        yield {"posts": [posts[post_no] for post_no in sorted(posts)]}
+    else:
+        raise ValueError(f"Unknown thread file kind '{kind}', choose from thread, segment, log")
+
+
+STORAGE_MODES = {
+    "snapshot": SnapshotThreadStore,
+    "append": AppendOnlyThreadStore,
+    "segmented": SegmentedThreadStore,
+}
+
+
+def create_thread_store(storage_mode, board_code, base_save_path, logger, **store_options):
+    """
+    Create the thread store of a board for the given storage mode
+
+    :param store_options: extra arguments of the store class, e.g. compression for the segmented mode
+    :return: thread store
+    """
+    if storage_mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown storage mode '{storage_mode}', choose from {', '.join(STORAGE_MODES)}")
+    return STORAGE_MODES[storage_mode](board_code, base_save_path, logger, **store_options)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Print a thread saved with the append or segmented storage mode, or from a compacted day")
+    argparser.add_argument("board", type=str, help="Board code of the thread, e.g. 'c'")
+    argparser.add_argument("thread_id", type=str, help="Thread number")
+    argparser.add_argument(
+        "--storage-mode",
+        type=str,
+        choices=["append", "segmented", "archive"],
+        default="append",
+        help="Storage mode the thread was saved with, 'archive' reads a day compacted by compaction.py (default: append)",
+    )
+    argparser.add_argument(
+        "--day",
+        type=str,
+        default=None,
+        help="Day folder to read from in segmented and archive mode, as YYYY_MM_DD (default: today)",
+    )
+    argparser.add_argument(
+        "--data-path",
+        type=str,
+        default=str(Path(__file__).resolve().parents[1] / "data"),
+        help="Path of the data folder (default: 'data' in the 4CTC repo folder)",
+    )
+    args = argparser.parse_args()
+
+    if args.storage_mode == "append":
+        thread_content = AppendOnlyThreadStore(args.board, Path(args.data_path), None).read_thread(args.thread_id)
+    elif args.storage_mode == "segmented":
+        thread_content = SegmentedThreadStore(args.board, Path(args.data_path), None).read_thread(args.thread_id, args.day)
+    else:
+        thread_content = read_archived_thread(Path(args.data_path), args.day or get_day(), args.board, args.thread_id)
+    if thread_content is None:
+        sys.exit(f"Thread {args.thread_id} on board /{args.board}/ not found")
+    json.dump(thread_content, sys.stdout, indent=2)
@@ -0,0 +1,155 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Endpoints:
+    """
+    Static definitions of the 4chan API addresses used by the scraper
+    """
+    def __init__(self, api_base_url: str = "https://a.4cdn.org"):
+        self.api_base_url = api_base_url.rstrip("/")
+
+    def board_list(self):
+        """
+        :return: address of the list of all boards
+        """
+        return f"{self.api_base_url}/boards.json"
+
+    def thread_list(self, board_code):
+        """
+        :return: address of the list of threads on a board
+        """
+        return f"{self.api_base_url}/{board_code}/threads.json"
+
+    def catalog(self, board_code):
+        """
+        :return: address of the catalog of a board, the thread list with every opening post and its last replies
+        """
+        return f"{self.api_base_url}/{board_code}/catalog.json"
+
+    def archive(self, board_code):
+        """
+        :return: address of the list of archived thread ids of a board
+        """
+        return f"{self.api_base_url}/{board_code}/archive.json"
+
+    def thread_content(self, board_code, thread_id):
+        """
+        :return: address of the content of a thread
+        """
+        return f"{self.api_base_url}/{board_code}/thread/{thread_id}.json"
+
+    def media_file(self, board_code, tim, ext):
+        """
+        :return: address of a file attached to a post, on the media host
+        """
+        return f"{self.api_base_url}/{board_code}/{tim}{ext}"
+
+    def thumbnail(self, board_code, tim):
+        """
+        :return: address of the thumbnail of a file attached to a post, on the media host
+        """
+        return f"{self.api_base_url}/{board_code}/{tim}s.jpg"
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # upper bounds in seconds of the request latency histogram
+
+
+class TransportStats:
+    """
+    Per endpoint record of the requests made through a Transport, including their timing and size
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.last_request_time = time.monotonic() # when the last request finished, for the stall watchdog
+
+    def record(self, endpoint, status_code, seconds, content_bytes, wire_bytes):
+        """
+        Add one finished request to the record
+        """
+        with self._lock:
+            stats = self.endpoints.setdefault(
+                endpoint,
+                {"requests": 0, "seconds": 0.0, "bytes": 0, "wire_bytes": 0, "status_codes": {}, "latency_buckets": [0] * len(LATENCY_BUCKETS)},
+            )
+            self.last_request_time = time.monotonic()
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += content_bytes
+            stats["wire_bytes"] += wire_bytes
+            stats["status_codes"][status_code] = stats["status_codes"].get(status_code, 0) + 1
+            for i, upper_bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= upper_bound:
+                    stats["latency_buckets"][i] += 1
+                    break
+
+    def snapshot(self):
+        """
+        :return: copy of the per endpoint record that is safe to read while requests go on
+        """
+        with self._lock:
+            return {
+                endpoint: {**stats, "status_codes": dict(stats["status_codes"]), "latency_buckets": list(stats["latency_buckets"])}
+                for endpoint, stats in self.endpoints.items()
+            }
+
+    def summary(self):
+        """
+        :return: one line summary of every endpoint, meant for logging
+        """
+        with self._lock:
+            parts = []
+            for endpoint, stats in sorted(self.endpoints.items()):
+                mean_ms = stats["seconds"] / stats["requests"] * 1000
+                parts.append(
+                    f"{endpoint}: {stats['requests']} requests, {mean_ms:.0f} ms mean, "
+                    f"{stats['wire_bytes']} bytes received ({stats['bytes']} decoded), status {stats['status_codes']}"
+                )
+            return "; ".join(parts)
+
+
+class Transport:
+    """
+    HTTP transport shared by the Requester and every Board. It owns one pooled keep-alive session, so connections to
+    the API are reused instead of doing a new TCP and TLS handshake for every request, asks for gzip compressed
+    responses and records the timing and size of every request in its stats. A request that cannot connect within
+    the connect timeout, or gets no data for the read timeout, fails instead of holding up the crawl forever
+    """
+    def __init__(self, api_base_url: str = "https://a.4cdn.org", pool_maxsize: int = 4, timeout=(10, 60)):
+        """
+        :param timeout: seconds as (connect timeout, read timeout), or one number for both
+        """
+        self.endpoints = Endpoints(api_base_url)
+        self.stats = TransportStats()
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip", "Connection": "keep-alive"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url, endpoint, headers=None):
+        """Send a GET request through the pooled session
+
+        :param endpoint: name of the endpoint the request is recorded under, e.g. "thread_list"
+        :return: request response
+        """
+        start_time = time.perf_counter()
+        request_response = self.session.get(url, headers=headers, timeout=self.timeout)
+        seconds = time.perf_counter() - start_time
+
+        content_bytes = len(request_response.content)
+        # Content-Length is the size on the wire, before gzip decoding
+        wire_bytes = int(request_response.headers.get("Content-Length", content_bytes))
+        self.stats.record(endpoint, request_response.status_code, seconds, content_bytes, wire_bytes)
+        return request_response
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        self.session.close()
@@ -1,9 +1,70 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
+import logging.handlers
 from pathlib import Path
 import argparse
 import os
 import json
+import html
+import queue
+import re
+import threading
+import time
+
+# Settings that may be left out of config.json, the defaults here are also used by the command line arguments
+OPTIONAL_CONFIG_DEFAULTS = {
+    "async_fetch": False,
+    "max_concurrent_requests": 4,
+    "persist_state": True,
+    "storage_mode": "snapshot",
+    "write_behind": False,
+    "write_queue_size": 256,
+    "segment_compression": "gzip",
+    "search_index": False,
+    "scheduling": "round_robin",
+    "scheduler_refresh_interval": 60,
+    "adaptive_polling": False,
+    "min_poll_interval": 10,
+    "max_poll_interval": 300,
+    "catalog_delta": False,
+    "backfill": False,
+    "backfill_interval": 3600,
+    "metrics_port": 0,
+    "api_base_url": "https://a.4cdn.org",
+    "checkpoint_interval": 300,
+    "board_list_ttl": 86400,
+    "workers": 1,
+    "coordinator_address": "",
+    "worker_id": "",
+    "post_sink": "",
+    "post_sink_path": "",
+    "post_sink_queue_size": 10000,
+    "post_sink_backpressure": "block",
+    "post_sink_rotate_mb": 100,
+    "compaction_interval": 0,
+    "retry_max_attempts": 6,
+    "retry_base_delay": 5,
+    "retry_max_delay": 300,
+    "breaker_failure_threshold": 5,
+    "breaker_reset_timeout": 60,
+    "json_log": False,
+    "log_max_mb": 50,
+    "log_backup_count": 5,
+    "debug_log_sampling": 10,
+    "record_traces": False,
+    "profile_seconds": 0,
+    "stall_timeout": 0,
+    "raw_passthrough": False,
+    "daemon": False,
+    "config_watch_interval": 5,
+    "media_capture": "",
+    "media_base_url": "https://i.4cdn.org",
+    "media_workers": 2,
+    "media_rate_limit_kb": 1024,
+    "media_queue_size": 10000,
+    "connect_timeout": 10,
+    "read_timeout": 60,
+}
 
 def get_argparser():
     """
@@ -58,9 +119,334 @@ def get_argparser():
         dest="clean_log", 
         help="If provided, logs older than 3 days will not be removed",
     )
+    argparser.add_argument(
+        "--async-fetch",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["async_fetch"],
+        help="If provided, thread contents are requested concurrently, still keeping to the request time limit",
+    )
+    argparser.add_argument(
+        "--max-concurrent-requests",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["max_concurrent_requests"],
+        help="Maximum number of requests in flight at the same time when --async-fetch is used (default: 4)",
+    )
+    argparser.add_argument(
+        "--no-persist-state",
+        action="store_false",
+        dest="persist_state",
+        help="If provided, the crawl state is not stored in 'data/state', so a restart requests every thread again",
+    )
+    argparser.add_argument(
+        "--storage-mode",
+        type=str,
+        choices=["snapshot", "append", "segmented"],
+        default=OPTIONAL_CONFIG_DEFAULTS["storage_mode"],
+        help="'snapshot' (default) rewrites one JSON file per thread on every capture, 'append' only appends new posts, deletions and thread deaths to one event log per thread, 'segmented' writes every capture to compressed rolling JSON-Lines segments per board and day",
+    )
+    argparser.add_argument(
+        "--segment-compression",
+        type=str,
+        choices=["gzip", "lzma"],
+        default=OPTIONAL_CONFIG_DEFAULTS["segment_compression"],
+        help="Compression of the segment files when --storage-mode segmented is used (default: gzip)",
+    )
+    argparser.add_argument(
+        "--write-behind",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["write_behind"],
+        help="If provided, thread contents are written by a background writer so requests do not wait for the disk",
+    )
+    argparser.add_argument(
+        "--write-queue-size",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["write_queue_size"],
+        help="Maximum number of captured threads waiting for the background writer (default: 256)",
+    )
+    argparser.add_argument(
+        "--search-index",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["search_index"],
+        help="If provided, captured posts are added to the full-text index in 'data/search' as they are saved",
+    )
+    argparser.add_argument(
+        "--scheduling",
+        type=str,
+        choices=["round_robin", "priority"],
+        default=OPTIONAL_CONFIG_DEFAULTS["scheduling"],
+        help="'round_robin' (default) fetches the threads of one board after another, 'priority' fetches the threads of all boards in order of how likely they are to die or change",
+    )
+    argparser.add_argument(
+        "--scheduler-refresh-interval",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["scheduler_refresh_interval"],
+        help="Seconds between two polls of each board's thread list with --scheduling priority, also how often the scheduler reports (default: 60)",
+    )
+    argparser.add_argument(
+        "--adaptive-polling",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["adaptive_polling"],
+        help="If provided, each board's thread list is polled on its own interval based on how active the board is (implies --scheduling priority)",
+    )
+    argparser.add_argument(
+        "--min-poll-interval",
+        type=check_poll_interval,
+        default=OPTIONAL_CONFIG_DEFAULTS["min_poll_interval"],
+        help="Shortest interval in seconds between two polls of a board with --adaptive-polling (at least 10, default: 10)",
+    )
+    argparser.add_argument(
+        "--max-poll-interval",
+        type=check_poll_interval,
+        default=OPTIONAL_CONFIG_DEFAULTS["max_poll_interval"],
+        help="Longest interval in seconds between two polls of a board with --adaptive-polling (default: 300)",
+    )
+    argparser.add_argument(
+        "--catalog-delta",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["catalog_delta"],
+        help="If provided, boards are polled through their catalog and small thread updates are taken from the last replies it shows instead of fetching the thread",
+    )
+    argparser.add_argument(
+        "--backfill",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["backfill"],
+        help="If provided, the final state of every archived thread of the monitored boards is downloaded to 'data/finalized'",
+    )
+    argparser.add_argument(
+        "--backfill-interval",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["backfill_interval"],
+        help="Seconds between two backfills of the archive of each board with --backfill (default: 3600)",
+    )
+    argparser.add_argument(
+        "--metrics-port",
+        type=check_port,
+        default=OPTIONAL_CONFIG_DEFAULTS["metrics_port"],
+        help="If provided, metrics in the Prometheus text format are served on http://127.0.0.1:<port>/metrics (default: 0, disabled)",
+    )
+    argparser.add_argument(
+        "--api-base-url",
+        type=str,
+        default=OPTIONAL_CONFIG_DEFAULTS["api_base_url"],
+        help="Address of the API, e.g. a local mock API for benchmarks (default: https://a.4cdn.org)",
+    )
+    argparser.add_argument(
+        "--checkpoint-interval",
+        type=check_non_negative_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["checkpoint_interval"],
+        help="Seconds between two checkpoints of the crawl state in 'data/state/checkpoint.json', which is also written on exit, 0 disables it (default: 300)",
+    )
+    argparser.add_argument(
+        "--board-list-ttl",
+        type=check_non_negative_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["board_list_ttl"],
+        help="Seconds the list of boards is cached in 'data/state/board_list.json', 0 always requests it (default: 86400)",
+    )
+    argparser.add_argument(
+        "--workers",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["workers"],
+        help="Number of worker processes the boards are split over, each writes to 'partitions/<worker id>' in the output path (default: 1)",
+    )
+    argparser.add_argument(
+        "--coordinator-address",
+        type=str,
+        default=OPTIONAL_CONFIG_DEFAULTS["coordinator_address"],
+        help="'host:port' of a coordinator started with 'python src/coordinator.py', to join a crawl sharded over several hosts as a worker",
+    )
+    argparser.add_argument(
+        "--worker-id",
+        type=str,
+        default=OPTIONAL_CONFIG_DEFAULTS["worker_id"],
+        help="Name of this worker at the coordinator (default: <hostname>-<process id>)",
+    )
+    argparser.add_argument(
+        "--post-sink",
+        type=str,
+        choices=["stdout", "socket", "file"],
+        default=OPTIONAL_CONFIG_DEFAULTS["post_sink"],
+        help="If provided, every newly captured post is streamed as an NDJSON record to the standard output, a Unix domain socket or a rotating file",
+    )
+    argparser.add_argument(
+        "--post-sink-path",
+        type=str,
+        default=OPTIONAL_CONFIG_DEFAULTS["post_sink_path"],
+        help="Path of the socket or file of the post stream (default: 'data/stream/posts.sock' or 'data/stream/posts.ndjson')",
+    )
+    argparser.add_argument(
+        "--post-sink-queue-size",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["post_sink_queue_size"],
+        help="Maximum number of post records waiting for the sink (default: 10000)",
+    )
+    argparser.add_argument(
+        "--post-sink-backpressure",
+        type=str,
+        choices=["block", "drop"],
+        default=OPTIONAL_CONFIG_DEFAULTS["post_sink_backpressure"],
+        help="When the post stream queue is full, 'block' (default) waits for the sink, 'drop' discards the records",
+    )
+    argparser.add_argument(
+        "--post-sink-rotate-mb",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["post_sink_rotate_mb"],
+        help="Size in MB at which the post stream file is rotated (default: 100)",
+    )
+    argparser.add_argument(
+        "--compaction-interval",
+        type=check_non_negative_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["compaction_interval"],
+        help="Seconds between two runs of the background job that compacts closed days of 'data/saves' into 'data/archive', 0 disables it (default: 0)",
+    )
+    argparser.add_argument(
+        "--retry-max-attempts",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["retry_max_attempts"],
+        help="Attempts of a failed thread request before it is given up until the thread changes again (default: 6)",
+    )
+    argparser.add_argument(
+        "--retry-base-delay",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["retry_base_delay"],
+        help="Seconds before the first retry of a failed request, doubled for every further attempt and jittered (default: 5)",
+    )
+    argparser.add_argument(
+        "--retry-max-delay",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["retry_max_delay"],
+        help="Maximum seconds between two attempts of a failed request (default: 300)",
+    )
+    argparser.add_argument(
+        "--breaker-failure-threshold",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["breaker_failure_threshold"],
+        help="Failed requests in a row after which a board is paused (default: 5)",
+    )
+    argparser.add_argument(
+        "--breaker-reset-timeout",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["breaker_reset_timeout"],
+        help="Seconds a board is paused before it is tried again, doubled while it keeps failing (default: 60)",
+    )
+    argparser.add_argument(
+        "--json-log",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["json_log"],
+        help="If provided, the saved logs are written as one JSON object per line to 'info_log.jsonl' and 'debug_log.jsonl'",
+    )
+    argparser.add_argument(
+        "--log-max-mb",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["log_max_mb"],
+        help="Size in MB at which a saved log is rotated (default: 50)",
+    )
+    argparser.add_argument(
+        "--log-backup-count",
+        type=check_non_negative_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["log_backup_count"],
+        help="Number of rotated files kept of each saved log (default: 5)",
+    )
+    argparser.add_argument(
+        "--debug-log-sampling",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["debug_log_sampling"],
+        help="Of a debug message repeated more than 100 times a minute, e.g. for every thread, only every n-th is logged, 1 logs all (default: 10)",
+    )
+    argparser.add_argument(
+        "--record-traces",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["record_traces"],
+        help="If provided, every polled thread list is kept in 'data/traces' to replay in the crawl simulator",
+    )
+    argparser.add_argument(
+        "--profile-seconds",
+        type=check_non_negative_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["profile_seconds"],
+        help="Seconds a profile runs after the process gets SIGUSR1, 0 ignores the signal (default: 0)",
+    )
+    argparser.add_argument(
+        "--stall-timeout",
+        type=check_non_negative_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["stall_timeout"],
+        help="Seconds without a finished request after which the stacks of all threads are logged, 0 disables it (default: 0)",
+    )
+    argparser.add_argument(
+        "--raw-passthrough",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["raw_passthrough"],
+        help="If provided, threads and thread lists are saved as the bytes the API sent instead of being parsed and written again",
+    )
+    argparser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=OPTIONAL_CONFIG_DEFAULTS["daemon"],
+        help="If provided, run as a daemon: reload config.json when it changes or on SIGHUP, refresh the board list and stop cleanly on SIGTERM",
+    )
+    argparser.add_argument(
+        "--config-watch-interval",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["config_watch_interval"],
+        help="Seconds between checks of config.json for changes in daemon mode (default: 5)",
+    )
+    argparser.add_argument(
+        "--media-capture",
+        type=str,
+        choices=["thumbnails", "files", "both"],
+        default=OPTIONAL_CONFIG_DEFAULTS["media_capture"],
+        help="If provided, the thumbnails, files or both of newly captured posts are downloaded into data/media, every file once by its md5",
+    )
+    argparser.add_argument(
+        "--media-base-url",
+        type=str,
+        default=OPTIONAL_CONFIG_DEFAULTS["media_base_url"],
+        help="Base URL of the media host (default: https://i.4cdn.org)",
+    )
+    argparser.add_argument(
+        "--media-workers",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["media_workers"],
+        help="Number of concurrent media downloads, on connections of their own (default: 2)",
+    )
+    argparser.add_argument(
+        "--media-rate-limit-kb",
+        type=check_non_negative_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["media_rate_limit_kb"],
+        help="Maximum download rate of the media capture in KB per second, 0 leaves it unlimited (default: 1024)",
+    )
+    argparser.add_argument(
+        "--media-queue-size",
+        type=check_positive_int,
+        default=OPTIONAL_CONFIG_DEFAULTS["media_queue_size"],
+        help="Maximum number of media files waiting for download, further files are dropped (default: 10000)",
+    )
+    argparser.add_argument(
+        "--connect-timeout",
+        type=check_timeout,
+        default=OPTIONAL_CONFIG_DEFAULTS["connect_timeout"],
+        help="Seconds to wait for a connection to the API before the request fails (default: 10)",
+    )
+    argparser.add_argument(
+        "--read-timeout",
+        type=check_timeout,
+        default=OPTIONAL_CONFIG_DEFAULTS["read_timeout"],
+        help="Seconds to wait for data from the API before the request fails (default: 60)",
+    )
     return argparser
 
 
+def get_optional_settings(source):
+    """
+    Collect the optional settings either from parsed command line arguments or from a loaded config dictionary,
+    settings missing in the config fall back to their defaults
+
+    :param source: argparse namespace or config dictionary
+    :return: dictionary of optional settings keyed by Requester argument name
+    """
+    if isinstance(source, dict):
+        return {key: source.get(key, default) for key, default in OPTIONAL_CONFIG_DEFAULTS.items()}
+    return {key: getattr(source, key) for key in OPTIONAL_CONFIG_DEFAULTS}
+
+
 def check_positive_float(value):
     """
     A helper function to ensure request interval argument is above one
@@ -71,67 +457,164 @@ def check_positive_float(value):
         raise argparse.ArgumentTypeError(f"--request-time-limit value should be at least 1, now is {value}")
     return fvalue
 
+def check_timeout(value):
+    """
+    A helper function to ensure a timeout is above zero, fractions of a second are allowed
+    :return: timeout in seconds
+    """
+    fvalue = float(value)
+    if not fvalue > 0:
+        raise argparse.ArgumentTypeError(f"timeout should be above 0 seconds, now is {value}")
+    return fvalue
+
+def check_poll_interval(value):
+    """
+    A helper function to ensure poll intervals keep to the API rule of at least 10 seconds between thread list requests
+    :return: poll interval
+    """
+    fvalue = float(value)
+    if fvalue < 10:
+        raise argparse.ArgumentTypeError(f"poll interval should be at least 10 seconds, now is {value}")
+    return fvalue
+
+def check_positive_int(value):
+    """
+    A helper function to ensure integer arguments are at least one
+    :return: integer value
+    """
+    ivalue = int(value)
+    if ivalue < 1:
+        raise argparse.ArgumentTypeError(f"value should be at least 1, now is {value}")
+    return ivalue
+
+def check_non_negative_int(value):
+    """
+    A helper function to ensure integer arguments are at least zero
+    :return: integer value
+    """
+    ivalue = int(value)
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError(f"value should be at least 0, now is {value}")
+    return ivalue
+
+def check_port(value):
+    """
+    A helper function to ensure a port number is valid, 0 stands for disabled
+    :return: port number
+    """
+    ivalue = int(value)
+    if ivalue < 0 or ivalue > 65535:
+        raise argparse.ArgumentTypeError(f"port should be between 0 and 65535, now is {value}")
+    return ivalue
+
 class LoggerManager:
     """
-    Logger class for scraper tool
+    Logger class for scraper tool. Logging calls only put the record on a queue, a background listener thread
+    formats them and does the file I/O. The info and debug logs are rotated when they reach log_max_mb, keeping
+    log_backup_count older files, and repeated debug messages are sampled, see SamplingFilter
     """
-    def __init__(self, base_save_path: Path, logfolderpath: Path, save_log: bool):
+    def __init__(self, base_save_path: Path, logfolderpath: Path, save_log: bool, json_log: bool = False, log_max_mb: int = 50, log_backup_count: int = 5, debug_log_sampling: int = 10):
         self.save_log = save_log
         if self.save_log:
             self.logfolder = base_save_path / logfolderpath
             self.logfolder.mkdir(parents=True, exist_ok=True)
         self.logfolder = base_save_path / logfolderpath
         self.logger = None
+        self.json_log = json_log
+        self.log_max_mb = log_max_mb
+        self.log_backup_count = log_backup_count
+        self.debug_log_sampling = debug_log_sampling
+        self._listener = None
+        self._queue_handler = None
+        self._stream_log_level = logging.INFO
+        self._next_cleanup_time = 0.0
 
     def setup_logging(self, stream_log_level=logging.INFO):
         """
         Setup logger
         """
         self.logger = logging.getLogger("4chan_requester")
-        self.logger.setLevel(logging.DEBUG)
+        self._stream_log_level = stream_log_level
         log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(threadName)s - %(message)s")
 
         streamlogs = logging.StreamHandler()
         streamlogs.setLevel(stream_log_level)
         streamlogs.setFormatter(log_formatter)
-        self.logger.addHandler(streamlogs)
+        handlers = [streamlogs]
 
         if self.save_log:
-            self._setup_save_logging(log_formatter)
+            handlers.extend(self._setup_save_logging(JsonLogFormatter() if self.json_log else log_formatter))
+
+        # debug calls return right away when no handler takes them
+        self.logger.setLevel(min(handler.level for handler in handlers))
+        queue_handler = LazyQueueHandler(queue.SimpleQueue())
+        if self.debug_log_sampling > 1:
+            queue_handler.addFilter(SamplingFilter(self.debug_log_sampling))
+        self.logger.addHandler(queue_handler)
+        self._queue_handler = queue_handler
+        self._listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        self._listener.start()
 
         self.logger.debug("Logger Initialized")
 
     def _setup_save_logging(self, log_formatter):
-        infologpath = self.logfolder / ("info_log" + self._get_full_time() + ".log")
-        infologfile = logging.FileHandler(infologpath)
+        suffix = ".jsonl" if self.json_log else ".log"
+        infologfile = logging.handlers.RotatingFileHandler(
+            self.logfolder / ("info_log" + suffix), maxBytes=self.log_max_mb * 1024 * 1024, backupCount=self.log_backup_count
+        )
         infologfile.setLevel(logging.INFO)
         infologfile.setFormatter(log_formatter)
-        self.logger.addHandler(infologfile)
 
-        debuglogpath = self.logfolder / ("debug_log" + self._get_full_time() + ".log")
-        debuglogfile = logging.FileHandler(debuglogpath)
+        debuglogfile = logging.handlers.RotatingFileHandler(
+            self.logfolder / ("debug_log" + suffix), maxBytes=self.log_max_mb * 1024 * 1024, backupCount=self.log_backup_count
+        )
         debuglogfile.setLevel(logging.DEBUG)
         debuglogfile.setFormatter(log_formatter)
-        self.logger.addHandler(debuglogfile)
-
-    def _get_full_time(self):
-        now = datetime.utcnow()
-        return now.strftime("%Y_%m_%d_%H_%M_%S")
+        return [infologfile, debuglogfile]
 
     def cleanup_old_logs(self, days_to_keep: int = 3):
         """
-        Clean up/Delete old logs
+        Clean up/Delete old logs, rotated logs and the timestamped logs of older versions that were not written to
+        for days_to_keep days. The size of the logs is already bounded by the rotation, so this runs at most once an hour
         """
-        now = datetime.utcnow()
-        threshold_date = now - timedelta(days=days_to_keep)
-
-        for log_file in self.logfolder.glob("*.log"):
-            file_date_str = log_file.name[-len("yyyy_mm_dd_hh_mm_ss.log"):-len(".log")]
-            file_date = datetime.strptime(file_date_str, "%Y_%m_%d_%H_%M_%S")
-            
-            if file_date < threshold_date:
+        if time.time() < self._next_cleanup_time:
+            return
+        self._next_cleanup_time = time.time() + 3600
+        threshold_time = time.time() - days_to_keep * 86400
+
+        for log_file in self.logfolder.glob("*_log*"):
+            if log_file.name in ("info_log.log", "debug_log.log", "info_log.jsonl", "debug_log.jsonl"):
+                # the logs written to right now
+                continue
+            if log_file.stat().st_mtime < threshold_time:
                 os.remove(log_file)
 
+    def reconfigure(self, save_log: bool, json_log: bool, log_max_mb: int, log_backup_count: int, debug_log_sampling: int):
+        """
+        Switch a running logger to new settings, the records queued so far are written with the old ones
+        """
+        handlers = self._listener.handlers if self._listener is not None else ()
+        self.close()
+        self.logger.removeHandler(self._queue_handler)
+        for handler in handlers:
+            handler.close()
+        self.save_log = save_log
+        if self.save_log:
+            self.logfolder.mkdir(parents=True, exist_ok=True)
+        self.json_log = json_log
+        self.log_max_mb = log_max_mb
+        self.log_backup_count = log_backup_count
+        self.debug_log_sampling = debug_log_sampling
+        self.setup_logging(self._stream_log_level)
+
+    def close(self):
+        """
+        Write out the records still queued and stop the listener thread
+        """
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
     def get_logger(self):
         """
         :return: the logger object
@@ -141,6 +624,63 @@ class LoggerManager:
         return self.logger
 
 
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue as they are, the message is only formatted by the handlers in the listener thread.
+    Arguments of %-style logging calls must therefore not be changed after the call
+    """
+    def prepare(self, record):
+        return record
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line, with the fields passed in extra= of the logging call
+    """
+    STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.STANDARD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Samples high volume debug messages, e.g. one line per thread on every sweep. Of the debug records with the same
+    message template (the unformatted message of a %-style logging call), the first burst in every interval
+    seconds pass, then only every sample_every-th. Records of other levels always pass. Records are logged from
+    many threads (fetcher pool, writer, media and backfill), the counts are only changed under a lock
+    """
+    def __init__(self, sample_every: int = 10, burst: int = 100, interval: float = 60):
+        super().__init__()
+        self.sample_every = sample_every
+        self.burst = burst
+        self.interval = interval
+        self._counts = {}
+        self._window_end = 0.0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG:
+            return True
+        with self._lock:
+            if record.created >= self._window_end:
+                self._counts = {}
+                self._window_end = record.created + self.interval
+            count = self._counts.get(record.msg, 0) + 1
+            self._counts[record.msg] = count
+        return count <= self.burst or count % self.sample_every == 0
+
+
 def get_time():
     """
     :return: time information
@@ -156,6 +696,23 @@ def get_day():
     return now.strftime("%Y_%m_%d")
 
 
+_LINE_BREAK_PATTERN = re.compile(r"<br\s*/?>", re.IGNORECASE)
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+def strip_html(text):
+    """
+    Turn the HTML of a post comment or subject into plain text, line breaks are kept as newlines
+
+    :return: plain text, empty string for missing text
+    """
+    if not text:
+        return ""
+    text = _LINE_BREAK_PATTERN.sub("\n", text)
+    text = _TAG_PATTERN.sub("", text)
+    return html.unescape(text)
+
+
 def load_and_validate_config(config_path):
     """
     Load configuration from a JSON file and validate required fields.
@@ -0,0 +1,5 @@
+from pathlib import Path
+import sys
+
+# the modules in src import each other by their flat names, like when src/requester.py is run
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
@@ -0,0 +1,102 @@
+import json
+import logging
+import socket
+import time
+import requests
+from backfill import ArchiveBackfiller
+from mock_api import MockApiServer
+from ratelimit import TokenBucket
+from transport import Transport
+
+
+class FailingThreadTransport(Transport):
+    """
+    Transport whose requests for archived threads never connect
+    """
+    def get(self, url, endpoint, headers=None):
+        if endpoint == "archive_thread":
+            raise requests.ConnectionError("connection refused")
+        return super().get(url, endpoint, headers=headers)
+
+
+def get_closed_port():
+    with socket.socket() as unused_socket:
+        unused_socket.bind(("127.0.0.1", 0))
+        return unused_socket.getsockname()[1]
+
+
+def make_backfiller(transport, tmp_path):
+    return ArchiveBackfiller(transport, TokenBucket(0.01), logging.getLogger("test_backfill"), tmp_path, max_workers=2, retry_delay=0.01)
+
+
+def archive_live_threads(mock_api, count):
+    board = mock_api.boards["a"]
+    board.archived = list(board.threads)[:count]
+    return [str(thread_id) for thread_id in board.archived]
+
+
+def test_unreachable_archive_is_skipped(tmp_path):
+    transport = Transport(f"http://127.0.0.1:{get_closed_port()}", timeout=(1, 1))
+    try:
+        assert make_backfiller(transport, tmp_path).run_due(["a"]) == 0
+    finally:
+        transport.close()
+
+
+def test_failed_thread_requests_are_tried_again_on_the_next_backfill(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=5, latency=0, threads_per_second=0).start()
+    transport = FailingThreadTransport(mock_api.api_base_url)
+    try:
+        archive_live_threads(mock_api, 3)
+        backfiller = make_backfiller(transport, tmp_path)
+        assert backfiller.backfill_board("a") == 0
+        assert backfiller.checkpoint["a"] == {"finalized": [], "missing": []}
+    finally:
+        transport.close()
+        mock_api.close()
+
+
+def test_background_backfill_does_not_hold_up_the_caller(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=20, latency=0.05, threads_per_second=0).start()
+    transport = Transport(mock_api.api_base_url)
+    backfiller = make_backfiller(transport, tmp_path)
+    try:
+        thread_ids = archive_live_threads(mock_api, 20)
+        start_time = time.monotonic()
+        backfiller.start(lambda: ["a"])
+        # the 21 requests take over a second, starting them does not
+        assert time.monotonic() - start_time < 0.5
+        deadline = time.monotonic() + 10
+        while len(list(backfiller.get_finalized_path("a").glob("*.json"))) < len(thread_ids) and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        backfiller.close()
+        transport.close()
+        mock_api.close()
+    assert sorted(path.stem for path in backfiller.get_finalized_path("a").glob("*.json")) == sorted(thread_ids)
+    with open(tmp_path / "state" / "backfill_checkpoint.json", "r") as infile:
+        assert sorted(json.load(infile)["a"]["finalized"]) == sorted(thread_ids)
+
+
+def test_backfill_resumes_from_its_checkpoint(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=8, latency=0, threads_per_second=0).start()
+    transport = Transport(mock_api.api_base_url)
+    try:
+        board = mock_api.boards["a"]
+        live_thread_ids = [str(thread_id) for thread_id in board.threads]
+        # threads 0 to 3 are archived, one of them was pruned from the mock board and is gone
+        board.archived = [int(thread_id) for thread_id in live_thread_ids[:3]] + [1]
+        assert make_backfiller(transport, tmp_path).backfill_board("a") == 3
+        assert mock_api.count_requests("thread") == 4
+
+        # after a restart only the newly archived threads are requested, the first thread fell out of the archive
+        board.archived = [int(thread_id) for thread_id in live_thread_ids[1:5]] + [1]
+        backfiller = make_backfiller(transport, tmp_path)
+        # written by an interrupted run after its last checkpoint
+        (backfiller.get_finalized_path("a") / f"{live_thread_ids[4]}.json").write_text("{}")
+        assert backfiller.backfill_board("a") == 1
+        assert mock_api.count_requests("thread") == 5
+        assert backfiller.checkpoint["a"] == {"finalized": live_thread_ids[1:4], "missing": ["1"]}
+    finally:
+        transport.close()
+        mock_api.close()
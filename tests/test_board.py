@@ -0,0 +1,101 @@
+import json
+import logging
+import time
+from board import Board
+from mock_api import MockApiServer
+from retry import RetryQueue
+from storage import WriteBehindWriter
+from transport import Transport
+
+
+def make_thread_list(*threads):
+    return [{"page": 1, "threads": [{"no": thread_no, "last_modified": last_modified, "replies": replies} for thread_no, last_modified, replies in threads]}]
+
+
+def test_failed_delta_on_the_writer_thread_requests_a_full_fetch(tmp_path):
+    logger = logging.getLogger("test_board")
+    writer = WriteBehindWriter(logger)
+    board = Board("a", logger, base_save_path=tmp_path, storage_mode="segmented", writer=writer)
+    board.initialize()
+    try:
+        assert board.get_threads_to_update(make_thread_list((5, 100, 3))) == ["5"]
+        board.thread_tails["5"] = (8, 3)
+        # nothing of the thread is stored, the delta cannot be added
+        board.save_thread_delta("5", {"no": 5, "resto": 0}, [{"no": 9, "resto": 5}])
+        writer.flush()
+    finally:
+        writer.close()
+
+    # the writer thread left the capture state alone, the next thread list applies the request
+    assert board.tracking_threads["5"] == [100, 3]
+    assert board.get_threads_to_update(make_thread_list((5, 100, 4))) == ["5"]
+    assert "5" not in board.thread_tails
+
+
+def test_threads_waiting_for_a_retry_are_fetched_after_a_restart_from_the_checkpoint(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=2, latency=0, replies_per_second=0, threads_per_second=0).start()
+    logger = logging.getLogger("test_board")
+    transport = Transport(mock_api.api_base_url)
+    try:
+        board = Board("a", logger, transport, base_save_path=tmp_path, retry_queue=RetryQueue())
+        board.thread_content_request_interval = 0
+        thread_list = board.get_online_thread_list()
+        failing_thread_id, fetched_thread_id = board.get_threads_to_update(thread_list)
+        assert board.get_thread_content(fetched_thread_id) is not None
+        mock_api.error_rate = 1
+        assert board.get_thread_content(failing_thread_id) is None
+        checkpoint_state = json.loads(json.dumps(board.get_checkpoint_state()))
+    finally:
+        transport.close()
+        mock_api.close()
+
+    # the retry queue is gone after the restart, the thread list brings the failed thread back
+    restarted_board = Board("a", logger, base_save_path=tmp_path, retry_queue=RetryQueue(), checkpoint_state=checkpoint_state)
+    restarted_board.initialize()
+    assert restarted_board.get_threads_to_update(thread_list) == [failing_thread_id]
+
+
+def test_catalog_delta_only_captures_updates_without_gaps(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=3, replies_per_thread=10, latency=0, replies_per_second=0, threads_per_second=0).start()
+    transport = Transport(mock_api.api_base_url)
+    try:
+        board = Board("a", logging.getLogger("test_board"), transport, base_save_path=tmp_path, catalog_delta=True)
+        board.thread_list_request_interval = board.thread_content_request_interval = 0
+        mock_board = mock_api.boards["a"]
+        small_update, large_update, deletion = (str(thread_id) for thread_id in sorted(mock_board.threads))
+        for _ in range(3):
+            mock_board._new_reply(int(deletion))
+        for thread_id in board.get_threads_to_update(board.get_online_thread_list()):
+            board.save_thread_content(thread_id, board.get_thread_content(thread_id))
+
+        # last_modified has a resolution of one second
+        time.sleep(1.1)
+        for _ in range(2):
+            mock_board._new_reply(int(small_update))
+        for _ in range(7):
+            mock_board._new_reply(int(large_update))
+        # one reply deleted and one new, the reply count stays the same
+        del mock_board.threads[int(deletion)][1]
+        mock_board._new_reply(int(deletion))
+
+        thread_ids = board.get_threads_to_update(board.get_online_thread_list())
+        assert sorted(board.capture_from_catalog(thread_ids)) == sorted([large_update, deletion])
+        stored_posts = [post["no"] for post in board.thread_store.read_thread(small_update)["posts"]]
+        assert stored_posts == [post["no"] for post in mock_board.threads[int(small_update)]]
+        assert board.thread_tails[small_update] == (stored_posts[-1], len(stored_posts) - 1)
+    finally:
+        transport.close()
+        mock_api.close()
+    assert mock_api.count_requests("thread") == 3
+
+
+def test_a_forgotten_update_is_fetched_with_the_next_thread_list(tmp_path):
+    board = Board("a", logging.getLogger("test_board"), base_save_path=tmp_path)
+    board.initialize()
+    thread_list = make_thread_list((1, 100, 3), (2, 200, 5))
+    assert board.get_threads_to_update(thread_list) == ["1", "2"]
+    board.forget_thread_update("2")
+    board.forget_thread_update("3")
+    assert board.tracking_threads == {"1": [100, 3], "2": [0, 5]}
+    assert board.get_threads_to_update(thread_list) == ["2"]
+    assert board.get_threads_to_update(thread_list) == []
@@ -0,0 +1,60 @@
+import logging
+from board import Board
+from checkpoint import BoardListCache, CrawlCheckpoint
+from mock_api import MockApiServer
+from scheduler import BoardPollPlanner, ThreadScheduler
+from transport import Transport
+
+
+def test_crawl_state_round_trips_through_the_checkpoint(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=3, latency=0, replies_per_second=0, threads_per_second=0).start()
+    logger = logging.getLogger("test_checkpoint")
+    transport = Transport(mock_api.api_base_url)
+    try:
+        board = Board("a", logger, transport, base_save_path=tmp_path)
+        board.thread_content_request_interval = 0
+        thread_ids = board.get_threads_to_update(board.get_online_thread_list())
+        board.save_thread_content(thread_ids[0], board.get_thread_content(thread_ids[0]))
+        scheduler = ThreadScheduler()
+        scheduler.push_board_threads(board, thread_ids[1:])
+        planner = BoardPollPlanner([board], fixed_interval=60)
+        planner.pop_due_boards()
+        planner.schedule(board)
+        checkpoint = CrawlCheckpoint(tmp_path / "state" / "checkpoint.json")
+        checkpoint.save([board], scheduler, planner)
+
+        checkpoint_data = CrawlCheckpoint(tmp_path / "state" / "checkpoint.json").load()
+        restored_board = Board("a", logger, transport, base_save_path=tmp_path / "restored", checkpoint_state=checkpoint_data["boards"]["a"])
+        # nothing is loaded or created until the board is used, its state is saved again as it was
+        assert not (tmp_path / "restored").exists()
+        assert restored_board.get_checkpoint_state() == checkpoint_data["boards"]["a"]
+
+        restored_board.initialize()
+        assert restored_board.tracking_threads == board.tracking_threads
+        assert restored_board.thread_tails == board.thread_tails
+        assert restored_board.prepare_thread_request(thread_ids[0]) == board.prepare_thread_request(thread_ids[0])
+        assert restored_board.prepare_thread_request(thread_ids[0])[1] is not None
+        restored_scheduler = ThreadScheduler()
+        restored_scheduler.restore_pending([restored_board], checkpoint_data["scheduler"])
+        assert sorted(thread_id for _, thread_id in restored_scheduler.pop_batch(10)) == sorted(thread_ids[1:])
+        assert BoardPollPlanner([restored_board], next_polls=checkpoint_data["next_polls"]).pop_due_boards() == []
+    finally:
+        transport.close()
+        mock_api.close()
+
+
+def test_an_unreadable_checkpoint_is_ignored(tmp_path):
+    checkpoint_path = tmp_path / "checkpoint.json"
+    assert CrawlCheckpoint(checkpoint_path).load() is None
+    checkpoint_path.write_text('{"saved": 1')
+    assert CrawlCheckpoint(checkpoint_path).load() is None
+
+
+def test_board_list_cache_expires(tmp_path):
+    cache = BoardListCache(tmp_path / "boards.json", ttl=3600)
+    assert cache.get() is None
+    cache.put(["a", "b"])
+    assert cache.get() == ["a", "b"]
+    assert BoardListCache(tmp_path / "boards.json", ttl=0).get() is None
+    cache.invalidate()
+    assert cache.get() is None
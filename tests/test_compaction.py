@@ -0,0 +1,42 @@
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from compaction import DayCompactor
+from utils import get_day
+
+COMPACTION_SCRIPT = Path(__file__).resolve().parents[1] / "src" / "compaction.py"
+
+
+def make_day(data_path, day):
+    thread_path = data_path / "saves" / day / "threads" / "a" / "1_00_00_00.json"
+    thread_path.parent.mkdir(parents=True)
+    thread_path.write_text('{"posts": [{"no": 1, "resto": 0}]}')
+
+
+def run_compaction(data_path, *arguments):
+    return subprocess.run(
+        [sys.executable, str(COMPACTION_SCRIPT), "--data-path", str(data_path), *arguments], capture_output=True, text=True
+    )
+
+
+def test_only_days_past_the_grace_period_are_closed(tmp_path):
+    compactor = DayCompactor(tmp_path, None, grace_period=3600)
+    assert compactor.is_day_closed((datetime.utcnow() - timedelta(days=2)).strftime("%Y_%m_%d"))
+    assert not compactor.is_day_closed(get_day())
+    assert not compactor.is_day_closed((datetime.utcnow() + timedelta(days=1)).strftime("%Y_%m_%d"))
+
+
+def test_command_line_refuses_an_open_day_without_force(tmp_path):
+    today = get_day()
+    make_day(tmp_path, today)
+
+    refused = run_compaction(tmp_path, "--day", today)
+    assert refused.returncode != 0
+    assert "--force" in refused.stderr
+    assert (tmp_path / "saves" / today).exists()
+
+    forced = run_compaction(tmp_path, "--day", today, "--force")
+    assert forced.returncode == 0, forced.stderr
+    assert not (tmp_path / "saves" / today).exists()
+    assert (tmp_path / "archive" / today / "a" / "index.jsonl").exists()
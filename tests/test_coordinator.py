@@ -0,0 +1,61 @@
+import threading
+import time
+from coordinator import Coordinator, CoordinatorClient
+
+
+def test_boards_are_shared_between_workers_and_reassigned_when_one_leaves():
+    coordinator = Coordinator(["a", "b", "c", "d", "e"]).start()
+    first_client = CoordinatorClient(coordinator.address, "w1")
+    second_client = None
+    try:
+        assert sorted(first_client.assigned_boards) == ["a", "b", "c", "d", "e"]
+        second_client = CoordinatorClient(coordinator.address, "w2")
+        assert len(second_client.assigned_boards) == 2
+        first_client.reserve()
+        assert sorted(first_client.assigned_boards + second_client.assigned_boards) == ["a", "b", "c", "d", "e"]
+
+        first_client.close()
+        second_client.reserve()
+        assert sorted(second_client.assigned_boards) == ["a", "b", "c", "d", "e"]
+    finally:
+        if second_client is not None:
+            second_client.close()
+        coordinator.close()
+
+
+def test_workers_together_keep_to_the_request_time_limit():
+    request_time_limit = 0.05
+    coordinator = Coordinator(["a", "b"], request_time_limit=request_time_limit).start()
+    clients = [CoordinatorClient(coordinator.address, f"w{i}") for i in range(3)]
+    try:
+        threads = [threading.Thread(target=lambda client=client: [client.acquire() for _ in range(10)]) for client in clients]
+        start_time = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start_time
+    finally:
+        for client in clients:
+            client.close()
+        coordinator.close()
+    # the first token is in the bucket already
+    assert elapsed >= (30 - 1) * request_time_limit * 0.95
+
+
+def test_boards_of_a_silent_worker_go_to_the_others():
+    coordinator = Coordinator(["a", "b"], worker_timeout=1).start()
+    live_client = CoordinatorClient(coordinator.address, "live", heartbeat_interval=0.2)
+    silent_client = CoordinatorClient(coordinator.address, "silent", heartbeat_interval=3600)
+    try:
+        assert len(silent_client.assigned_boards) == 1
+        deadline = time.monotonic() + 5
+        while "silent" in coordinator.get_assignments() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assignments = coordinator.get_assignments()
+        assert list(assignments) == ["live"]
+        assert sorted(assignments["live"]) == ["a", "b"]
+    finally:
+        live_client.close()
+        silent_client.close()
+        coordinator.close()
@@ -0,0 +1,60 @@
+import json
+import logging
+import sqlite3
+from corpus import CorpusBuilder
+
+
+def write_thread(data_path, day, board_code, thread_id, posts):
+    thread_path = data_path / "saves" / day / "threads" / board_code / f"{thread_id}.json"
+    thread_path.parent.mkdir(parents=True, exist_ok=True)
+    thread_path.write_text(json.dumps({"posts": posts}))
+    return thread_path
+
+
+def count_manifest_inputs(output_path):
+    with sqlite3.connect(str(output_path / "manifest.sqlite3")) as connection:
+        return connection.execute("SELECT COUNT(*) FROM inputs").fetchone()[0]
+
+
+class RacingCorpusBuilder(CorpusBuilder):
+    """
+    Corpus builder whose inputs are removed right after they were listed, like a snapshot the scraper replaces
+    """
+    def get_changed_inputs(self):
+        changed_inputs = super().get_changed_inputs()
+        for path, _, _, _, _ in changed_inputs:
+            if path.endswith("2.json"):
+                (self.data_path / path).unlink()
+        return changed_inputs
+
+
+def test_inputs_removed_during_a_build_are_skipped(tmp_path):
+    data_path, output_path = tmp_path / "data", tmp_path / "corpus"
+    write_thread(data_path, "2024_01_01", "a", 1, [{"no": 1, "resto": 0, "com": "first"}])
+    write_thread(data_path, "2024_01_01", "a", 2, [{"no": 2, "resto": 0, "com": "second"}])
+    builder = RacingCorpusBuilder(data_path, output_path, logging.getLogger("test_corpus"), workers=1)
+    try:
+        stats = builder.build()
+    finally:
+        builder.close()
+
+    assert stats["new_posts"] == 1
+    # the removed input is not recorded as done
+    assert count_manifest_inputs(output_path) == 1
+
+
+def test_removed_inputs_are_forgotten(tmp_path):
+    data_path, output_path = tmp_path / "data", tmp_path / "corpus"
+    write_thread(data_path, "2024_01_01", "a", 1, [{"no": 1, "resto": 0, "com": "first"}])
+    removed_path = write_thread(data_path, "2024_01_01", "a", 2, [{"no": 2, "resto": 0, "com": ">>1 second"}])
+    builder = CorpusBuilder(data_path, output_path, logging.getLogger("test_corpus"), workers=1)
+    try:
+        first_stats = builder.build()
+        removed_path.unlink()
+        second_stats = builder.build()
+    finally:
+        builder.close()
+
+    assert (first_stats["new_posts"], first_stats["new_edges"]) == (2, 1)
+    assert (second_stats["inputs"], second_stats["pruned_inputs"]) == (0, 1)
+    assert count_manifest_inputs(output_path) == 1
@@ -0,0 +1,61 @@
+import json
+import os
+import signal
+import pytest
+from daemon import ConfigWatcher, install_signal_handler
+
+
+def write_config(config_path, **settings):
+    config = {"boards": ["a"], "exclude_boards": [], "request_time_limit": 1, "output_path": "data", "save_log": False, "clean_log": False}
+    config_path.write_text(json.dumps(dict(config, **settings)))
+
+
+def test_a_changed_config_file_is_reloaded_after_the_check_interval(tmp_path):
+    config_path = tmp_path / "config.json"
+    write_config(config_path)
+    watcher = ConfigWatcher(config_path, check_interval=0)
+    assert not watcher.reload_due()
+
+    write_config(config_path, request_time_limit=2)
+    stat = config_path.stat()
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert watcher.reload_due()
+    assert watcher.load()["request_time_limit"] == 2
+    assert not watcher.reload_due()
+
+    # not checked again before the interval is over
+    watcher.check_interval = 3600
+    watcher.reload_due()
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    assert not watcher.reload_due()
+
+
+def test_a_requested_reload_is_due_at_once(tmp_path):
+    config_path = tmp_path / "config.json"
+    write_config(config_path)
+    watcher = ConfigWatcher(config_path, check_interval=3600)
+    watcher.request_reload()
+    assert watcher.reload_due()
+    assert not watcher.reload_due()
+
+
+def test_a_broken_config_file_raises_so_the_current_one_is_kept(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text("{")
+    with pytest.raises(ValueError):
+        ConfigWatcher(config_path).load()
+    assert ConfigWatcher(None).load() is None
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGHUP"), reason="no SIGHUP on this platform")
+def test_sighup_requests_a_reload(tmp_path):
+    config_path = tmp_path / "config.json"
+    write_config(config_path)
+    watcher = ConfigWatcher(config_path, check_interval=3600)
+    previous_handler = signal.getsignal(signal.SIGHUP)
+    try:
+        assert install_signal_handler("SIGHUP", watcher.request_reload)
+        os.kill(os.getpid(), signal.SIGHUP)
+        assert watcher.reload_due()
+    finally:
+        signal.signal(signal.SIGHUP, previous_handler)
@@ -0,0 +1,150 @@
+from collections import Counter
+import logging
+import time
+from board import Board
+from fetcher import AsyncThreadFetcher
+from mock_api import MockApiServer
+from ratelimit import TokenBucket
+from retry import RetryQueue
+from transport import Transport
+
+
+class CountingMockApi(MockApiServer):
+    """
+    Mock API that also counts the requests of every path
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.path_counts = Counter()
+
+    def _record(self, path, status_code, n_bytes):
+        super()._record(path, status_code, n_bytes)
+        self.path_counts[path] += 1
+
+
+class ErrorCountingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_board(mock_api, tmp_path, logger, max_concurrent_requests=4):
+    transport = Transport(mock_api.api_base_url, pool_maxsize=max_concurrent_requests)
+    return Board("a", logger, transport, base_save_path=tmp_path, retry_queue=RetryQueue())
+
+
+def make_logger():
+    logger = logging.getLogger("test_fetcher")
+    handler = ErrorCountingHandler()
+    logger.handlers = [handler]
+    logger.propagate = False
+    return logger, handler
+
+
+def test_concurrent_requests_keep_to_the_request_time_limit(tmp_path):
+    mock_api = CountingMockApi(boards=1, threads_per_board=30, latency=0, replies_per_second=0, threads_per_second=0).start()
+    logger, errors = make_logger()
+    request_time_limit = 0.05
+    fetcher = AsyncThreadFetcher(TokenBucket(request_time_limit), logger, max_concurrent_requests=4)
+    try:
+        board = make_board(mock_api, tmp_path, logger)
+        thread_ids = board.get_threads_to_update(board.get_online_thread_list())
+        start_time = time.monotonic()
+        captured_count = fetcher.fetch_threads(board, thread_ids)
+        elapsed = time.monotonic() - start_time
+    finally:
+        fetcher.close()
+        mock_api.close()
+
+    assert captured_count == len(thread_ids) == 30
+    # the bucket starts with one token, every further request waits for its own
+    assert elapsed >= (len(thread_ids) - 1) * request_time_limit * 0.95
+    assert not errors.records
+
+
+def test_every_updated_thread_is_fetched_once(tmp_path):
+    mock_api = CountingMockApi(boards=1, threads_per_board=20, latency=0.01, replies_per_second=20, threads_per_second=0).start()
+    logger, errors = make_logger()
+    fetcher = AsyncThreadFetcher(TokenBucket(0.001), logger, max_concurrent_requests=4)
+    try:
+        board = make_board(mock_api, tmp_path, logger)
+        first_ids = board.get_threads_to_update(board.get_online_thread_list())
+        fetcher.fetch_threads(board, first_ids)
+        # Last-Modified has a resolution of a second
+        time.sleep(1.5)
+        # the thread list may only be requested every thread_list_request_interval seconds
+        board.thread_list_request_interval = 0
+        updated_ids = board.get_threads_to_update(board.get_online_thread_list())
+        fetcher.fetch_threads(board, updated_ids)
+    finally:
+        fetcher.close()
+        mock_api.close()
+
+    assert updated_ids
+    thread_counts = Counter({path: count for path, count in mock_api.path_counts.items() if "/thread/" in path})
+    expected_counts = Counter(f"/a/thread/{thread_id}.json" for thread_id in list(first_ids) + list(updated_ids))
+    assert thread_counts == expected_counts
+    assert set(board.thread_content_last_request) == set(first_ids)
+    assert not errors.records
+
+
+def test_not_modified_and_not_found_responses_are_read_as_no_content(tmp_path):
+    mock_api = CountingMockApi(boards=1, threads_per_board=3, latency=0, replies_per_second=0, threads_per_second=0).start()
+    logger, errors = make_logger()
+    fetcher = AsyncThreadFetcher(TokenBucket(0.001), logger, max_concurrent_requests=2)
+    try:
+        board = make_board(mock_api, tmp_path, logger)
+        thread_ids = board.get_threads_to_update(board.get_online_thread_list())
+        assert fetcher.fetch_threads(board, thread_ids) == len(thread_ids)
+        # nothing changed since, so the conditional requests are answered with 304
+        assert fetcher.fetch_threads(board, thread_ids) == 0
+        assert board.read_thread_content(board.request_thread_content(thread_ids[0])) is None
+        # a thread that is not on the board is answered with 404
+        assert fetcher.fetch_threads(board, [1]) == 0
+        assert board.read_thread_content(board.request_thread_content(1)) is None
+    finally:
+        fetcher.close()
+        mock_api.close()
+
+    assert mock_api.count_requests("thread", 304) == len(thread_ids) + 1
+    assert mock_api.count_requests("thread", 404) == 2
+    assert board.circuit_breaker.state == "closed"
+    assert len(board.retry_queue) == 0
+    assert not errors.records
+
+
+def test_failed_threads_of_several_boards_are_retried_from_the_shared_queue(tmp_path):
+    mock_api = CountingMockApi(boards=2, threads_per_board=3, latency=0, replies_per_second=0, threads_per_second=0).start()
+    logger, errors = make_logger()
+    retry_queue = RetryQueue(base_delay=0.01, max_delay=0.01)
+    fetcher = AsyncThreadFetcher(TokenBucket(0.001), logger, max_concurrent_requests=4)
+    try:
+        boards = []
+        for board_code in mock_api.boards:
+            transport = Transport(mock_api.api_base_url, pool_maxsize=4)
+            boards.append(Board(board_code, logger, transport, base_save_path=tmp_path, retry_queue=retry_queue))
+        jobs = [(board, thread_id) for board in boards for thread_id in board.get_threads_to_update(board.get_online_thread_list())]
+        mock_api.error_rate = 1
+        assert fetcher.fetch_jobs(jobs) == 0
+        assert len(retry_queue) == len(jobs) == 6
+        assert all(board.retry_attempts == dict.fromkeys(board.tracking_threads, 1) for board in boards)
+        assert not any(board.thread_content_last_request for board in boards)
+
+        mock_api.error_rate = 0
+        time.sleep(0.05)
+        due_jobs = retry_queue.pop_due()
+        assert sorted((board.board_code, thread_id) for board, thread_id in due_jobs) == sorted((board.board_code, thread_id) for board, thread_id in jobs)
+        assert fetcher.fetch_jobs(due_jobs) == 6
+    finally:
+        fetcher.close()
+        mock_api.close()
+
+    assert len(retry_queue) == 0
+    assert all(board.retry_attempts == {} and board.circuit_breaker.state == "closed" for board in boards)
+    assert all(set(board.thread_content_last_request) == set(board.tracking_threads) for board in boards)
+    # every failed request is logged as an error, nothing failed unexpectedly
+    assert len(errors.records) == 6
+    assert not any(record.exc_info for record in errors.records)
@@ -0,0 +1,115 @@
+import base64
+import hashlib
+import logging
+import socket
+import time
+from media import MediaFetcher, get_media_path
+from mock_api import MockApiServer
+
+
+def get_posts_with_files(mock_api):
+    """
+    :return: dictionary of the md5 of every file on the mock API to a post it is attached to
+    """
+    posts = {}
+    for board in mock_api.boards.values():
+        for thread_posts in board.threads.values():
+            for post in thread_posts:
+                if post.get("tim") in board.media:
+                    posts.setdefault(post["md5"], post)
+    return posts
+
+
+def wait_for_downloads(media_fetcher, n_results, timeout=30):
+    """
+    Wait until n_results files were downloaded or failed
+    """
+    end_time = time.monotonic() + timeout
+    while media_fetcher.counts["downloaded"] + media_fetcher.counts["failed"] < n_results:
+        assert time.monotonic() < end_time, media_fetcher.summary()
+        time.sleep(0.01)
+
+
+def make_media_fetcher(mock_api, tmp_path, **kwargs):
+    return MediaFetcher(tmp_path / "media", logging.getLogger("test_media"), mock_api.api_base_url, **kwargs)
+
+
+def test_a_file_is_downloaded_once_by_its_md5(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=5, latency=0, media_files=3, media_rate=1.0).start()
+    media_fetcher = make_media_fetcher(mock_api, tmp_path, capture="both")
+    try:
+        post = next(iter(get_posts_with_files(mock_api).values()))
+        repost = {**post, "no": post["no"] + 1}
+        # queued at the same time and after the first download
+        media_fetcher.publish("a", post["resto"] or post["no"], [post, repost])
+        wait_for_downloads(media_fetcher, 2)
+        media_fetcher.publish("a", post["resto"] or post["no"], [repost])
+    finally:
+        media_fetcher.close()
+        mock_api.close()
+
+    md5 = base64.b64decode(post["md5"]).hex()
+    assert mock_api.count_requests("media_file") == 1
+    assert mock_api.count_requests("thumbnail") == 1
+    assert media_fetcher.counts == {"downloaded": 2, "duplicate": 4, "failed": 0, "dropped": 0}
+    file_path = get_media_path(tmp_path / "media", "files", md5, post["ext"])
+    assert hashlib.md5(file_path.read_bytes()).hexdigest() == md5
+    assert get_media_path(tmp_path / "media", "thumbnails", md5, post["ext"]).exists()
+
+
+def test_a_file_that_does_not_match_its_md5_is_not_stored(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=5, latency=0, media_files=3, media_rate=1.0).start()
+    media_fetcher = make_media_fetcher(mock_api, tmp_path, capture="files")
+    try:
+        post = next(iter(get_posts_with_files(mock_api).values()))
+        wrong_md5 = base64.b64encode(hashlib.md5(b"another file").digest()).decode()
+        media_fetcher.publish("a", post["no"], [{**post, "md5": wrong_md5}])
+        wait_for_downloads(media_fetcher, 1)
+    finally:
+        media_fetcher.close()
+        mock_api.close()
+
+    assert mock_api.count_requests("media_file") == 1
+    assert media_fetcher.counts["failed"] == 1
+    assert media_fetcher.counts["downloaded"] == 0
+    assert not [path for path in (tmp_path / "media").rglob("*") if path.is_file()]
+
+
+def test_downloads_keep_to_the_byte_rate_limit(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=20, latency=0, media_files=6, media_rate=1.0).start()
+    rate_limit_kb = 64
+    media_fetcher = make_media_fetcher(mock_api, tmp_path, capture="files", workers=3, rate_limit_kb=rate_limit_kb)
+    try:
+        posts = list(get_posts_with_files(mock_api).values())
+        start_time = time.monotonic()
+        media_fetcher.publish("a", 1, posts)
+        wait_for_downloads(media_fetcher, len(posts))
+        elapsed = time.monotonic() - start_time
+    finally:
+        media_fetcher.close()
+        mock_api.close()
+
+    assert media_fetcher.counts["downloaded"] == len(posts) > 1
+    total_bytes = sum(post["fsize"] for post in posts)
+    # the bucket starts with a second of bytes, the rest comes at the limit
+    assert elapsed >= (total_bytes - rate_limit_kb * 1024) / (rate_limit_kb * 1024) * 0.95
+    assert media_fetcher.downloaded_bytes == total_bytes
+
+
+def test_a_stalled_download_fails_after_the_configured_timeout(tmp_path):
+    # accepts connections but never answers
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    media_fetcher = MediaFetcher(
+        tmp_path / "media", logging.getLogger("test_media"), f"http://127.0.0.1:{server.getsockname()[1]}", capture="thumbnails", timeout=(1, 0.5)
+    )
+    try:
+        start_time = time.monotonic()
+        media_fetcher.publish("a", 1, [{"no": 1, "tim": 1700000000000, "ext": ".jpg", "md5": base64.b64encode(b"0" * 16).decode()}])
+        wait_for_downloads(media_fetcher, 1, timeout=5)
+        assert media_fetcher.counts["failed"] == 1
+        assert time.monotonic() - start_time < 5
+    finally:
+        media_fetcher.close()
+        server.close()
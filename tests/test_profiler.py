@@ -0,0 +1,73 @@
+import logging
+import signal
+import threading
+import time
+from mock_api import MockApiServer
+from profiler import SamplingProfiler, StallWatchdog
+from requester import Requester
+from utils import get_argparser, get_optional_settings
+
+
+class StoppedRequester(Requester):
+    """
+    Requester that stops its crawl right away, before the first round
+    """
+    def _begin_monitoring(self):
+        self._stop_event.set()
+        super()._begin_monitoring()
+
+
+def test_profiler_and_watchdog_are_off_by_default(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=1, latency=0).start()
+    handler_before = signal.getsignal(signal.SIGUSR1)
+    try:
+        for optional_settings in [get_optional_settings(get_argparser().parse_args([])), get_optional_settings({})]:
+            optional_settings["api_base_url"] = mock_api.api_base_url
+            requester = StoppedRequester(
+                boards=["a"],
+                exclude_boards=False,
+                request_time_limit=0.01,
+                output_path=str(tmp_path),
+                save_log=False,
+                clean_log=False,
+                **optional_settings
+            )
+            assert requester._profiler is None
+            assert requester._watchdog is None
+            assert signal.getsignal(signal.SIGUSR1) is handler_before
+            assert not any(thread.name == "StallWatchdog" for thread in threading.enumerate())
+    finally:
+        mock_api.close()
+
+
+def test_signal_handler_is_only_installed_from_the_main_thread(tmp_path):
+    profiler = SamplingProfiler(tmp_path, logging.getLogger("test_profiler"), duration=1)
+    handler_before = signal.getsignal(signal.SIGUSR1)
+    installed = []
+    thread = threading.Thread(target=lambda: installed.append(profiler.install(signal.SIGUSR1)))
+    thread.start()
+    thread.join()
+    assert installed == [False]
+    assert signal.getsignal(signal.SIGUSR1) is handler_before
+
+
+def test_watchdog_logs_a_stall_once_until_requests_finish_again(caplog):
+    last_progress = [time.monotonic() - 10]
+    watchdog = StallWatchdog(lambda: last_progress[0], logging.getLogger("test_profiler"), stall_timeout=0.2)
+    with caplog.at_level(logging.WARNING, logger="test_profiler"):
+        watchdog.start()
+        try:
+            time.sleep(0.5)
+            assert watchdog.stall_count == 1
+            stall_logs = [record.getMessage() for record in caplog.records if "No request finished" in record.getMessage()]
+            assert len(stall_logs) == 1
+            # the stack of the stalled thread is in the log
+            assert "test_watchdog_logs_a_stall_once_until_requests_finish_again" in stall_logs[0]
+
+            last_progress[0] = time.monotonic()
+            time.sleep(0.1)
+            assert watchdog.stall_count == 1
+            time.sleep(0.4)
+            assert watchdog.stall_count == 2
+        finally:
+            watchdog.close()
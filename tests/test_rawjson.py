@@ -0,0 +1,50 @@
+import json
+import random
+from mock_api import MockBoard
+from rawjson import RawJson, load_json, read_post_numbers, read_thread_list_entries
+
+
+def make_board():
+    return MockBoard("a", threads_per_board=40, replies_per_thread=10, replies_per_second=0, threads_per_second=0,
+                     rng=random.Random(1), start_post_no=1000)
+
+
+def test_post_numbers_match_the_parsed_thread():
+    board = make_board()
+    for thread_id in board.bump_order:
+        thread_content = board.thread_content(thread_id)
+        raw_thread = RawJson(json.dumps(thread_content).encode("utf-8"))
+        assert read_post_numbers(raw_thread) == read_post_numbers(thread_content)
+
+
+def test_thread_list_entries_match_the_parsed_thread_list():
+    board = make_board()
+    thread_list = board.thread_list()
+    raw_thread_list = RawJson(json.dumps(thread_list, indent=2).encode("utf-8"))
+    assert read_thread_list_entries(raw_thread_list) == read_thread_list_entries(thread_list)
+    assert len(read_thread_list_entries(thread_list)) == 40
+
+
+def test_post_numbers_inside_strings_are_not_read():
+    thread_content = {"posts": [
+        {"no": 1, "resto": 0, "com": 'quoting {"no": 99, "last_modified": 1, "replies": 2}'},
+        {"no": 2, "resto": 1, "sub": '"no": 98', "com": "plain"},
+    ]}
+    raw_thread = RawJson(json.dumps(thread_content).encode("utf-8"))
+    assert read_post_numbers(raw_thread) == [1, 2]
+
+
+def test_thread_list_entries_do_not_depend_on_key_order_or_whitespace():
+    raw_thread_list = RawJson(
+        b'[{"page":1,"threads":[{"replies":3,"no":1,"last_modified":10}]},\n'
+        b' {"page" : 2, "threads" : [ { "last_modified" : 20 , "no" : 2 , "replies" : 0 } ] }]'
+    )
+    assert read_thread_list_entries(raw_thread_list) == [(1, 10, 3), (2, 20, 0)]
+
+
+def test_the_document_is_parsed_only_when_asked_for():
+    thread_content = {"posts": [{"no": 1, "resto": 0}]}
+    raw_thread = RawJson(json.dumps(thread_content).encode("utf-8"))
+    assert load_json(raw_thread) == thread_content
+    assert load_json(raw_thread) is load_json(raw_thread)
+    assert load_json(thread_content) is thread_content
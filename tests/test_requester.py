@@ -0,0 +1,43 @@
+import threading
+from mock_api import MockApiServer
+from requester import Requester
+
+
+class StoppedRequester(Requester):
+    """
+    Requester that stops its crawl after run_seconds and counts the rounds that ended with the summary logs
+    """
+    run_seconds = 3
+
+    def _begin_monitoring(self):
+        self.summary_count = 0
+        threading.Timer(self.run_seconds, self._stop_event.set).start()
+        super()._begin_monitoring()
+
+    def _log_retry_state(self):
+        self.summary_count += 1
+        super()._log_retry_state()
+
+
+def test_round_robin_waits_while_all_boards_are_paused(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=5, latency=0, error_rate=1.0).start()
+    try:
+        requester = StoppedRequester(
+            boards=["a"],
+            exclude_boards=False,
+            request_time_limit=0.01,
+            output_path=str(tmp_path),
+            save_log=False,
+            clean_log=False,
+            api_base_url=mock_api.api_base_url,
+            breaker_failure_threshold=2,
+            breaker_reset_timeout=20,
+        )
+    finally:
+        mock_api.close()
+
+    board = requester._monitoring_boards[0]
+    assert board.circuit_breaker.trip_count == 1
+    # the two failures that opened the breaker, then the loop sleeps instead of going round without requests
+    assert mock_api.count_requests("threads") == 2
+    assert requester.summary_count <= 2
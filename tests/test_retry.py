@@ -0,0 +1,101 @@
+import logging
+import random
+import types
+import pytest
+import retry
+from retry import CircuitBreaker, RetryQueue
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(retry, "time", types.SimpleNamespace(time=clock))
+    return clock
+
+
+def test_backoff_doubles_up_to_max_delay_with_jitter():
+    retry_queue = RetryQueue(base_delay=5, max_delay=60)
+    random.seed(0)
+    for attempt, delay in [(1, 5), (2, 10), (3, 20), (4, 40), (5, 60), (10, 60)]:
+        backoffs = [retry_queue.get_backoff(attempt) for _ in range(200)]
+        assert delay / 2 <= min(backoffs) and max(backoffs) <= delay
+        # jittered, not the same delay for every request
+        assert max(backoffs) - min(backoffs) > delay / 4
+
+
+def test_requests_are_given_up_after_max_attempts(clock):
+    retry_queue = RetryQueue(base_delay=5, max_attempts=3)
+    assert retry_queue.schedule("a", 1, 1) is not None
+    assert retry_queue.schedule("a", 2, 2) is not None
+    assert retry_queue.schedule("a", 3, 3) is None
+    assert len(retry_queue) == 2
+    assert (retry_queue.retried_count, retry_queue.given_up_count) == (2, 1)
+
+
+def test_retries_are_popped_in_the_order_they_become_due(clock):
+    retry_queue = RetryQueue()
+    retry_queue.push("a", 1, 30)
+    retry_queue.push("b", 2, 10)
+    retry_queue.push("a", 3, 20)
+    assert retry_queue.pop_due() == []
+    assert retry_queue.seconds_until_next() == 10
+
+    clock.now += 25
+    assert retry_queue.pop_due() == [("b", 2), ("a", 3)]
+    clock.now += 5
+    assert retry_queue.pop_due() == [("a", 1)]
+    assert retry_queue.seconds_until_next() == float("inf")
+
+
+def test_dropping_a_board_forgets_only_its_retries(clock):
+    first_board, second_board = object(), object()
+    retry_queue = RetryQueue()
+    retry_queue.push(first_board, 1, 10)
+    retry_queue.push(second_board, 2, 5)
+    retry_queue.push(first_board, 3, 1)
+    retry_queue.drop_board(first_board)
+    clock.now += 10
+    assert retry_queue.pop_due() == [(second_board, 2)]
+
+
+def test_circuit_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker("a", logging.getLogger("test_retry"), failure_threshold=3, reset_timeout=60, max_reset_timeout=200)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open()
+    breaker.record_failure()
+    assert breaker.is_open() and breaker.state == "open"
+    assert breaker.seconds_until_retry() == 60
+
+    clock.now += 60
+    assert not breaker.is_open()
+    assert breaker.state == "half_open"
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.consecutive_failures == 0
+    assert breaker.trip_count == 1
+
+
+def test_a_failure_while_half_open_opens_the_breaker_for_longer(clock):
+    breaker = CircuitBreaker("a", logging.getLogger("test_retry"), failure_threshold=1, reset_timeout=60, max_reset_timeout=200)
+    breaker.record_failure()
+    for timeout in [120, 200, 200]:
+        clock.now += breaker.seconds_until_retry()
+        assert not breaker.is_open()
+        breaker.record_failure()
+        assert breaker.is_open()
+        assert breaker.seconds_until_retry() == timeout
+
+    # a success resets the timeout
+    clock.now += breaker.seconds_until_retry()
+    assert not breaker.is_open()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.seconds_until_retry() == 60
@@ -0,0 +1,120 @@
+import logging
+import time
+from board import Board
+from scheduler import BoardPollPlanner, ThreadScheduler
+
+
+def make_thread_list(*threads):
+    return [{"page": 1, "threads": [{"no": thread_no, "last_modified": last_modified, "replies": replies} for thread_no, last_modified, replies in threads]}]
+
+
+def make_board(tmp_path, board_code, thread_list):
+    board = Board(board_code, logging.getLogger("test_scheduler"), base_save_path=tmp_path)
+    board.initialize()
+    return board, board.get_threads_to_update(thread_list)
+
+
+def test_threads_about_to_be_pruned_are_fetched_first(tmp_path):
+    last_modified = int(time.time()) - 60
+    board, thread_ids = make_board(tmp_path, "a", make_thread_list(*[(thread_no, last_modified, 0) for thread_no in range(1, 6)]))
+    scheduler = ThreadScheduler()
+    scheduler.push_board_threads(board, thread_ids)
+    assert [thread_id for _, thread_id in scheduler.pop_batch(5)] == ["5", "4", "3", "2", "1"]
+    assert len(scheduler) == 0
+
+
+def test_busy_and_long_waiting_threads_go_before_quiet_ones(tmp_path):
+    now = int(time.time())
+    board, thread_ids = make_board(tmp_path, "a", make_thread_list((1, now - 60, 0), (2, now - 60, 0), (3, now - 3600, 0)))
+    # thread 1 was captured before, its change is as old as the one of thread 2
+    board.thread_content_last_request["1"] = time.localtime(now - 120)
+    board.thread_content_last_request["2"] = time.localtime(now - 120)
+    board.thread_content_last_request["3"] = time.localtime(now - 7200)
+    board.reply_velocity["1"] = 1.0
+    board.thread_positions = {"1": 0.0, "2": 0.0, "3": 0.0}
+    scheduler = ThreadScheduler()
+    scheduler.push_board_threads(board, thread_ids)
+    assert [thread_id for _, thread_id in scheduler.pop_batch(3)] == ["1", "3", "2"]
+
+
+def test_a_rescored_thread_is_queued_once(tmp_path):
+    board, thread_ids = make_board(tmp_path, "a", make_thread_list((1, 100, 0), (2, 100, 0)))
+    scheduler = ThreadScheduler()
+    scheduler.push_board_threads(board, thread_ids)
+    # the next thread list only lists thread 2 as changed, the waiting thread 1 is rescored too
+    scheduler.push_board_threads(board, ["2"])
+    scheduler.push(board, "1", 100.0)
+    assert len(scheduler) == 2
+    assert scheduler.pushed_count == 2
+    assert [thread_id for _, thread_id in scheduler.pop_batch(10)] == ["1", "2"]
+    assert scheduler.pop_batch(10) == []
+
+
+def test_threads_that_die_while_waiting_are_counted_as_missed(tmp_path):
+    board, thread_ids = make_board(tmp_path, "a", make_thread_list((1, 100, 0), (2, 100, 0), (3, 100, 0)))
+    other_board, other_thread_ids = make_board(tmp_path, "b", make_thread_list((7, 100, 0)))
+    scheduler = ThreadScheduler()
+    scheduler.push_board_threads(board, thread_ids)
+    scheduler.push_board_threads(other_board, other_thread_ids)
+    # the last thread of the board is fetched, then it and a waiting thread die
+    assert scheduler.pop_batch(1) == [(board, "3")]
+    scheduler.record_deaths(board, ["3", "2"])
+    assert (scheduler.death_count, scheduler.missed_death_count) == (2, 1)
+
+    # the waiting threads survive a restart, the ones of boards no longer crawled are dropped
+    restored_scheduler = ThreadScheduler()
+    restored_scheduler.restore_pending([board], scheduler.get_pending())
+    assert restored_scheduler.pop_batch(10) == [(board, "1")]
+    scheduler.drop_board(other_board)
+    assert scheduler.pop_batch(10) == [(board, "1")]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_busy_boards_are_polled_more_often_than_quiet_ones(tmp_path):
+    busy_board, _ = make_board(tmp_path, "a", make_thread_list((1, 100, 0)))
+    quiet_board, _ = make_board(tmp_path, "b", make_thread_list((1, 100, 0)))
+    unseen_board = Board("c", logging.getLogger("test_scheduler"), base_save_path=tmp_path)
+    busy_board.activity = 1.0 # changes per second
+    quiet_board.activity = 0.0
+    assert busy_board.get_poll_interval() == busy_board.min_poll_interval
+    assert quiet_board.get_poll_interval() == quiet_board.max_poll_interval
+    assert unseen_board.get_poll_interval() == unseen_board.min_poll_interval
+    busy_board.activity = 0.1
+    assert busy_board.get_poll_interval() == busy_board.target_changes_per_poll / 0.1
+
+    clock = FakeClock()
+    planner = BoardPollPlanner([busy_board, quiet_board], adaptive=True, clock=clock)
+    assert planner.pop_due_boards() == [busy_board, quiet_board]
+    assert planner.schedule(busy_board) == 50
+    assert planner.schedule(quiet_board) == quiet_board.max_poll_interval
+    clock.now += 50
+    assert planner.pop_due_boards() == [busy_board]
+    assert planner.seconds_until_next_poll() == quiet_board.max_poll_interval - 50
+
+
+def test_poll_plan_survives_a_restart_and_follows_board_changes(tmp_path):
+    first_board, _ = make_board(tmp_path, "a", make_thread_list((1, 100, 0)))
+    second_board, _ = make_board(tmp_path, "b", make_thread_list((1, 100, 0)))
+    clock = FakeClock()
+    planner = BoardPollPlanner([first_board, second_board], fixed_interval=60, clock=clock)
+    planner.pop_due_boards()
+    planner.schedule(first_board)
+    clock.now += 30
+    planner.schedule(second_board)
+
+    restored_planner = BoardPollPlanner([first_board, second_board], fixed_interval=60, next_polls=planner.get_next_polls(), clock=clock)
+    assert restored_planner.pop_due_boards() == []
+    assert restored_planner.seconds_until_next_poll() == 30
+    restored_planner.remove(first_board)
+    added_board, _ = make_board(tmp_path, "c", make_thread_list((1, 100, 0)))
+    restored_planner.add(added_board)
+    assert restored_planner.pop_due_boards() == [added_board]
+    clock.now += 60
+    assert restored_planner.pop_due_boards() == [second_board]
@@ -0,0 +1,60 @@
+import json
+import logging
+import search_index
+from compaction import DayCompactor
+from rawjson import RawJson
+from search_index import SearchIndex
+from storage import create_thread_store
+
+
+def make_thread(thread_id, *replies):
+    return {"posts": [{"no": thread_id, "resto": 0, "com": f"opening {thread_id}"}] + [
+        {"no": post_no, "resto": thread_id, "com": comment} for post_no, comment in replies
+    ]}
+
+
+def write_snapshot(data_path, day, board_code, thread_id, thread_content):
+    thread_path = data_path / "saves" / day / "threads" / board_code / f"{thread_id}_00_00_00.json"
+    thread_path.parent.mkdir(parents=True, exist_ok=True)
+    thread_path.write_text(json.dumps(thread_content))
+
+
+def test_only_posts_after_the_last_indexed_post_are_read(tmp_path, monkeypatch):
+    index = SearchIndex(tmp_path / "posts.sqlite3")
+    stripped = []
+    monkeypatch.setattr(search_index, "strip_html", lambda text: stripped.append(text) or text)
+    try:
+        assert index.add_thread("a", make_thread(1, (2, "first reply"))) == 2
+        stripped.clear()
+        assert index.add_thread("a", make_thread(1, (2, "first reply"), (3, "second reply"))) == 1
+        # only the subject and comment of the new post
+        assert stripped == [None, "second reply"]
+
+        # a capture without new posts is not read beyond its post numbers, an edited text is not picked up
+        raw_thread = RawJson(json.dumps(make_thread(1, (2, "first reply"), (3, "edited reply"))).encode("utf-8"))
+        assert index.add_thread("a", raw_thread) == 0
+        assert index.search("edited") == []
+        assert [result["post_no"] for result in index.search("second")] == [3]
+        assert sorted(result["post_no"] for result in index.search("reply")) == [2, 3]
+    finally:
+        index.close()
+
+
+def test_every_storage_layout_is_indexed(tmp_path):
+    data_path = tmp_path / "data"
+    logger = logging.getLogger("test_search_index")
+    write_snapshot(data_path, "2024_01_01", "a", 1, make_thread(1, (2, "snapshot words")))
+    DayCompactor(data_path, logger).compact_day("2024_01_01")
+    write_snapshot(data_path, "2024_01_02", "a", 10, make_thread(10, (11, "snapshot words")))
+    create_thread_store("append", "b", data_path, logger).save_thread(20, make_thread(20, (21, "logged words")))
+    create_thread_store("segmented", "c", data_path, logger).save_thread(30, make_thread(30, (31, "segment words")))
+
+    index = SearchIndex(tmp_path / "posts.sqlite3")
+    try:
+        assert index.index_saves(data_path) == 8
+        results = {(result["board"], result["post_no"]) for result in index.search("words")}
+        assert results == {("a", 2), ("a", 11), ("b", 21), ("c", 31)}
+        # nothing changed since the last build
+        assert index.index_saves(data_path) == 0
+    finally:
+        index.close()
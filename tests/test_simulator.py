@@ -0,0 +1,47 @@
+import json
+from rawjson import RawJson
+from simulator import CrawlSimulator, TraceRecorder, load_traces
+
+
+def make_traces():
+    # thread 1 lives until 20, thread 4 lives between two polls of the crawler, thread 5 gets its last post
+    # after it was captured and dies before the next poll
+    return {"a": [
+        (0, [[1, 0, 0], [5, 0, 0]]),
+        (5, [[1, 0, 0], [4, 5, 3], [5, 4, 2]]),
+        (10, [[1, 9, 3]]),
+        (20, [[2, 20, 0]]),
+        (30, [[2, 20, 0]]),
+    ]}
+
+
+def test_threads_that_died_before_their_last_posts_were_captured_are_counted():
+    result = CrawlSimulator(make_traces(), "round_robin", request_time_limit=1).run()
+    assert result["threads"] == 4
+    assert result["died"] == 3
+    assert result["missed_before_death"] == 2
+    assert result["never_captured"] == 1
+    assert (result["captured_posts"], result["posts"]) == (7, 12)
+    assert result["requests"] == {"thread_list": 4, "thread_content": 4, "thread_gone": 0, "total": 8}
+
+
+def test_a_faster_crawl_misses_nothing():
+    traces = {"a": [(poll_time, [[1, poll_time, poll_time // 5]]) for poll_time in range(0, 60, 5)] + [(60, [])]}
+    result = CrawlSimulator(traces, "priority", request_time_limit=0.1, scheduler_refresh_interval=1).run()
+    assert result["died"] == 1
+    assert result["missed_before_death"] == 0
+    assert result["captured_posts"] == result["posts"]
+
+
+def test_recorded_traces_are_read_back_in_time_order(tmp_path):
+    recorder = TraceRecorder(tmp_path)
+    recorder.record("a", [{"page": 1, "threads": [{"no": 1, "last_modified": 5, "replies": 2}]}], poll_time=86400 + 10)
+    recorder.record("a", [{"page": 1, "threads": [{"no": 1, "last_modified": 3, "replies": 1}]}], poll_time=10)
+    raw_thread_list = json.dumps([{"page": 1, "threads": [{"no": 7, "last_modified": 1, "replies": 0}]}]).encode("utf-8")
+    recorder.record("b", RawJson(raw_thread_list), poll_time=20)
+
+    assert load_traces(tmp_path) == {
+        "a": [(10, [[1, 3, 1]]), (86410, [[1, 5, 2]])],
+        "b": [(20, [[7, 1, 0]])],
+    }
+    assert load_traces(tmp_path, ["a"], first_day="1970_01_02") == {"a": [(86410, [[1, 5, 2]])]}
@@ -0,0 +1,75 @@
+import json
+import logging
+import threading
+import pytest
+from sinks import PostSink, PostStream, RotatingFileSink
+
+
+class GatedSink(PostSink):
+    """
+    Holds every write until released
+    """
+    def __init__(self):
+        self.writing = threading.Event()
+        self.released = threading.Event()
+        self.records = []
+
+    def write_lines(self, lines):
+        self.writing.set()
+        self.released.wait()
+        self.records += [json.loads(line) for line in lines]
+
+
+def make_posts(*post_numbers):
+    return [{"no": post_no, "com": f"post {post_no}"} for post_no in post_numbers]
+
+
+def test_a_sink_without_write_lines_fails_when_it_is_created():
+    class IncompleteSink(PostSink):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteSink()
+
+
+def test_drop_discards_records_while_the_queue_is_full():
+    sink = GatedSink()
+    stream = PostStream(sink, logging.getLogger("test_sinks"), max_queue_size=2, backpressure="drop")
+    stream.publish("a", 1, make_posts(1))
+    assert sink.writing.wait(5)
+    stream.publish("a", 1, make_posts(*range(2, 12)))
+    assert stream.dropped_records == 8
+
+    sink.released.set()
+    stream.close()
+    assert [record["post"] for record in sink.records] == [1, 2, 3]
+    assert stream.streamed_records == 3
+
+
+def test_block_waits_for_the_sink_and_loses_nothing():
+    sink = GatedSink()
+    stream = PostStream(sink, logging.getLogger("test_sinks"), max_queue_size=2, backpressure="block")
+    stream.publish("a", 1, make_posts(1))
+    assert sink.writing.wait(5)
+    publisher = threading.Thread(target=stream.publish, args=("a", 1, make_posts(*range(2, 12))))
+    publisher.start()
+    publisher.join(0.2)
+    assert publisher.is_alive()
+
+    sink.released.set()
+    publisher.join(5)
+    stream.close()
+    assert [record["post"] for record in sink.records] == list(range(1, 12))
+    assert stream.dropped_records == 0
+    assert sink.records[0]["board"] == "a" and sink.records[0]["thread"] == 1
+
+
+def test_the_file_sink_rotates_at_max_bytes(tmp_path):
+    sink = RotatingFileSink(tmp_path / "posts.ndjson", max_bytes=10, backup_count=2)
+    for i in range(4):
+        sink.write_lines([f"record {i}\n".encode("utf-8")])
+    sink.close()
+    assert (tmp_path / "posts.ndjson").read_text() == "record 3\n"
+    assert (tmp_path / "posts.ndjson.1").read_text() == "record 2\n"
+    assert (tmp_path / "posts.ndjson.2").read_text() == "record 1\n"
+    assert not (tmp_path / "posts.ndjson.3").exists()
@@ -0,0 +1,56 @@
+import logging
+import time
+from board import Board
+from mock_api import MockApiServer
+from state_store import CrawlStateStore
+from transport import Transport
+
+
+def test_thread_state_survives_a_reopen(tmp_path):
+    state_store = CrawlStateStore(tmp_path / "crawl_state.sqlite3")
+    state_store.record_board_fetch("a", 1700000000.0, "Tue, 14 Nov 2023 22:13:20 GMT", '"abc"')
+    state_store.record_thread_fetch("a", "5", 100, 3, 1700000001.0, etag='"def"', last_post_no=8, captured_replies=3)
+    state_store.record_thread_fetch("a", "6", 100, 0, 1700000002.0)
+    state_store.remove_threads("a", ["6"])
+    state_store.close()
+
+    state_store = CrawlStateStore(tmp_path / "crawl_state.sqlite3")
+    try:
+        assert state_store.load_board("a") == {"last_fetch": 1700000000.0, "http_last_modified": "Tue, 14 Nov 2023 22:13:20 GMT", "etag": '"abc"'}
+        assert state_store.load_threads("a") == {
+            "5": {
+                "last_modified": 100, "replies": 3, "last_fetch": 1700000001.0, "http_last_modified": None, "etag": '"def"',
+                "last_post_no": 8, "captured_replies": 3,
+            }
+        }
+        assert state_store.load_board("b") is None
+    finally:
+        state_store.close()
+
+
+def test_requests_are_conditional_right_after_a_restart(tmp_path):
+    mock_api = MockApiServer(boards=1, threads_per_board=3, latency=0, replies_per_second=0, threads_per_second=0).start()
+    logger = logging.getLogger("test_state_store")
+    transport = Transport(mock_api.api_base_url)
+    try:
+        for restart in range(2):
+            state_store = CrawlStateStore(tmp_path / "state" / "crawl_state.sqlite3")
+            board = Board("a", logger, transport, base_save_path=tmp_path, state_store=state_store)
+            board.thread_list_request_interval = board.thread_content_request_interval = 0
+            thread_list = board.get_online_thread_list()
+            if restart == 0:
+                for thread_id in board.get_threads_to_update(thread_list):
+                    board.save_thread_content(thread_id, board.get_thread_content(thread_id))
+                # Last-Modified has a resolution of one second
+                time.sleep(1.1)
+            else:
+                assert thread_list is None
+                for thread_id in board.tracking_threads:
+                    assert board.get_thread_content(thread_id) is None
+            state_store.close()
+    finally:
+        transport.close()
+        mock_api.close()
+    assert mock_api.count_requests("threads", 304) == 1
+    assert mock_api.count_requests("thread", 200) == 3
+    assert mock_api.count_requests("thread", 304) == 3
@@ -0,0 +1,127 @@
+import json
+import logging
+import lzma
+from rawjson import RawJson
+from storage import AppendOnlyThreadStore, SegmentedThreadStore, WriteBehindWriter, read_thread_file
+
+
+def make_thread(thread_id, *replies, **opening_fields):
+    return {"posts": [{"no": thread_id, "resto": 0, "com": "opening", **opening_fields}] + [
+        {"no": post_no, "resto": thread_id, "com": f"reply {post_no}"} for post_no in replies
+    ]}
+
+
+def read_events(log_file):
+    return log_file.read_text().splitlines()
+
+
+def test_append_only_store_logs_only_the_changes(tmp_path):
+    logger = logging.getLogger("test_storage")
+    store = AppendOnlyThreadStore("a", tmp_path, logger)
+    store.save_thread(1, make_thread(1, 2, 3))
+    store.save_thread(1, make_thread(1, 2, 3))
+    log_file = store.get_thread_log_file(1)
+    assert len(read_events(log_file)) == 3
+
+    # post 2 deleted, post 4 new and the opening post changed
+    store.save_thread(1, make_thread(1, 3, 4, replies=2))
+    assert len(read_events(log_file)) == 6
+    store.mark_thread_dead(1)
+
+    thread_content = store.read_thread(1)
+    assert [post["no"] for post in thread_content["posts"]] == [1, 3, 4]
+    assert thread_content["posts"][0]["replies"] == 2
+    assert thread_content["deleted_posts"] == [2]
+    assert thread_content["died"] is not None
+    assert store.read_thread(2) is None
+
+
+def test_append_only_store_continues_from_its_log_after_a_restart(tmp_path):
+    logger = logging.getLogger("test_storage")
+    AppendOnlyThreadStore("a", tmp_path, logger).save_thread(1, make_thread(1, 2))
+    store = AppendOnlyThreadStore("a", tmp_path, logger)
+    log_file = store.get_thread_log_file(1)
+    # a crash in the middle of an append
+    with open(log_file, "a") as outfile:
+        outfile.write('{"event": "post", "captured": 1.0, "post": {"no": 3')
+
+    assert store.append_posts(1, {"no": 1}, [{"no": 2, "resto": 1}, {"no": 5, "resto": 1}])
+    assert not store.append_posts(7, {"no": 7}, [{"no": 8, "resto": 7}])
+    assert [post["no"] for post in store.read_thread(1)["posts"]] == [1, 2, 5]
+
+
+def test_write_behind_jobs_run_in_order_and_survive_a_failing_job():
+    writer = WriteBehindWriter(logging.getLogger("test_storage"), max_queue_size=2)
+    written = []
+
+    def failing_job():
+        raise OSError("disk full")
+
+    for i in range(5):
+        writer.submit(written.append, i)
+        if i == 2:
+            writer.submit(failing_job)
+    writer.flush()
+    assert written == [0, 1, 2, 3, 4]
+    writer.submit(written.append, 5)
+    writer.close()
+    assert written == [0, 1, 2, 3, 4, 5]
+
+
+def test_segmented_store_continues_from_its_index_after_a_restart(tmp_path):
+    logger = logging.getLogger("test_storage")
+    store = SegmentedThreadStore("a", tmp_path, logger, max_segment_bytes=1)
+    store.save_thread(1, make_thread(1, 2))
+    store.save_thread(2, make_thread(2))
+    segment_path = store.get_segment_path()
+    # a crash while the index was written
+    with open(segment_path / "index.jsonl", "a") as index_file:
+        index_file.write('{"thread_id": "2", "segm')
+
+    store = SegmentedThreadStore("a", tmp_path, logger, max_segment_bytes=1)
+    store.save_thread(1, RawJson(json.dumps(make_thread(1, 2, 3)).encode("utf-8")))
+    assert store.append_posts(2, {"no": 2}, [{"no": 4, "resto": 2}])
+    assert not store.append_posts(5, {"no": 5}, [{"no": 6, "resto": 5}])
+
+    # every capture went into a new segment, none was overwritten
+    assert len(list(segment_path.glob("segment_*.jsonl.gz"))) == 4
+    store = SegmentedThreadStore("a", tmp_path, logger)
+    assert [post["no"] for post in store.read_thread(1)["posts"]] == [1, 2, 3]
+    assert [post["no"] for post in store.read_thread(2)["posts"]] == [2, 4]
+    assert store.read_thread(1, day="2000_01_01") is None
+
+
+def test_segments_are_valid_compressed_streams(tmp_path):
+    store = SegmentedThreadStore("a", tmp_path, logging.getLogger("test_storage"), compression="lzma")
+    store.save_thread(1, make_thread(1, 2))
+    store.save_thread(1, make_thread(1, 2, 3))
+    segment_file, = store.get_segment_path().glob("segment_*.jsonl.xz")
+    with lzma.open(segment_file, "rt") as infile:
+        records = [json.loads(line) for line in infile]
+    assert [len(record["content"]["posts"]) for record in records] == [2, 3]
+    assert store.read_thread(1) == records[-1]["content"]
+
+
+def test_thread_files_of_every_kind_read_as_thread_contents(tmp_path):
+    logger = logging.getLogger("test_storage")
+    store = AppendOnlyThreadStore("a", tmp_path, logger)
+    store.save_thread(1, make_thread(1, 2, 3))
+    store.save_thread(1, make_thread(1, 3, 4))
+    log_file = store.get_thread_log_file(1)
+    with open(log_file, "a") as outfile:
+        outfile.write('{"event": "post", "post": {"no": 5')
+    # the deleted post is kept, the half written line is skipped
+    assert [[post["no"] for post in thread["posts"]] for thread in read_thread_file(log_file, "log")] == [[1, 2, 3, 4]]
+
+    segmented_store = SegmentedThreadStore("a", tmp_path, logger, compression="lzma")
+    segmented_store.save_thread(1, make_thread(1, 2))
+    segmented_store.save_thread(6, make_thread(6))
+    segment_file, = (tmp_path / "segments").glob("*/a/segment_*.jsonl.xz")
+    assert [thread["posts"][0]["no"] for thread in read_thread_file(segment_file, "segment")] == [1, 6]
+
+    snapshot_file = tmp_path / "1.json"
+    snapshot_file.write_text(json.dumps(make_thread(1, 2)))
+    assert list(read_thread_file(snapshot_file, "thread")) == [make_thread(1, 2)]
+    # a snapshot caught while it is replaced
+    snapshot_file.write_text(json.dumps(make_thread(1, 2))[:10])
+    assert list(read_thread_file(snapshot_file, "thread")) == []
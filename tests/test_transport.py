@@ -0,0 +1,38 @@
+import socket
+import time
+import pytest
+import requests
+from transport import Transport
+from utils import get_argparser
+
+
+def test_a_stalled_connection_times_out():
+    # accepts connections but never answers
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    transport = Transport(f"http://127.0.0.1:{server.getsockname()[1]}", timeout=(1, 0.5))
+    try:
+        start_time = time.monotonic()
+        with pytest.raises(requests.Timeout):
+            transport.get(transport.endpoints.board_list(), "board_list")
+        assert time.monotonic() - start_time < 5
+    finally:
+        transport.close()
+        server.close()
+
+
+def test_requests_have_a_timeout_by_default():
+    connect_timeout, read_timeout = Transport().timeout
+    assert 0 < connect_timeout < float("inf")
+    assert 0 < read_timeout < float("inf")
+
+
+def test_timeout_flags_take_fractions_of_a_second(capsys):
+    argparser = get_argparser()
+    args = argparser.parse_args(["--connect-timeout", "0.5", "--read-timeout", "2.5"])
+    assert (args.connect_timeout, args.read_timeout) == (0.5, 2.5)
+
+    with pytest.raises(SystemExit):
+        argparser.parse_args(["--read-timeout", "0"])
+    assert "argument --read-timeout: timeout should be above 0 seconds" in capsys.readouterr().err
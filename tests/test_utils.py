@@ -0,0 +1,36 @@
+import logging
+import threading
+from utils import SamplingFilter
+
+
+def make_record(message, level=logging.DEBUG, created=1000.0):
+    record = logging.LogRecord("test_utils", level, __file__, 1, message, None, None)
+    record.created = created
+    return record
+
+
+def test_repeated_debug_messages_are_sampled_per_window():
+    sampling_filter = SamplingFilter(sample_every=10, burst=5, interval=60)
+    passed = [sampling_filter.filter(make_record("Thread %s", created=1000.0 + i * 0.01)) for i in range(50)]
+    # the burst, then every 10th
+    assert [i + 1 for i, passed_record in enumerate(passed) if passed_record] == [1, 2, 3, 4, 5, 10, 20, 30, 40, 50]
+    assert sampling_filter.filter(make_record("Other %s", created=1001.0))
+    assert all(sampling_filter.filter(make_record("Thread %s", logging.INFO, created=1001.0)) for _ in range(20))
+    # a new window starts with a new burst
+    assert sampling_filter.filter(make_record("Thread %s", created=1061.0))
+
+
+def test_counts_are_not_lost_between_logging_threads():
+    sampling_filter = SamplingFilter(sample_every=7, burst=10, interval=3600)
+    passed_counts = []
+
+    def log_many():
+        passed_counts.append(sum(sampling_filter.filter(make_record("Thread %s")) for _ in range(5000)))
+
+    threads = [threading.Thread(target=log_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the same records as from a single thread
+    assert sum(passed_counts) == sum(1 for count in range(1, 8 * 5000 + 1) if count <= 10 or count % 7 == 0)